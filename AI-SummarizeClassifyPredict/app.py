@@ -3,23 +3,36 @@ import boto3
 import psycopg2
 import requests
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
-import PyPDF2
-import io
 import os
 from dotenv import load_dotenv
 import logging
-import pickle
 import time  # Add this import
 import re  # Add this import
 import plotly.express as px
 import pandas as pd  # Add this import
-from datetime import datetime
+from datetime import datetime, timezone
 import uuid
 import json
 from streamlit import session_state
-from docx import Document  # Add this import
+from s3_inventory import S3Inventory, SUPPORTED_EXTENSIONS
+from uploads import DirectUploader
+from text_cache import ExtractedTextCache, join_pages
+from extractors import extract_pages
+from vector_index import VectorIndex
+from llm_scheduler import BACKGROUND, BATCH, INTERACTIVE, RequestScheduler
+from single_flight import SingleFlight, request_fingerprint
+from resilience import CircuitBreaker, CircuitOpenError, Hedger
+from projection import PCAProjection
+from map_reduce import MapReduceSummarizer, SummaryCache
+from classification import InvalidClassification, LabelSet, ZeroShotClassifier, mean_pool
+from representative import select_representatives
+from corpus_events import CorpusWatcher
+from warmup import Warmup, serve_readiness
+from corpus_collections import (
+    DEFAULT_COLLECTION, VECTOR_SPACES, active_rows_clause, build_index_version, collection_signature, create_collection_tables,
+    list_collections, load_collection_state, session_collection, validate_collection, vector_space
+)
 
 # Load environment variables
 load_dotenv()
@@ -42,6 +55,56 @@ POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
 MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
 MISTRAL_API_ENDPOINT = "https://api.mistral.ai/v1/chat/completions"
 MISTRAL_EMBED_API_ENDPOINT = "https://api.mistral.ai/v1/embeddings"
+INDEX_QUANTIZATION = os.getenv('INDEX_QUANTIZATION', 'none')  # none, int8 or binary
+EMBEDDING_PROJECTION_DIM = int(os.getenv('EMBEDDING_PROJECTION_DIM', '0'))  # 0 disables PCA projection
+PROJECTION_RESCORE = os.getenv('PROJECTION_RESCORE', 'true').lower() == 'true'
+
+# Queries are short, so batch retrieval embeds many of them per request
+QUERY_EMBED_BATCH_SIZE = int(os.getenv('QUERY_EMBED_BATCH_SIZE', '128'))
+
+# MMR re-ranking of retrieved chunks: 1.0 ranks by relevance only, lower values favour diversity
+RETRIEVAL_MMR_LAMBDA = float(os.getenv('RETRIEVAL_MMR_LAMBDA', '0.7'))
+MMR_CANDIDATE_FACTOR = int(os.getenv('MMR_CANDIDATE_FACTOR', '4'))
+
+# Outbound Mistral calls share these slots; batch and background work can't take all of them
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv('MAX_CONCURRENT_LLM_CALLS', '4'))
+MAX_BATCH_LLM_CALLS = int(os.getenv('MAX_BATCH_LLM_CALLS', '3'))
+MAX_BACKGROUND_LLM_CALLS = int(os.getenv('MAX_BACKGROUND_LLM_CALLS', '2'))
+
+# Timeouts (seconds) for Mistral requests, so a stalled connection can't hang a session
+MISTRAL_CONNECT_TIMEOUT = float(os.getenv('MISTRAL_CONNECT_TIMEOUT', '5'))
+MISTRAL_READ_TIMEOUT = float(os.getenv('MISTRAL_READ_TIMEOUT', '60'))
+MISTRAL_EMBED_READ_TIMEOUT = float(os.getenv('MISTRAL_EMBED_READ_TIMEOUT', '30'))
+# Consecutive failures before an endpoint's circuit opens, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', '30'))
+# Embedding requests still unanswered after this long (until a p95 is observed) are sent again
+EMBED_HEDGE_DELAY = float(os.getenv('EMBED_HEDGE_DELAY', '2'))
+
+# Per-chunk metadata columns usable as retrieval filters
+METADATA_COLUMNS = ('document_key', 'file_type', 'uploaded_at', 'collection')
+ADDITIONAL_CONTEXT_KEY = 'additional_context'
+
+# Resident indexes kept per process, one per recently analyzed collection
+COLLECTION_INDEX_CACHE_SIZE = int(os.getenv('COLLECTION_INDEX_CACHE_SIZE', '8'))
+# Previous index versions of each collection kept for rollback after a rebuild
+INDEX_VERSIONS_RETAINED = int(os.getenv('INDEX_VERSIONS_RETAINED', '1'))
+# Collections whose indexes are loaded in the background when the process starts
+WARM_START_COLLECTIONS = [name.strip() for name in os.getenv('WARM_START_COLLECTIONS', 'default').split(',') if name.strip()]
+# How long warm-up waits for the change listener, so it loads the indexes under the keys queries will use
+WARM_START_LISTENER_WAIT = float(os.getenv('WARM_START_LISTENER_WAIT', '10'))
+# Port of the GET /ready probe, which returns 503 until warm-up finishes; unset disables it
+WARM_START_READY_PORT = os.getenv('WARM_START_READY_PORT')
+
+# Map-reduce summarization over whole document sets
+MAP_REDUCE_MAX_WORKERS = int(os.getenv('MAP_REDUCE_MAX_WORKERS', '4'))
+MISTRAL_REQUESTS_PER_SECOND = float(os.getenv('MISTRAL_REQUESTS_PER_SECOND', '2'))
+REDUCE_TOKEN_BUDGET = int(os.getenv('REDUCE_TOKEN_BUDGET', '6000'))
+PARTIAL_SUMMARY_MAX_TOKENS = int(os.getenv('PARTIAL_SUMMARY_MAX_TOKENS', '300'))
+
+# Embedding classifier confidence below which a document is sent to the LLM instead
+ZERO_SHOT_CONFIDENCE_THRESHOLD = float(os.getenv('ZERO_SHOT_CONFIDENCE_THRESHOLD', '0.5'))
+CLASSIFY_MAX_CHARS = int(os.getenv('CLASSIFY_MAX_CHARS', '8000'))
 
 # Initialize S3 Client
 s3_client = boto3.client(
@@ -51,6 +114,98 @@ s3_client = boto3.client(
     region_name=AWS_REGION
 )
 
+# Shared S3 listing cache (survives Streamlit reruns)
+@st.cache_resource
+def get_s3_inventory():
+    return S3Inventory(s3_client, S3_BUCKET_NAME, ttl=int(os.getenv('S3_INVENTORY_TTL', '60')))
+
+@st.cache_resource
+def get_uploader():
+    return DirectUploader(s3_client, S3_BUCKET_NAME, get_s3_inventory())
+
+# One scheduler per process, shared by every session
+@st.cache_resource
+def get_request_scheduler():
+    return RequestScheduler(
+        MAX_CONCURRENT_LLM_CALLS,
+        {BATCH: MAX_BATCH_LLM_CALLS, BACKGROUND: MAX_BACKGROUND_LLM_CALLS}
+    )
+
+# Identical Mistral requests in flight at the same time share one upstream call
+@st.cache_resource
+def get_single_flight():
+    return SingleFlight()
+
+@st.cache_resource
+def get_circuit_breaker(endpoint):
+    return CircuitBreaker(endpoint, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+
+@st.cache_resource
+def get_hedger():
+    return Hedger(default_delay=EMBED_HEDGE_DELAY)
+
+def open_circuits():
+    """Mistral endpoints currently failing fast; non-empty means the app runs in degraded mode."""
+    return [
+        endpoint for endpoint in (MISTRAL_API_ENDPOINT, MISTRAL_EMBED_API_ENDPOINT)
+        if get_circuit_breaker(endpoint).is_open
+    ]
+
+def show_degraded_mode():
+    """Warn that calls to a failing Mistral endpoint are being skipped until it recovers."""
+    circuits = open_circuits()
+    if MISTRAL_API_ENDPOINT in circuits:
+        st.warning("Degraded mode: Mistral text generation is failing, so requests are rejected immediately "
+                   "until it recovers.")
+    if MISTRAL_EMBED_API_ENDPOINT in circuits:
+        st.warning("Degraded mode: Mistral embeddings are failing, so Mistral-Embed processing and retrieval "
+                   "are unavailable until it recovers. TF-IDF still works.")
+
+def post_mistral(endpoint, headers, data, priority=INTERACTIVE, session=None, hedge=False):
+    """POST to Mistral in a scheduler slot; overlapping identical requests of the same priority are sent once.
+    
+    Raises CircuitOpenError without calling the endpoint while its circuit is open. Set hedge only
+    for idempotent requests.
+    """
+    scheduler = get_request_scheduler()
+    breaker = get_circuit_breaker(endpoint)
+    read_timeout = MISTRAL_EMBED_READ_TIMEOUT if endpoint == MISTRAL_EMBED_API_ENDPOINT else MISTRAL_READ_TIMEOUT
+    
+    def send():
+        return requests.post(endpoint, headers=headers, json=data, timeout=(MISTRAL_CONNECT_TIMEOUT, read_timeout))
+    
+    hedger = get_hedger() if hedge else None
+    
+    def attempt():
+        # Hedge inside the slot, so the hedge delay and latency samples cover only the HTTP call
+        # and a request still queueing locally never fires a duplicate
+        with scheduler.slot(priority, session):
+            return hedger.call(send) if hedger else send()
+    return get_single_flight().do(
+        # Keyed by priority too, so an interactive caller never waits behind a background slot
+        request_fingerprint(endpoint, data, priority),
+        lambda: breaker.call(attempt, is_failure=lambda response: response.status_code >= 500)
+    )
+
+def current_session_id():
+    """Fair-queuing key for the calling Streamlit session (worker threads have none)."""
+    try:
+        return st.session_state.setdefault('session_id', str(uuid.uuid4()))
+    except Exception:
+        return None
+
+@st.cache_resource
+def get_text_cache():
+    return ExtractedTextCache(
+        os.getenv('TEXT_CACHE_DIR', '.text_cache'),
+        max_bytes=int(os.getenv('TEXT_CACHE_MAX_MB', '512')) * 1024 * 1024
+    )
+
+# Per-chunk and merge summaries, reused across reruns and summary styles
+@st.cache_resource
+def get_summary_cache():
+    return SummaryCache(max_entries=int(os.getenv('SUMMARY_CACHE_MAX_ENTRIES', '10000')))
+
 # Initialize PostgreSQL Connection
 def get_db_connection():
     try:
@@ -66,12 +221,26 @@ def get_db_connection():
         logger.error(f"Database connection error: {str(e)}")
         raise
 
+# One change listener per process; indexes are cached by the generations it tracks
+@st.cache_resource
+def get_corpus_watcher():
+    return CorpusWatcher(get_db_connection).start()
+
 conn = get_db_connection()
 cur = conn.cursor()
 
 # Initialize database tables
+@st.cache_resource
 def initialize_database():
-    """Initialize database tables with proper error handling."""
+    """Create and migrate the tables once per process.
+    
+    Reruns skip it: ALTER TABLE locks embeddings exclusively, so running it on every rerun would
+    queue each interaction behind any ingest in progress. A failed attempt is not cached and is
+    retried on the next run.
+    """
+    # Own connection, since the cached call outlives the run that made it
+    conn = get_db_connection()
+    cur = conn.cursor()
     try:
         # Create tables with IF NOT EXISTS clause
         cur.execute('''
@@ -82,6 +251,32 @@ def initialize_database():
             )
         ''')
         
+        cur.execute('''
+            ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS embedding_reduced FLOAT[]
+        ''')
+        
+        # Chunk metadata for filtered retrieval
+        cur.execute('''
+            ALTER TABLE embeddings
+                ADD COLUMN IF NOT EXISTS document_key TEXT,
+                ADD COLUMN IF NOT EXISTS file_type TEXT,
+                ADD COLUMN IF NOT EXISTS uploaded_at TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS collection TEXT DEFAULT 'default'
+        ''')
+        for column in METADATA_COLUMNS:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS embeddings_{column}_idx ON embeddings ({column})")
+        
+        # Single-corpus state from before collections; adopted by the default collection
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS projection_state (
+                id INTEGER PRIMARY KEY,
+                projection BYTEA,
+                source_dimension INTEGER,
+                reduced_dimension INTEGER,
+                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
         cur.execute('''
             CREATE TABLE IF NOT EXISTS model_state (
                 id INTEGER PRIMARY KEY,
@@ -90,6 +285,8 @@ def initialize_database():
             )
         ''')
         
+        create_collection_tables(cur)
+        
         # Ensure the tables were created successfully
         cur.execute("""
             SELECT EXISTS (
@@ -112,102 +309,81 @@ def initialize_database():
             
         conn.commit()
         logger.info("Database tables initialized successfully")
+        return True
         
     except Exception as e:
         logger.error(f"Database initialization error: {str(e)}")
         conn.rollback()
         raise
+    finally:
+        conn.close()
 
-# Modified vectorizer initialization with persistence
-@st.cache_resource
-def initialize_vectorizer(vectorizer_type):
-    try:
-        if (vectorizer_type == "TF-IDF"):
-            # Try to load fitted vectorizer from database
-            cur.execute("SELECT vectorizer FROM model_state WHERE id = 1")
-            result = cur.fetchone()
-            if result and result[0]:
-                vectorizer = pickle.loads(result[0])
-                st.success("Loaded previously fitted TF-IDF vectorizer")
-                return vectorizer, True
-            else:
-                vectorizer = TfidfVectorizer(
-                    max_features=100,
-                    stop_words='english',
-                    lowercase=True,
-                    dtype=np.float32
-                )
-                return vectorizer, False
-        else:
-            # For Mistral-Embed, no need to load from database
-            return None, False
-    except Exception as e:
-        st.error(f"Error initializing vectorizer: {str(e)}")
-        if vectorizer_type == "TF-IDF":
-            vectorizer = TfidfVectorizer(
-                max_features=100,
-                stop_words='english',
-                lowercase=True,
-                dtype=np.float32
-            )
-            return vectorizer, False
-        else:
-            return None, False
+def new_tfidf_vectorizer():
+    return TfidfVectorizer(
+        max_features=100,
+        stop_words='english',
+        lowercase=True,
+        dtype=np.float32
+    )
 
-def extract_text_from_pdf(pdf_content):
-    """Extract text from PDF binary content."""
-    try:
-        pdf_file = io.BytesIO(pdf_content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        logger.error(f"PDF extraction error: {str(e)}")
-        return None
+@st.cache_resource(max_entries=COLLECTION_INDEX_CACHE_SIZE)
+def load_collection_vectorizer(collection, signature):
+    """Fitted TF-IDF vectorizer of a collection's TF-IDF space as of signature, or None."""
+    # Own cursor, since this may also run on the warm-up thread
+    with conn.cursor() as state_cur:
+        state = load_collection_state(state_cur, collection, vector_space("TF-IDF"))
+    return state['vectorizer'] if state else None
 
-def extract_text_from_docx(docx_content):
-    """Extract text from DOCX binary content."""
-    try:
-        doc = Document(io.BytesIO(docx_content))
-        text = []
-        for paragraph in doc.paragraphs:
-            text.append(paragraph.text)
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    text.append(cell.text)
-        return '\n'.join(text)  # Fixed the string literal syntax error here
-    except Exception as e:
-        logger.error(f"DOCX extraction error: {str(e)}")
+def get_vectorizer(collection=DEFAULT_COLLECTION):
+    return load_collection_vectorizer(collection, get_corpus_signature(collection, "TF-IDF"))
+
+def extract_document_text(document_key, document_content, etag=None):
+    """Extract text from document bytes, reusing the cached extraction for this key and ETag."""
+    cached = get_text_cache().get(document_key, etag)
+    if cached:
+        return cached[0]
+    
+    pages = extract_pages(document_key, document_content)
+    if pages is None:
         return None
+    text, page_offsets = join_pages(pages)
+    get_text_cache().put(document_key, etag, text, page_offsets)
+    return text
 
-def load_document_from_s3(bucket_name, document_key):
+def load_document_from_s3(bucket_name, document_key, etag=None):
     """Load document from S3 and handle multiple document types."""
     try:
+        # Skip the download entirely when this version was already extracted
+        cached = get_text_cache().get(document_key, etag)
+        if cached:
+            return cached[0]
+        
         response = s3_client.get_object(Bucket=bucket_name, Key=document_key)
+        etag = response['ETag'].strip('"')
+        cached = get_text_cache().get(document_key, etag)
+        if cached:
+            response['Body'].close()
+            return cached[0]
+        
         document_content = response['Body'].read()
         
         # Log document details for debugging
         logger.info(f"Loading document: {document_key}, Size: {len(document_content)} bytes")
         
-        file_extension = document_key.lower().split('.')[-1]
-        
-        if file_extension == 'pdf':
-            return extract_text_from_pdf(document_content)
-        elif file_extension in ['docx', 'doc']:
-            return extract_text_from_docx(document_content)
-        else:
-            try:
-                return document_content.decode('utf-8')
-            except UnicodeDecodeError:
-                return document_content.decode('latin-1')
+        return extract_document_text(document_key, document_content, etag)
     except Exception as e:
         logger.error(f"Error loading document from S3: {str(e)}")
         st.error(f"Error loading document {document_key}: {str(e)}")
         return None
 
+def load_document(document_key, etag=None):
+    """Load document text, reusing bytes uploaded in this session instead of downloading them again."""
+    uploaded = st.session_state.get('uploaded_documents', {}).get(document_key)
+    if uploaded and (etag is None or uploaded['etag'] == etag):
+        logger.info(f"Using uploaded bytes for {document_key}, Size: {len(uploaded['content'])} bytes")
+        return extract_document_text(document_key, uploaded['content'], uploaded['etag'])
+    return load_document_from_s3(S3_BUCKET_NAME, document_key, etag)
+
 def chunk_document_fixed_size(document, chunk_size=512, overlap=50):
     """Fixed-size chunking with sliding window."""
     if not document:
@@ -288,16 +464,20 @@ def chunk_document(document, chunking_strategy, chunk_size=512, overlap=50):
     else:
         return chunk_document_sentence(document)
 
-def call_mistral_embed_api(texts):
-    """Call Mistral Embed API to get embeddings."""
+def call_mistral_embed_api(texts, batch_size=5, priority=INTERACTIVE, session=None):
+    """Call Mistral Embed API to get embeddings, batch_size texts per request.
+
+    Each request waits for a scheduler slot in its priority class, so ingestion yields to queries
+    between batches.
+    """
+    session = session or current_session_id()
     try:
         # Ensure texts are non-empty and properly formatted
         texts = [text[:8000] for text in texts if text.strip()]  # Limit text length to 8000 chars
         if not texts:
             raise ValueError("No valid texts provided for embedding.")
         
-        # Process in smaller batches with delay between calls
-        batch_size = 5  # Reduced batch size
+        # Process in batches with delay between calls
         all_embeddings = []
         
         for i in range(0, len(texts), batch_size):
@@ -320,7 +500,7 @@ def call_mistral_embed_api(texts):
             
             for retry in range(max_retries):
                 try:
-                    response = requests.post(MISTRAL_EMBED_API_ENDPOINT, headers=headers, json=data)
+                    response = post_mistral(MISTRAL_EMBED_API_ENDPOINT, headers, data, priority, session, hedge=True)
                     
                     if response.status_code == 429:  # Too Many Requests
                         wait_time = int(response.headers.get('Retry-After', retry_delay * (retry + 1)))
@@ -340,12 +520,16 @@ def call_mistral_embed_api(texts):
                     if response.status_code != 429 or retry == max_retries - 1:
                         raise
                 
+                except CircuitOpenError:
+                    raise
+                
                 except Exception as e:
                     if retry == max_retries - 1:
                         raise
             
             # Add delay between batches to avoid rate limits
-            time.sleep(1)  # 1 second delay between batches
+            if i + batch_size < len(texts):
+                time.sleep(1)  # 1 second delay between batches
             
         return all_embeddings
         
@@ -359,105 +543,221 @@ def call_mistral_embed_api(texts):
         st.error(f"Mistral Embed API error: {str(e)}")
         return []
 
-def store_embeddings(chunks, vectorizer_type):
-    """Store document chunks and their embeddings with vectorizer persistence."""
+def fit_projection(embeddings):
+    """Fit a PCA projection for this corpus; returns (projection or None, reduced vector per embedding)."""
+    if not EMBEDDING_PROJECTION_DIM or not embeddings or len(embeddings[0]) <= EMBEDDING_PROJECTION_DIM:
+        return None, [None] * len(embeddings)
+    
+    projection = PCAProjection.fit(embeddings, EMBEDDING_PROJECTION_DIM)
+    logger.info(f"Fitted PCA projection {projection.source_dimension} -> {projection.dimension} dims")
+    return projection, projection.transform(embeddings).tolist()
+
+def chunk_metadata(document_key, uploaded_at=None, collection=DEFAULT_COLLECTION):
+    """Filterable metadata stored alongside each chunk of a document."""
+    # Stored as naive UTC so it compares directly with the TIMESTAMP column
+    uploaded_at = uploaded_at or datetime.now(timezone.utc)
+    if uploaded_at.tzinfo is not None:
+        uploaded_at = uploaded_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return {
+        'document_key': document_key,
+        'file_type': document_key.lower().split('.')[-1] if '.' in document_key else None,
+        'uploaded_at': uploaded_at,
+        'collection': collection
+    }
+
+def insert_chunk(cursor, chunk, embedding, reduced, metadata, version):
+    metadata = metadata or {}
+    cursor.execute("""
+        INSERT INTO embeddings (chunk, embedding, embedding_reduced, document_key, file_type, uploaded_at, collection,
+                                index_version)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (
+        chunk, embedding, reduced,
+        metadata.get('document_key'), metadata.get('file_type'),
+        metadata.get('uploaded_at'), metadata.get('collection', DEFAULT_COLLECTION), version
+    ))
+
+def store_embeddings(chunks, vectorizer_type, metadata=None, collection=DEFAULT_COLLECTION):
+    """Replace a collection's chunks, embeddings and vectorizer state.
+    
+    metadata is either one chunk_metadata() dict for all chunks or a list with one per chunk.
+    The new contents are built as a new index version beside the active one, which keeps serving
+    until the cutover; other collections (and concurrent ingests into them) are unaffected.
+    """
     try:
         if not chunks:
             raise ValueError("No chunks provided for embedding")
+        if not isinstance(metadata, list):
+            metadata = [metadata] * len(chunks)
         
-        # Clear existing embeddings
-        cur.execute("DELETE FROM embeddings")
-        conn.commit()
-        
-        # Filter out empty chunks
-        valid_chunks = [chunk for chunk in chunks if chunk and chunk.strip()]
+        # Filter out empty chunks, keeping each chunk's metadata alongside it
+        valid = [(chunk, chunk_info) for chunk, chunk_info in zip(chunks, metadata) if chunk and chunk.strip()]
+        valid_chunks = [chunk for chunk, _ in valid]
         if not valid_chunks:
             raise ValueError("No valid text content found in chunks")
         
         if vectorizer_type == "TF-IDF":
-            # Combine all chunks to fit vectorizer
-            all_text = " ".join(valid_chunks)
-            
-            # Fit the vectorizer and store it
-            vectorizer.fit([all_text])
-            vectorizer_binary = pickle.dumps(vectorizer)
-            
-            # Store or update the vectorizer in the database
-            cur.execute("""
-                INSERT INTO model_state (id, vectorizer)
-                VALUES (1, %s)
-                ON CONFLICT (id) 
-                DO UPDATE SET vectorizer = EXCLUDED.vectorizer, last_updated = CURRENT_TIMESTAMP
-            """, (vectorizer_binary,))
-            
-            successful_inserts = 0
-            failed_inserts = 0
-            
-            for chunk in valid_chunks:
-                if not chunk.strip():
-                    continue
-                    
-                embedding = vectorizer.transform([chunk]).toarray()[0].tolist()
-                try:
-                    cur.execute(
-                        "INSERT INTO embeddings (chunk, embedding) VALUES (%s, %s)",
-                        (chunk, embedding)
-                    )
-                    successful_inserts += 1
-                except Exception as e:
-                    failed_inserts += 1
-                    st.error(f"Failed to insert chunk: {str(e)}")
-            
-            conn.commit()
-            st.success(f"Successfully processed {successful_inserts} chunks")
-            if failed_inserts > 0:
-                st.warning(f"Failed to process {failed_inserts} chunks")
-            
-            return True
+            # Fit on the whole collection, then embed every chunk
+            vectorizer = new_tfidf_vectorizer()
+            vectorizer.fit([" ".join(valid_chunks)])
+            embeddings = [vectorizer.transform([chunk]).toarray()[0].tolist() for chunk in valid_chunks]
         else:
+            vectorizer = None
             # Use Mistral-Embed API to get embeddings
-            embeddings = call_mistral_embed_api(valid_chunks)
-            if not embeddings:
+            embeddings = call_mistral_embed_api(valid_chunks, priority=BACKGROUND)
+            if len(embeddings) != len(valid_chunks):
                 st.error("Failed to get embeddings from Mistral-Embed API")
                 return False
-            
-            successful_inserts = 0
-            failed_inserts = 0
-            
-            for chunk, embedding in zip(valid_chunks, embeddings):
-                if not chunk.strip():
-                    continue
-                try:
-                    cur.execute(
-                        "INSERT INTO embeddings (chunk, embedding) VALUES (%s, %s)",
-                        (chunk, embedding)
-                    )
-                    successful_inserts += 1
-                except Exception as e:
-                    failed_inserts += 1
-                    st.error(f"Failed to insert chunk: {str(e)}")
-            
-            conn.commit()
-            st.success(f"Successfully processed {successful_inserts} chunks")
-            if failed_inserts > 0:
-                st.warning(f"Failed to process {failed_inserts} chunks")
-            
-            # Store embeddings as numpy array in session state
-            if embeddings:
-                st.session_state.current_embeddings = np.array(embeddings)
-            
-            return True
         
+        # Every version is one fixed-dimension vector space
+        dimension = len(embeddings[0])
+        if any(len(embedding) != dimension for embedding in embeddings):
+            raise ValueError(f"{vectorizer_type} returned embeddings of different dimensions")
+        
+        # Embed every chunk first so the optional projection is fitted on the whole corpus
+        projection, reduced_embeddings = fit_projection(embeddings)
+    except Exception as e:
+        st.error(f"Error in store_embeddings: {str(e)}")
+        return False
+    
+    def write_chunks(ingest_cur, version):
+        for (chunk, chunk_info), embedding, reduced in zip(valid, embeddings, reduced_embeddings):
+            insert_chunk(ingest_cur, chunk, embedding, reduced, {**(chunk_info or {}), 'collection': collection}, version)
+    
+    ingest_conn = get_db_connection()
+    try:
+        version = build_index_version(
+            ingest_conn, collection, vectorizer_type, dimension, write_chunks, vectorizer, projection,
+            INDEX_VERSIONS_RETAINED
+        )
     except Exception as e:
         st.error(f"Error in store_embeddings: {str(e)}")
-        conn.rollback()
         return False
+    finally:
+        ingest_conn.close()
+    
+    st.success(f"Successfully processed {len(embeddings)} chunks into collection '{collection}' (version {version})")
+    if vectorizer_type != "TF-IDF":
+        # Store embeddings as numpy array in session state
+        st.session_state.current_embeddings = np.array(embeddings)
+    return True
 
-def retrieve_relevant_chunks(query, vectorizer_type, top_k=5):
-    """Retrieve relevant chunks using cosine similarity."""
+def get_corpus_signature(collection=DEFAULT_COLLECTION, vectorizer_type=None):
+    """Cheap fingerprint of a collection's vector space, used to know when to rebuild its index.
+    
+    It comes from the change listener without touching the database, or from the database while
+    the listener is disconnected. vectorizer_type selects the space; None means the most recently built one.
+    """
+    token = get_corpus_watcher().token(collection)
+    if token is not None:
+        return token
+    with conn.cursor() as signature_cur:
+        return collection_signature(signature_cur, collection, vector_space(vectorizer_type))
+
+@st.cache_resource(max_entries=COLLECTION_INDEX_CACHE_SIZE)
+def load_vector_index(collection, vectorizer_type, signature, mode):
+    """Build the resident retrieval index for the active version of one vector space of a collection."""
+    started = time.perf_counter()
+    # Own cursor, since this may also run on the warm-up thread
+    with conn.cursor() as index_cur:
+        state = load_collection_state(index_cur, collection, vector_space(vectorizer_type))
+        # A version holds one space, so its rows form a homogeneous matrix; rows of another dimension
+        # can only come from data stored before spaces were recorded and are left out here
+        index_cur.execute("""
+            SELECT id, chunk, embedding, embedding_reduced, document_key, file_type, uploaded_at, collection
+            FROM embeddings
+            WHERE collection = %s AND index_version = %s AND array_length(embedding, 1) = %s AND chunk <> ''
+            ORDER BY id
+        """, (collection, state and state['version'], state and state['dimension']))
+        rows = index_cur.fetchall()
+    
+    # Use the projection fitted at ingest so queries are reduced with the same matrix
+    reduced_vectors = None
+    projection = state['projection'] if state else None
+    if projection is not None and rows:
+        if projection.source_dimension != state['dimension']:
+            projection = None
+        elif all(row[3] and len(row[3]) == projection.dimension for row in rows):
+            reduced_vectors = [row[3] for row in rows]
+    
+    index = VectorIndex(
+        [row[0] for row in rows],
+        [row[1] for row in rows],
+        [row[2] for row in rows],
+        mode=mode,
+        projection=projection,
+        reduced_vectors=reduced_vectors,
+        rescore=PROJECTION_RESCORE,
+        metadata={
+            column: [row[position] for row in rows]
+            for position, column in enumerate(METADATA_COLUMNS, start=4)
+        }
+    )
+    logger.info(f"Loaded {len(index)} {vectorizer_type or 'latest'} chunks of '{collection}' into {mode} index "
+                f"in {time.perf_counter() - started:.1f}s ({index.memory_bytes() / 1024 / 1024:.1f} MB resident)")
+    return index
+
+def warm_collection_index(collection, vectorizer_type):
+    """Load one vector space's index (and TF-IDF vectorizer) into the shared cache; returns its chunk count."""
+    index = load_vector_index(
+        collection, vectorizer_type, get_corpus_signature(collection, vectorizer_type), INDEX_QUANTIZATION
+    )
+    if vectorizer_type == "TF-IDF":
+        get_vectorizer(collection)
+    return len(index)
+
+@st.cache_resource
+def get_warmup():
+    """Preloads WARM_START_COLLECTIONS once per process; every session then shares the resident indexes."""
+    def plan():
+        if not get_corpus_watcher().wait_connected(WARM_START_LISTENER_WAIT):
+            logger.warning("Warming up without the change listener; indexes may load again once it connects")
+        return [
+            (f"{collection}/{vectorizer_type}", lambda c=collection, v=vectorizer_type: warm_collection_index(c, v))
+            for collection in WARM_START_COLLECTIONS
+            for vectorizer_type in VECTOR_SPACES
+        ]
+    return Warmup(plan).start()
+
+@st.cache_resource
+def get_readiness_server():
+    """GET /ready on WARM_START_READY_PORT for the deployment's readiness probe; Streamlit's own health check doesn't wait for warm-up."""
+    return serve_readiness(get_warmup(), int(WARM_START_READY_PORT))
+
+def build_filter_clause(filters, collection=None, space=None):
+    """Translate retrieval filters (and the collection) into a SQL WHERE clause on the indexed metadata columns.
+    
+    Rows come from the collection's active version in space (see active_rows_clause).
+    """
+    predicates = []
+    params = []
+    if collection is not None:
+        active_rows, active_params = active_rows_clause(collection, space)
+        predicates.append(active_rows)
+        params.extend(active_params)
+    for name, column in (('document_keys', 'document_key'), ('file_types', 'file_type'), ('collections', 'collection')):
+        if (filters or {}).get(name) is not None:
+            predicates.append(f"{column} = ANY(%s)")
+            params.append(list(filters[name]))
+    if (filters or {}).get('uploaded_after') is not None:
+        predicates.append("uploaded_at >= %s")
+        params.append(filters['uploaded_after'])
+    if (filters or {}).get('uploaded_before') is not None:
+        predicates.append("uploaded_at <= %s")
+        params.append(filters['uploaded_before'])
+    return ("WHERE " + " AND ".join(predicates) if predicates else ""), params
+
+def retrieve_relevant_chunks(query, vectorizer_type, top_k=5, filters=None, collection=DEFAULT_COLLECTION):
+    """Retrieve relevant chunks of one collection using cosine similarity.
+    
+    filters (document_keys, file_types, uploaded_after, uploaded_before) restrict the candidate
+    rows before scoring.
+    """
     try:
-        # Verify embeddings exist
-        cur.execute("SELECT COUNT(*) FROM embeddings")
+        # Verify embeddings exist in the space being queried
+        space = vector_space(vectorizer_type)
+        active_rows, active_params = active_rows_clause(collection, space)
+        cur.execute(f"SELECT COUNT(*) FROM embeddings WHERE {active_rows}", active_params)
         count = cur.fetchone()[0]
         if count == 0:
             st.error("No embeddings found. Please process documents first.")
@@ -465,99 +765,128 @@ def retrieve_relevant_chunks(query, vectorizer_type, top_k=5):
         
         # For empty query, return most recent chunks
         if not query.strip():
-            cur.execute("SELECT chunk FROM embeddings ORDER BY id DESC LIMIT %s", (top_k,))
+            where_clause, params = build_filter_clause(filters, collection, space)
+            cur.execute(f"SELECT chunk FROM embeddings {where_clause} ORDER BY id DESC LIMIT %s", (*params, top_k))
             chunks = cur.fetchall()
             return [{"chunk": chunk[0], "similarity": 1.0} for chunk in chunks]
         
-        if vectorizer_type == "TF-IDF":
-            if not hasattr(vectorizer, 'vocabulary_'):
-                st.error("Vectorizer not fitted! Please initialize document embeddings first.")
-                return []
-            
-            # Generate query embedding
-            query_embedding = vectorizer.transform([query]).toarray()[0].tolist()
-        else:
-            # Use Mistral-Embed API to get query embedding
-            query_embeddings = call_mistral_embed_api([query])
-            if not query_embeddings:
-                return []
-            query_embedding = query_embeddings[0]
-        
-        # Fetch all embeddings
-        cur.execute("SELECT chunk, embedding FROM embeddings")
-        rows = cur.fetchall()
-        
-        if not rows:
-            st.warning("No embeddings found in database. Please initialize document embeddings first.")
-            return []
-        
-        # Split chunks and embeddings
-        chunks = []
-        embeddings = []
-        for row in rows:
-            if row[0] and row[1]:
-                chunks.append(row[0])
-                # Ensure embedding is a list of floats with consistent length
-                embedding = [float(x) for x in row[1]]
-                embeddings.append(embedding)
+        return retrieve_relevant_chunks_batch([query], vectorizer_type, top_k, filters, collection=collection)[0]
         
-        if not chunks:
-            st.warning("No valid chunks found in database")
-            return []
-        
-        # Ensure all embeddings have the same length
-        embedding_length = len(embeddings[0])
-        embeddings = [emb for emb in embeddings if len(emb) == embedding_length]
+    except Exception as e:
+        st.error(f"Error in retrieve_relevant_chunks: {str(e)}")
+        logger.error(f"Error retrieving chunks: {str(e)}")
+        return []
+
+def retrieve_relevant_chunks_batch(queries, vectorizer_type, top_k=5, filters=None, mmr_lambda=None,
+                                   collection=DEFAULT_COLLECTION):
+    """Retrieve relevant chunks for many queries at once.
+    
+    All queries are embedded together and scored against the index in blocks, which is far
+    faster than calling retrieve_relevant_chunks in a loop. Returns one result list per query
+    (empty for blank queries). filters apply to every query, as in retrieve_relevant_chunks.
+    Results are re-ranked with MMR (mmr_lambda, default RETRIEVAL_MMR_LAMBDA) so near-duplicate
+    chunks don't crowd out other passages.
+    """
+    mmr_lambda = RETRIEVAL_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    results = [[] for _ in queries]
+    try:
+        positions = [i for i, query in enumerate(queries) if query and query.strip()]
+        if not positions:
+            return results
+        texts = [queries[i] for i in positions]
         
-        # Convert to numpy array with explicit dtype
-        embeddings_array = np.array(embeddings, dtype=np.float32)
-        query_embedding_array = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+        # Search the resident index of the selected vectorizer's space; it is rebuilt only when that space changes
+        index = load_vector_index(
+            collection, vectorizer_type, get_corpus_signature(collection, vectorizer_type), INDEX_QUANTIZATION
+        )
+        if not len(index):
+            st.warning(
+                f"No {vectorizer_type} embeddings found for this collection. "
+                f"Please process the documents with {vectorizer_type} first."
+            )
+            return results
         
-        # Calculate similarities
-        similarities = cosine_similarity(query_embedding_array, embeddings_array)[0]
+        rows = index.filter_rows(filters)
+        if rows is not None and not len(rows):
+            st.warning("No chunks match the selected filters.")
+            return results
         
-        # Get top results
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
-        results = [{"chunk": chunks[i], "similarity": float(similarities[i])} for i in top_indices]
+        if vectorizer_type == "TF-IDF":
+            vectorizer = get_vectorizer(collection)
+            if vectorizer is None:
+                st.error("Vectorizer not fitted! Please initialize document embeddings first.")
+                return results
+            
+            # Generate query embeddings
+            query_embeddings = vectorizer.transform(texts).toarray()
+        else:
+            # Use Mistral-Embed API, many queries per request
+            query_embeddings = call_mistral_embed_api(texts, batch_size=QUERY_EMBED_BATCH_SIZE)
+            if len(query_embeddings) != len(texts):
+                return results
         
+        if mmr_lambda < 1:
+            matches = index.search_diverse(query_embeddings, top_k, mmr_lambda, MMR_CANDIDATE_FACTOR, rows=rows)
+        else:
+            matches = index.search(query_embeddings, top_k, rows=rows)
+        for position, query_matches in zip(positions, matches):
+            results[position] = [
+                {"chunk": index.chunks[row], "similarity": similarity} for row, similarity in query_matches
+            ]
         return results
         
     except Exception as e:
-        st.error(f"Error in retrieve_relevant_chunks: {str(e)}")
+        st.error(f"Error in retrieve_relevant_chunks_batch: {str(e)}")
         logger.error(f"Error retrieving chunks: {str(e)}")
-        return []
+        return results
+
+def call_mistral_completion(prompt, model, temperature, max_tokens, response_format=None, priority=INTERACTIVE,
+                            session=None):
+    """Call Mistral API, retrying on rate limits; raises on failure."""
+    headers = {
+        "Authorization": f"Bearer {MISTRAL_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+    if response_format:
+        data["response_format"] = response_format
+    max_retries = 3
+    retry_delay = 5  # seconds
+    session = session or current_session_id()
+    for retry in range(max_retries):
+        response = post_mistral(MISTRAL_API_ENDPOINT, headers, data, priority, session)
+        if response.status_code == 429 and retry < max_retries - 1:
+            wait_time = int(response.headers.get('Retry-After', retry_delay * (retry + 1)))
+            logger.warning(f"Rate limit hit, waiting {wait_time} seconds...")
+            time.sleep(wait_time)
+            continue
+        response.raise_for_status()
+        return response.json().get("choices", [{}])[0].get("message", {}).get("content", "")
 
 def call_mistral_api(prompt, model, temperature, max_tokens):
     """Call Mistral API with error handling."""
     try:
-        headers = {
-            "Authorization": f"Bearer {MISTRAL_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": temperature,
-            "max_tokens": max_tokens
-        }
-        response = requests.post(MISTRAL_API_ENDPOINT, headers=headers, json=data)
-        response.raise_for_status()
-        return response.json().get("choices", [{}])[0].get("message", {}).get("content", "")
+        return call_mistral_completion(prompt, model, temperature, max_tokens)
     except Exception as e:
         logger.error(f"Mistral API error: {str(e)}")
         return f"Error calling Mistral API: {str(e)}"
 
-def diagnose_document_processing(vectorizer_type):
+def diagnose_document_processing(vectorizer_type, collection=DEFAULT_COLLECTION):
     """Diagnostic function to check document processing pipeline."""
     with st.expander("Diagnostics Results", expanded=True):
         st.write("Running diagnostics...")
         
         # Check S3 connection
         try:
-            response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME, Prefix=S3_DOCUMENT_KEY)
+            objects = get_s3_inventory().list_objects(prefixes=[S3_DOCUMENT_KEY], suffixes=None, refresh=True)
             st.write("✅ S3 connection successful")
-            if 'Contents' in response:
-                st.write(f"Found {len(response['Contents'])} objects with prefix {S3_DOCUMENT_KEY}")
+            if objects:
+                st.write(f"Found {len(objects)} objects with prefix {S3_DOCUMENT_KEY}")
             else:
                 st.warning(f"No objects found with prefix {S3_DOCUMENT_KEY}")
         except Exception as e:
@@ -566,7 +895,8 @@ def diagnose_document_processing(vectorizer_type):
         # Check vectorizer/embedding state
         try:
             if vectorizer_type == "TF-IDF":
-                if hasattr(vectorizer, 'vocabulary_'):
+                vectorizer = get_vectorizer(collection)
+                if vectorizer is not None:
                     st.write("✅ TF-IDF Vectorizer is fitted")
                     st.write(f"Vocabulary size: {len(vectorizer.vocabulary_)}")
                 else:
@@ -578,12 +908,13 @@ def diagnose_document_processing(vectorizer_type):
         
         # Check database state
         try:
-            cur.execute("SELECT COUNT(*) FROM embeddings")
+            active_rows, params = active_rows_clause(collection, vector_space(vectorizer_type))
+            cur.execute(f"SELECT COUNT(*) FROM embeddings WHERE {active_rows}", params)
             count = cur.fetchone()[0]
-            st.write(f"✅ Database connected, found {count} embeddings")
+            st.write(f"✅ Database connected, found {count} {vectorizer_type} embeddings in collection '{collection}'")
             
             if count > 0:
-                cur.execute("SELECT chunk FROM embeddings LIMIT 1")
+                cur.execute(f"SELECT chunk FROM embeddings WHERE {active_rows} LIMIT 1", params)
                 sample_chunk = cur.fetchone()[0]
                 st.write("Sample chunk preview:")
                 st.write(sample_chunk[:200] + "...")
@@ -598,6 +929,8 @@ def init_session_state():
         st.session_state.session_id = str(uuid.uuid4())
     if 'cache' not in st.session_state:
         st.session_state.cache = {}
+    if 'uploaded_documents' not in st.session_state:
+        st.session_state.uploaded_documents = {}
     if 'documents_processed' not in st.session_state:
         st.session_state.documents_processed = False
     if 'processed_files' not in st.session_state:
@@ -674,10 +1007,11 @@ def file_uploader_ui():
         progress_bar = st.progress(0)
         
         successful_uploads = 0
+        skipped_uploads = 0
         failed_uploads = 0
-        total_files = len(uploaded_files)
+        documents = []
         
-        for idx, file in enumerate(uploaded_files):
+        for file in uploaded_files:
             try:
                 # Validate file
                 if not file:
@@ -695,29 +1029,10 @@ def file_uploader_ui():
                 if file_extension not in ALLOWED_TYPES:
                     raise ValueError(f"Unsupported file type: {file_extension}")
                 
-                progress = (idx + 1) / total_files
-                progress_bar.progress(progress)
-                upload_status.text(f"Uploading {file.name}... ({idx + 1}/{total_files})")
-                
                 file.seek(0)
                 
                 # Upload directly to bucket root
-                s3_key = file.name
-                
-                try:
-                    s3_client.upload_fileobj(
-                        file,
-                        S3_BUCKET_NAME,
-                        s3_key,
-                        ExtraArgs={
-                            'ContentType': ALLOWED_TYPES.get(file_extension, 'application/octet-stream')
-                        }
-                    )
-                except Exception as s3_error:
-                    raise ValueError(f"S3 upload failed: {str(s3_error)}")
-                
-                successful_uploads += 1
-                st.success(f"✅ Successfully uploaded {file.name}")
+                documents.append((file.name, file.read(), ALLOWED_TYPES.get(file_extension, 'application/octet-stream')))
                 
             except Exception as e:
                 failed_uploads += 1
@@ -727,16 +1042,43 @@ def file_uploader_ui():
                 logger.exception("Detailed error traceback:")
                 continue
         
+        # Upload concurrently; identical content already in the bucket is skipped
+        upload_status.text(f"Uploading {len(documents)} files...")
+        for idx, result in enumerate(get_uploader().upload(documents)):
+            progress_bar.progress((idx + 1) / len(documents))
+            
+            if result['status'] == 'failed':
+                failed_uploads += 1
+                error_msg = f"❌ Failed to upload {result['requested_key']}: S3 upload failed: {result['error']}"
+                st.error(error_msg)
+                logger.error(f"Upload error: {error_msg}")
+                continue
+            
+            # Keep the bytes so ingestion can use them without downloading from S3
+            st.session_state.uploaded_documents[result['key']] = {
+                'etag': result['etag'],
+                'content': result['content']
+            }
+            
+            if result['status'] == 'skipped':
+                skipped_uploads += 1
+                st.info(f"⏭️ {result['requested_key']} is already stored as {result['key']}")
+            else:
+                successful_uploads += 1
+                st.success(f"✅ Successfully uploaded {result['key']}")
+        
         progress_bar.empty()
         upload_status.empty()
         
         if successful_uploads > 0:
             st.success(f"🎉 Successfully uploaded {successful_uploads} files")
+        if skipped_uploads > 0:
+            st.info(f"Skipped {skipped_uploads} files already in the bucket")
         if failed_uploads > 0:
             st.warning(f"⚠️ Failed to upload {failed_uploads} files")
             st.info("Please check file size, format, and try again")
         
-        return successful_uploads > 0
+        return successful_uploads + skipped_uploads > 0
 
 def get_task_prompt(context, task_type, **kwargs):
     """Generate appropriate prompt based on task type."""
@@ -764,6 +1106,14 @@ def main():
     
     # Title with center alignment using markdown
     st.markdown("<h1 style='text-align: center;'>AI: Summarize, Classify, Predict</h1>", unsafe_allow_html=True)
+    show_degraded_mode()
+    
+    # Indexes load in the background from the first run in this process, which the script health check
+    # triggers at boot; queries meanwhile wait for them
+    if WARM_START_READY_PORT:
+        get_readiness_server()
+    if not get_warmup().ready:
+        st.info("Loading document indexes in the background. The first results may take a little longer.")
     
     # Left-aligned description with bullet points on separate lines
     st.markdown(
@@ -783,6 +1133,8 @@ def main():
     state = {
         'task_type': None,
         'style': None,
+        'map_reduce': False,
+        'labels': None,
         'prediction_target': None,
         'model': None,
         'temperature': None,
@@ -791,7 +1143,10 @@ def main():
         'vectorizer_type': None,
         'chunking_strategy': None,
         'selected_s3_files': None,
-        'user_text': None
+        'file_types': None,
+        'uploaded_after': None,
+        'user_text': None,
+        'collection': None
     }
     
     with col1:
@@ -809,8 +1164,18 @@ def main():
                 ["concise", "detailed", "bullet_points", "executive"],
                 help="Choose how you want your summary formatted"
             )
+            state['map_reduce'] = st.checkbox(
+                "Summarize Whole Documents",
+                value=True,
+                help="Summarize every chunk in parallel and merge the partial summaries, instead of only the most recent chunks"
+            )
         elif state['task_type'] == "classification":
             st.info("Will classify document content by topic, tone, and intent")
+            labels = st.text_input(
+                "Labels (Optional)",
+                help="Comma-separated labels; each document is assigned one, using embeddings first and the model only when unsure"
+            )
+            state['labels'] = [label.strip() for label in labels.split(',') if label.strip()]
         elif state['task_type'] == "prediction":
             state['prediction_target'] = st.text_input(
                 "Prediction Target", 
@@ -839,6 +1204,25 @@ def main():
         state['vectorizer_type'] = st.selectbox("Embedding Method", ["Mistral-Embed", "TF-IDF"])
         state['chunking_strategy'] = st.selectbox("Chunking Strategy", ["Sentence-Based", "Fixed-Size"])
         
+        if state['input_source'] in ["S3 Documents", "Upload Documents", "Both"]:
+            # Each session works in its own collection unless a shared (team) one is named
+            private_collection = session_collection(st.session_state.session_id)
+            collection_input = st.text_input(
+                "Collection",
+                value=st.session_state.get('collection', private_collection),
+                help="Documents are processed into and analyzed from this collection only. "
+                     "Enter a team name to share processed documents; the default is private to this session."
+            )
+            try:
+                state['collection'] = validate_collection(collection_input)
+                st.session_state.collection = state['collection']
+            except ValueError as e:
+                st.error(str(e))
+                state['collection'] = st.session_state.get('collection', private_collection)
+            shared = [name for name, _ in list_collections(cur) if name != private_collection]
+            if shared:
+                st.caption("Other collections: " + ", ".join(shared))
+        
         # Add optional context for document-based analysis
         if state['input_source'] in ["S3 Documents", "Upload Documents", "Both"]:
             state['additional_context'] = st.text_area(
@@ -862,6 +1246,19 @@ def main():
             else:
                 st.warning("No documents found in S3 bucket")
         
+        if state['input_source'] in ["S3 Documents", "Upload Documents", "Both"]:
+            with st.expander("Retrieval Filters"):
+                state['file_types'] = st.multiselect(
+                    "File Types",
+                    sorted(extension.lstrip('.') for extension in SUPPORTED_EXTENSIONS),
+                    help="Only analyze chunks from these file types (all if empty)"
+                )
+                state['uploaded_after'] = st.date_input(
+                    "Uploaded On Or After",
+                    value=None,
+                    help="Only analyze documents uploaded on or after this date"
+                )
+        
         if state['input_source'] == "Direct Text Input":
             state['user_text'] = st.text_area(
                 "Enter your text",
@@ -882,7 +1279,8 @@ def main():
                         state['selected_s3_files'],
                         state['vectorizer_type'],
                         state['chunking_strategy'],
-                        state.get('additional_context', '')  # Pass additional context
+                        state.get('additional_context', ''),  # Pass additional context
+                        state['collection']
                     )
         
         # Generate button
@@ -907,7 +1305,11 @@ def main():
                         state['model'],
                         state['temperature'],
                         state['max_tokens'],
-                        state['style'] if state['task_type'] == "summarization" else None
+                        state['style'] if state['task_type'] == "summarization" else None,
+                        retrieval_filters(state),
+                        state['map_reduce'],
+                        state['labels'],
+                        state['collection']
                     )
         
         # Display processing status and results
@@ -924,52 +1326,87 @@ def main():
 
 # ...rest of the existing code...
 
+def retrieval_filters(state):
+    """Restrict analysis to the documents selected in the UI plus any additional context."""
+    document_keys = [ADDITIONAL_CONTEXT_KEY]
+    if state['input_source'] in ["S3 Documents", "Both"]:
+        document_keys += state.get('selected_s3_files') or []
+    if state['input_source'] in ["Upload Documents", "Both"]:
+        document_keys += list(st.session_state.uploaded_documents)
+    filters = {'document_keys': document_keys}
+    if state.get('file_types'):
+        filters['file_types'] = state['file_types']
+    if state.get('uploaded_after'):
+        filters['uploaded_after'] = datetime.combine(state['uploaded_after'], datetime.min.time())
+    return filters
+
 def get_s3_files():
     """Get list of files from S3 bucket"""
     try:
-        response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME)
-        return [obj['Key'] for obj in response.get('Contents', [])
-                if obj['Key'].lower().endswith(('.pdf', '.txt', '.doc', '.docx'))]
+        return [obj['key'] for obj in get_s3_inventory().list_objects()]
     except Exception as e:
         st.error(f"Error accessing S3: {str(e)}")
         return []
 
-def process_documents(input_source, s3_files=None, vectorizer_type="Mistral-Embed", chunking_strategy="Sentence-Based", additional_context=None):
-    """Process documents from various sources"""
+def process_documents(input_source, s3_files=None, vectorizer_type="Mistral-Embed", chunking_strategy="Sentence-Based", additional_context=None,
+                      collection=DEFAULT_COLLECTION):
+    """Process documents from various sources into one collection, replacing its previous contents"""
     try:
-        if not s3_files and input_source in ["S3 Documents", "Both"]:
+        if not s3_files and (input_source == "S3 Documents" or (input_source == "Both" and not st.session_state.uploaded_documents)):
             st.error("Please select at least one document to process")
             return False
             
         all_chunks = []
+        all_metadata = []
         processed_files = []
         
         # Add additional context as first chunk if provided
         if additional_context and additional_context.strip():
             all_chunks.append(additional_context.strip())
+            all_metadata.append(chunk_metadata(ADDITIONAL_CONTEXT_KEY, collection=collection))
             logger.info("Added additional context to processing")
         
         # Process S3 documents
         if input_source in ["S3 Documents", "Both"] and s3_files:
+            # ETags from the cached listing let unchanged documents skip download and parsing
+            objects = {obj['key']: obj for obj in get_s3_inventory().list_objects()}
             for file_key in s3_files:
                 with st.spinner(f"Processing {file_key}..."):
-                    document_content = load_document_from_s3(S3_BUCKET_NAME, file_key)
+                    obj = objects.get(file_key, {})
+                    document_content = load_document(file_key, obj.get('etag'))
                     if document_content:
                         chunks = chunk_document(document_content, chunking_strategy)
                         if chunks:
                             all_chunks.extend(chunks)
+                            all_metadata.extend([chunk_metadata(file_key, obj.get('last_modified'), collection)] * len(chunks))
                             processed_files.append(file_key)
                             logger.info(f"Successfully chunked {file_key} into {len(chunks)} chunks")
                         else:
                             st.warning(f"No valid content extracted from {file_key}")
         
+        # Process uploaded documents straight from memory
+        if input_source in ["Upload Documents", "Both"]:
+            for file_key, uploaded in st.session_state.uploaded_documents.items():
+                if file_key in processed_files:
+                    continue
+                document_content = extract_document_text(file_key, uploaded['content'], uploaded['etag'])
+                if document_content:
+                    chunks = chunk_document(document_content, chunking_strategy)
+                    if chunks:
+                        all_chunks.extend(chunks)
+                        all_metadata.extend([chunk_metadata(file_key, collection=collection)] * len(chunks))
+                        processed_files.append(file_key)
+                        logger.info(f"Successfully chunked uploaded {file_key} into {len(chunks)} chunks")
+                    else:
+                        st.warning(f"No valid content extracted from {file_key}")
+        
         if not all_chunks:
             st.error("No valid content was extracted from the documents")
             return False
             
         # Store embeddings
         with st.spinner("Generating embeddings..."):
-            if store_embeddings(all_chunks, vectorizer_type):
+            if store_embeddings(all_chunks, vectorizer_type, all_metadata, collection):
                 st.session_state.processed_files = processed_files
                 st.session_state.documents_processed = True
                 st.success(f"✅ Successfully processed {len(processed_files)} documents with additional context")
@@ -982,14 +1419,176 @@ def process_documents(input_source, s3_files=None, vectorizer_type="Mistral-Embe
         logger.error(f"Document processing error: {str(e)}")
         return False
 
-def generate_from_processed_documents(task_type, model, temperature, max_tokens, style=None):
-    """Generate analysis from processed documents"""
+@st.cache_resource(max_entries=32)
+def get_representative_rows(collection, signature, filter_items, k):
+    """Medoid rows of the filtered collection, computed once per collection version, filter and k."""
+    index = load_vector_index(collection, None, signature, INDEX_QUANTIZATION)
+    filters = {name: list(value) if isinstance(value, tuple) else value for name, value in filter_items}
+    rows = index.filter_rows(filters)
+    rows = np.arange(len(index)) if rows is None else rows
+    if not len(rows):
+        return []
+    selected = select_representatives(np.asarray(index.full_vectors[rows]), k)
+    return [int(rows[i]) for i in selected]
+
+def select_representative_chunks(filters=None, k=10, collection=DEFAULT_COLLECTION):
+    """k chunks spread across the whole document set, in document order, for query-less prompts."""
+    signature = get_corpus_signature(collection)
+    # Hashable form of the filters for the cache key
+    filter_items = tuple(sorted(
+        (name, tuple(value) if isinstance(value, list) else value)
+        for name, value in (filters or {}).items()
+    ))
+    index = load_vector_index(collection, None, signature, INDEX_QUANTIZATION)
+    rows = get_representative_rows(collection, signature, filter_items, k)
+    return [{"chunk": index.chunks[row], "similarity": 1.0} for row in rows]
+
+def get_document_chunks(filters=None, collection=DEFAULT_COLLECTION):
+    """All stored chunks of a collection matching filters, in document order."""
+    where_clause, params = build_filter_clause(filters, collection)
+    cur.execute(f"SELECT chunk FROM embeddings {where_clause} ORDER BY id", params)
+    return [row[0] for row in cur.fetchall() if row[0] and row[0].strip()]
+
+def summarize_documents(model, temperature, max_tokens, style=None, filters=None, collection=DEFAULT_COLLECTION):
+    """Summarize every matching chunk with map-reduce rather than only the most recent ones."""
+    chunks = get_document_chunks(filters, collection)
+    if not chunks:
+        return None
+    
+    # Map and merge calls run on worker threads, so the session is captured here
+    session = current_session_id()
+    summarizer = MapReduceSummarizer(
+        lambda prompt, partial_max_tokens: call_mistral_completion(
+            prompt, model, temperature, partial_max_tokens, priority=BATCH, session=session
+        ),
+        model,
+        cache=get_summary_cache(),
+        max_workers=MAP_REDUCE_MAX_WORKERS,
+        requests_per_second=MISTRAL_REQUESTS_PER_SECOND,
+        token_budget=REDUCE_TOKEN_BUDGET,
+        partial_max_tokens=PARTIAL_SUMMARY_MAX_TOKENS
+    )
+    progress_bar = st.progress(0)
+    status = st.empty()
+    
+    def on_progress(stage, done, total):
+        progress_bar.progress(done / total)
+        status.text(f"{'Summarizing chunks' if stage == 'map' else 'Merging summaries'}: {done}/{total}")
+    
+    try:
+        return summarizer.summarize(
+            chunks,
+            lambda text: call_mistral_api(
+                get_task_prompt(text, "summarization", style=style or "concise"), model, temperature, max_tokens
+            ),
+            on_progress
+        )
+    finally:
+        progress_bar.empty()
+        status.empty()
+
+@st.cache_resource
+def get_zero_shot_classifier(labels):
+    """Embed the label names once per label set; failures are not cached."""
+    label_set = LabelSet(labels)
+    texts = ZeroShotClassifier.label_texts(label_set)
+    label_vectors = call_mistral_embed_api(texts, batch_size=QUERY_EMBED_BATCH_SIZE)
+    if len(label_vectors) != len(texts):
+        raise RuntimeError("Failed to embed labels")
+    return ZeroShotClassifier(label_set.labels, label_vectors, threshold=ZERO_SHOT_CONFIDENCE_THRESHOLD)
+
+def classify_with_llm(label_set, document_key, model, temperature, collection=DEFAULT_COLLECTION, space=None):
+    """Structured LLM classification of one stored document (its chunks in space), used for low-confidence cases."""
+    where_clause, params = build_filter_clause({'document_keys': [document_key]}, collection, space)
+    cur.execute(f"SELECT chunk FROM embeddings {where_clause} ORDER BY id", params)
+    text = " ".join(row[0] for row in cur.fetchall() if row[0])[:CLASSIFY_MAX_CHARS]
+    content = call_mistral_completion(
+        label_set.prompt(text), model, temperature, 200, response_format={"type": "json_object"}, priority=BATCH
+    )
+    return label_set.validate(content)
+
+def classify_documents(labels, model, temperature, filters=None, collection=DEFAULT_COLLECTION):
+    """Classify each processed document into one of labels.
+    
+    Documents are mean-pooled from the stored chunk vectors and matched to embedded label
+    prototypes; only low-confidence documents are sent to the LLM.
+    """
+    label_set = LabelSet(labels)
+    index = load_vector_index(
+        collection, "Mistral-Embed", get_corpus_signature(collection, "Mistral-Embed"), INDEX_QUANTIZATION
+    )
+    space = vector_space("Mistral-Embed")
+    if not len(index):
+        # Without a Mistral-Embed space the documents come from the latest index and all go to the LLM
+        index = load_vector_index(collection, None, get_corpus_signature(collection), INDEX_QUANTIZATION)
+        space = None
+    rows = index.filter_rows(filters)
+    rows = np.arange(len(index)) if rows is None else rows
+    document_keys = index.metadata.get('document_key', [None] * len(index))
+    rows = [row for row in rows if document_keys[row] not in (None, ADDITIONAL_CONTEXT_KEY)]
+    if not rows:
+        return []
+    
+    keys, vectors = mean_pool([document_keys[row] for row in rows], np.asarray(index.full_vectors[rows]))
+    classifier = get_zero_shot_classifier(tuple(labels))
+    if classifier.dimension == vectors.shape[1]:
+        predictions = classifier.classify(vectors)
+    else:
+        # TF-IDF vectors can't be compared with label embeddings
+        predictions = [{'confident': False}] * len(keys)
+    
+    results = []
+    for key, prediction in zip(keys, predictions):
+        if prediction['confident']:
+            results.append({
+                "Document": key, "Label": prediction['label'],
+                "Confidence": round(prediction['confidence'], 3), "Method": "embedding"
+            })
+            continue
+        try:
+            # Text from the same version the documents were listed from
+            answer = classify_with_llm(label_set, key, model, temperature, collection, space)
+            results.append({
+                "Document": key, "Label": answer['label'],
+                "Confidence": round(answer['confidence'], 3), "Method": "llm"
+            })
+        except (InvalidClassification, requests.exceptions.RequestException) as e:
+            logger.error(f"LLM classification failed for {key}: {str(e)}")
+            results.append({
+                "Document": key, "Label": prediction.get('label'),
+                "Confidence": round(prediction.get('confidence', 0.0), 3), "Method": "embedding (low confidence)"
+            })
+    return results
+
+def generate_from_processed_documents(task_type, model, temperature, max_tokens, style=None, filters=None,
+                                      map_reduce=False, labels=None, collection=DEFAULT_COLLECTION):
+    """Generate analysis from processed documents, limited to chunks matching filters"""
     try:
         if not st.session_state.documents_processed:
             st.error("Please process documents first")
             return
+        
+        if task_type == "summarization" and map_reduce:
+            result = summarize_documents(model, temperature, max_tokens, style, filters, collection)
+            if result:
+                display_results(result, task_type)
+            else:
+                st.error("No processed content available. Please ensure documents are properly processed.")
+            return
+        
+        if task_type == "classification" and labels:
+            results = classify_documents(labels, model, temperature, filters, collection)
+            if results:
+                st.markdown("### Results")
+                st.dataframe(results, use_container_width=True)
+            else:
+                st.error("No processed documents to classify.")
+            return
             
-        chunks = retrieve_relevant_chunks("", "Mistral-Embed", top_k=10)
+        # Medoids of the chunk clusters cover the whole document set at the same prompt size
+        chunks = select_representative_chunks(filters, k=10, collection=collection) or retrieve_relevant_chunks(
+            "", "Mistral-Embed", top_k=10, filters=filters, collection=collection
+        )
         if not chunks:
             st.error("No processed content available. Please ensure documents are properly processed.")
             return
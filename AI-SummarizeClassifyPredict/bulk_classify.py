@@ -0,0 +1,420 @@
+# Bulk document classification
+# Classifies every document under the given S3 prefixes (or an explicit list of keys) into a fixed
+# label set. Requests run concurrently under a rate limit, and answers are constrained to a JSON
+# schema and validated. Results are written to the classification_results table as they arrive,
+# so an interrupted run resumes where it stopped. Throughput and token cost are reported at the end.
+#
+# Usage: python bulk_classify.py --labels finance,legal,hr,engineering --prefix contracts/ --prefix invoices/
+#        python bulk_classify.py --labels-file labels.json --keys-file keys.txt --workers 16
+#        python bulk_classify.py --labels-file labels.json --prefix reports/ --embedding-fast-path
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import boto3
+import psycopg2
+import requests
+from dotenv import load_dotenv
+
+from classification import InvalidClassification, LabelSet, ZeroShotClassifier, mean_pool
+from corpus_collections import ACTIVE, vector_space
+from extractors import extract_pages
+from map_reduce import RateLimiter
+from s3_inventory import S3Inventory
+from text_cache import ExtractedTextCache, join_pages
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
+MISTRAL_API_ENDPOINT = "https://api.mistral.ai/v1/chat/completions"
+MISTRAL_EMBED_API_ENDPOINT = "https://api.mistral.ai/v1/embeddings"
+
+# USD per million (input, output) tokens; override with --input-price / --output-price
+MODEL_PRICES = {
+    'mistral-small-latest': (0.2, 0.6),
+    'open-mistral-7b': (0.25, 0.25),
+}
+
+# Only the start of each document is sent; enough to classify, and keeps cost per document flat
+CLASSIFY_MAX_CHARS = int(os.getenv('CLASSIFY_MAX_CHARS', '8000'))
+
+
+class ResultStore:
+    """classification_results table; one row per document and label set."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        with conn, conn.cursor() as cur:
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS classification_results (
+                    document_key TEXT,
+                    label_set TEXT,
+                    etag TEXT,
+                    label TEXT,
+                    confidence FLOAT,
+                    reason TEXT,
+                    status TEXT,
+                    error TEXT,
+                    model TEXT,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    classified_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (document_key, label_set)
+                )
+            ''')
+
+    def completed(self, label_set):
+        """{document_key: etag} of documents already classified with this label set."""
+        with self.conn.cursor() as cur:
+            cur.execute(
+                "SELECT document_key, etag FROM classification_results WHERE label_set = %s AND status = 'done'",
+                (label_set,)
+            )
+            return dict(cur.fetchall())
+
+    def label_vectors(self, label_set):
+        """Stored prototype vectors for this label set, in label order, or None.
+        
+        Keyed by the label set's digest, so a named set whose descriptions changed is embedded again.
+        """
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS label_prototypes (
+                    label_set TEXT,
+                    label TEXT,
+                    embedding FLOAT[],
+                    PRIMARY KEY (label_set, label)
+                )
+            ''')
+            cur.execute("SELECT label, embedding FROM label_prototypes WHERE label_set = %s", (label_set.digest,))
+            stored = dict(cur.fetchall())
+        if set(stored) != set(label_set.labels):
+            return None
+        return [stored[label] for label in label_set.labels]
+
+    def save_label_vectors(self, label_set, vectors):
+        with self.conn, self.conn.cursor() as cur:
+            for label, vector in zip(label_set.labels, vectors):
+                cur.execute("""
+                    INSERT INTO label_prototypes (label_set, label, embedding) VALUES (%s, %s, %s)
+                    ON CONFLICT (label_set, label) DO UPDATE SET embedding = EXCLUDED.embedding
+                """, (label_set.digest, label, list(vector)))
+
+    def document_vectors(self, document_keys, batch_size=1000):
+        """Mean-pooled stored chunk embeddings for the documents that were ingested."""
+        keys, vectors = [], []
+        with self.conn.cursor() as cur:
+            for start in range(0, len(document_keys), batch_size):
+                # Only active Mistral-Embed versions: retired ones are kept for rollback and would
+                # double-count, and other spaces can't be compared with the label embeddings
+                cur.execute("""
+                    SELECT document_key, embedding FROM embeddings
+                    WHERE document_key = ANY(%s) AND index_version IN (
+                        SELECT version FROM index_versions WHERE status = %s AND embedding_model = %s AND model_version = %s
+                    )
+                """, (list(document_keys[start:start + batch_size]), ACTIVE, *vector_space("Mistral-Embed")))
+                for key, embedding in cur.fetchall():
+                    if embedding:
+                        keys.append(key)
+                        vectors.append(embedding)
+        if not vectors:
+            return [], None
+        # Legacy rows migrated into a space may still differ in dimension; keep the majority
+        dimensions = [len(vector) for vector in vectors]
+        dimension = max(set(dimensions), key=dimensions.count)
+        rows = [i for i, d in enumerate(dimensions) if d == dimension]
+        return mean_pool([keys[i] for i in rows], [vectors[i] for i in rows])
+
+    def save(self, label_set, result):
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO classification_results
+                    (document_key, label_set, etag, label, confidence, reason, status, error, model,
+                     prompt_tokens, completion_tokens)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (document_key, label_set)
+                DO UPDATE SET etag = EXCLUDED.etag, label = EXCLUDED.label, confidence = EXCLUDED.confidence,
+                              reason = EXCLUDED.reason, status = EXCLUDED.status, error = EXCLUDED.error,
+                              model = EXCLUDED.model, prompt_tokens = EXCLUDED.prompt_tokens,
+                              completion_tokens = EXCLUDED.completion_tokens, classified_at = CURRENT_TIMESTAMP
+            """, (
+                result['key'], label_set, result.get('etag'), result.get('label'), result.get('confidence'),
+                result.get('reason'), result['status'], result.get('error'), result.get('model'),
+                result.get('prompt_tokens', 0), result.get('completion_tokens', 0)
+            ))
+
+
+class BulkClassifier:
+    """Classifies documents concurrently with bounded parallelism and a shared rate limit."""
+
+    def __init__(self, s3_client, bucket_name, label_set, model, temperature=0.0, max_workers=8,
+                 requests_per_second=5.0, max_attempts=2, text_cache=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.label_set = label_set
+        self.model = model
+        self.temperature = temperature
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.max_attempts = max_attempts
+        self.text_cache = text_cache
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bearer {MISTRAL_API_KEY}",
+            "Content-Type": "application/json"
+        })
+
+    def load_text(self, key, etag=None):
+        if self.text_cache and etag:
+            cached = self.text_cache.get(key, etag)
+            if cached:
+                return cached[0], etag
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+        etag = response['ETag'].strip('"')
+        content = response['Body'].read()
+        pages = extract_pages(key, content)
+        if pages is None:
+            raise ValueError("No extractor could read this document")
+        text, offsets = join_pages(pages)
+        if self.text_cache:
+            self.text_cache.put(key, etag, text, offsets)
+        return text, etag
+
+    def embed(self, texts):
+        """Embed texts with mistral-embed in one request."""
+        self.rate_limiter.wait()
+        response = self.session.post(
+            MISTRAL_EMBED_API_ENDPOINT,
+            json={"input": texts, "model": "mistral-embed"},
+            timeout=60
+        )
+        response.raise_for_status()
+        return [item["embedding"] for item in response.json().get("data", [])]
+
+    def complete(self, prompt):
+        """One JSON-mode chat completion; returns (content, usage)."""
+        max_retries = 3
+        retry_delay = 5  # seconds
+        for retry in range(max_retries):
+            self.rate_limiter.wait()
+            response = self.session.post(MISTRAL_API_ENDPOINT, json={
+                "model": self.model,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": self.temperature,
+                "max_tokens": 200,
+                "response_format": {"type": "json_object"}
+            }, timeout=60)
+            if response.status_code == 429 and retry < max_retries - 1:
+                wait_time = int(response.headers.get('Retry-After', retry_delay * (retry + 1)))
+                logger.warning(f"Rate limit hit, waiting {wait_time} seconds...")
+                time.sleep(wait_time)
+                continue
+            response.raise_for_status()
+            body = response.json()
+            content = body.get("choices", [{}])[0].get("message", {}).get("content", "")
+            return content, body.get("usage", {})
+
+    def classify(self, key, etag=None):
+        """Classify one document; never raises, failures are returned as status 'failed'."""
+        result = {'key': key, 'etag': etag, 'model': self.model, 'prompt_tokens': 0, 'completion_tokens': 0}
+        try:
+            text, result['etag'] = self.load_text(key, etag)
+            if not text.strip():
+                raise ValueError("Document has no text")
+            prompt = self.label_set.prompt(text[:CLASSIFY_MAX_CHARS])
+            for attempt in range(self.max_attempts):
+                content, usage = self.complete(prompt)
+                result['prompt_tokens'] += usage.get('prompt_tokens', 0)
+                result['completion_tokens'] += usage.get('completion_tokens', 0)
+                try:
+                    result.update(self.label_set.validate(content))
+                    result['status'] = 'done'
+                    return result
+                except InvalidClassification as e:
+                    # Retry once with a fresh sample; keep the last error if it still doesn't validate
+                    result['error'] = str(e)
+            result['status'] = 'invalid'
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        return result
+
+    def run(self, documents, on_result):
+        """Classify (key, etag) pairs, calling on_result(result) from the calling thread."""
+        pending = iter(documents)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            # Keep a bounded number of documents in flight rather than queueing all of them
+            futures = {
+                executor.submit(self.classify, key, etag)
+                for key, etag in itertools.islice(pending, self.max_workers * 4)
+            }
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    on_result(future.result())
+                    for key, etag in itertools.islice(pending, 1):
+                        futures.add(executor.submit(self.classify, key, etag))
+        except KeyboardInterrupt:
+            # Queued documents would only be classified and thrown away; a rerun picks them up
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        else:
+            executor.shutdown()
+
+
+def classify_by_embedding(store, classifier, label_set, documents, threshold, on_result):
+    """Label documents whose stored embeddings are close to one prototype; return the rest.
+
+    Documents that were never ingested, or whose vectors come from another model, are returned
+    unchanged for the LLM path.
+    """
+    etags = dict(documents)
+    keys, vectors = store.document_vectors([key for key, _ in documents])
+    if vectors is None:
+        return documents
+
+    label_vectors = store.label_vectors(label_set)
+    if label_vectors is None:
+        label_vectors = classifier.embed(ZeroShotClassifier.label_texts(label_set))
+        store.save_label_vectors(label_set, label_vectors)
+    zero_shot = ZeroShotClassifier(label_set.labels, label_vectors, threshold=threshold)
+    if zero_shot.dimension != vectors.shape[1]:
+        logger.warning("Stored embeddings don't match the label embedding model; skipping the fast path")
+        return documents
+
+    classified = set()
+    for key, prediction in zip(keys, zero_shot.classify(vectors)):
+        if prediction['confident']:
+            classified.add(key)
+            on_result({
+                'key': key, 'etag': etags.get(key), 'model': 'embedding', 'status': 'done',
+                'label': prediction['label'], 'confidence': prediction['confidence'],
+                'reason': f"nearest label prototype (cosine {prediction['similarity']:.3f})",
+                'prompt_tokens': 0, 'completion_tokens': 0
+            })
+    return [(key, etag) for key, etag in documents if key not in classified]
+
+
+def report(stats, elapsed, input_price, output_price):
+    documents = stats['done'] + stats['invalid'] + stats['failed']
+    cost = (stats['prompt_tokens'] * input_price + stats['completion_tokens'] * output_price) / 1_000_000
+    print(f"\nClassified {stats['done']} documents ({stats['invalid']} invalid, {stats['failed']} failed, "
+          f"{stats['skipped']} already done) in {elapsed:.1f}s")
+    if stats['embedding']:
+        print(f"Embedding fast path: {stats['embedding']} documents, {documents - stats['embedding']} sent to the LLM")
+    if documents:
+        print(f"Throughput: {documents / elapsed:.2f} documents/sec")
+        print(f"Tokens: {stats['prompt_tokens']} prompt, {stats['completion_tokens']} completion")
+        print(f"Cost: ${cost:.4f} total, ${cost / documents:.6f} per document")
+    print(f"Labels: {json.dumps(stats['labels'], sort_keys=True)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify many documents into a fixed label set")
+    labels_group = parser.add_mutually_exclusive_group(required=True)
+    labels_group.add_argument('--labels', help="Comma-separated label names")
+    labels_group.add_argument('--labels-file', help='JSON list of labels or {"name": ..., "labels": {label: description}}')
+    parser.add_argument('--prefix', action='append', default=[], help="S3 prefix to classify (repeatable)")
+    parser.add_argument('--keys-file', help="File with one S3 key per line")
+    parser.add_argument('--model', default='mistral-small-latest')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--requests-per-second', type=float, default=5.0)
+    parser.add_argument('--input-price', type=float, default=None, help="USD per 1M prompt tokens")
+    parser.add_argument('--output-price', type=float, default=None, help="USD per 1M completion tokens")
+    parser.add_argument('--restart', action='store_true', help="Reclassify documents that already have results")
+    parser.add_argument('--embedding-fast-path', action='store_true',
+                        help="Classify ingested documents from their stored embeddings; only low-confidence ones go to the LLM")
+    parser.add_argument('--confidence-threshold', type=float, default=0.5,
+                        help="Minimum embedding-classifier confidence to skip the LLM")
+    args = parser.parse_args()
+
+    label_set = LabelSet.from_file(args.labels_file) if args.labels_file else LabelSet(
+        [label.strip() for label in args.labels.split(',') if label.strip()]
+    )
+    bucket_name = os.getenv('S3_BUCKET_NAME')
+    s3_client = boto3.client(
+        's3',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_KEY'),
+        region_name=os.getenv('AWS_REGION')
+    )
+    conn = psycopg2.connect(
+        host=os.getenv('POSTGRES_HOST'),
+        port=os.getenv('POSTGRES_PORT'),
+        dbname=os.getenv('POSTGRES_DB'),
+        user=os.getenv('POSTGRES_USER'),
+        password=os.getenv('POSTGRES_PASSWORD')
+    )
+    store = ResultStore(conn)
+
+    # Explicit keys have no ETag up front; they are treated as unchanged once classified
+    documents = []
+    if args.prefix:
+        inventory = S3Inventory(s3_client, bucket_name)
+        documents += [(obj['key'], obj['etag']) for obj in inventory.list_objects(prefixes=args.prefix)]
+    if args.keys_file:
+        with open(args.keys_file) as f:
+            documents += [(line.strip(), None) for line in f if line.strip()]
+    if not documents:
+        parser.error("No documents to classify; pass --prefix and/or --keys-file")
+
+    completed = {} if args.restart else store.completed(label_set.name)
+    todo = [(key, etag) for key, etag in documents if key not in completed or (etag and completed[key] != etag)]
+    stats = {'done': 0, 'invalid': 0, 'failed': 0, 'skipped': len(documents) - len(todo),
+             'prompt_tokens': 0, 'completion_tokens': 0, 'labels': {}, 'embedding': 0}
+    print(f"Label set {label_set.name}: {len(todo)} documents to classify, {stats['skipped']} already done")
+
+    default_prices = MODEL_PRICES.get(args.model, (0.0, 0.0))
+    input_price = args.input_price if args.input_price is not None else default_prices[0]
+    output_price = args.output_price if args.output_price is not None else default_prices[1]
+
+    classifier = BulkClassifier(
+        s3_client, bucket_name, label_set, args.model,
+        max_workers=args.workers,
+        requests_per_second=args.requests_per_second,
+        text_cache=ExtractedTextCache(
+            os.getenv('TEXT_CACHE_DIR', '.text_cache'),
+            max_bytes=int(os.getenv('TEXT_CACHE_MAX_MB', '512')) * 1024 * 1024
+        )
+    )
+
+    def on_result(result):
+        store.save(label_set.name, result)
+        stats[result['status']] += 1
+        if result['model'] == 'embedding':
+            stats['embedding'] += 1
+        stats['prompt_tokens'] += result['prompt_tokens']
+        stats['completion_tokens'] += result['completion_tokens']
+        if result['status'] == 'done':
+            stats['labels'][result['label']] = stats['labels'].get(result['label'], 0) + 1
+        else:
+            logger.warning(f"{result['key']}: {result['status']} ({result.get('error')})")
+        processed = stats['done'] + stats['invalid'] + stats['failed']
+        if processed % 100 == 0:
+            logger.info(f"{processed}/{len(todo)} documents classified")
+
+    started = time.perf_counter()
+    try:
+        if args.embedding_fast_path:
+            todo = classify_by_embedding(store, classifier, label_set, todo, args.confidence_threshold, on_result)
+        classifier.run(todo, on_result)
+    except KeyboardInterrupt:
+        print("\nInterrupted; rerun the same command to resume")
+    finally:
+        report(stats, time.perf_counter() - started, input_price, output_price)
+        conn.close()
+    return 0 if stats['failed'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
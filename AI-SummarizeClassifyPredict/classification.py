@@ -0,0 +1,136 @@
+# Document classification helpers
+# LabelSet describes the allowed labels and the JSON schema LLM answers must follow.
+# ZeroShotClassifier assigns labels without an LLM: label descriptions are embedded once and each
+# document, mean-pooled from its stored chunk embeddings, goes to the nearest label prototype.
+# Only low-confidence documents need an LLM call.
+
+import hashlib
+import json
+
+import numpy as np
+
+from vector_index import normalize
+
+
+class InvalidClassification(Exception):
+    pass
+
+
+class LabelSet:
+    """Allowed labels (with optional descriptions) and the JSON schema answers must follow."""
+
+    def __init__(self, labels, name=None):
+        # labels: list of names or {name: description}
+        self.labels = dict(labels) if isinstance(labels, dict) else {label: "" for label in labels}
+        if not self.labels:
+            raise ValueError("At least one label is required")
+        # Identifies names and descriptions, so anything derived from the label texts can be cached by it
+        self.digest = hashlib.sha256(json.dumps(self.labels, sort_keys=True).encode('utf-8')).hexdigest()
+        self.name = name or f"labels-{self.digest[:12]}"
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            spec = json.load(f)
+        if isinstance(spec, list):
+            return cls(spec)
+        return cls(spec['labels'], spec.get('name'))
+
+    def schema(self):
+        return {
+            "type": "object",
+            "properties": {
+                "label": {"type": "string", "enum": list(self.labels)},
+                "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+                "reason": {"type": "string"}
+            },
+            "required": ["label", "confidence"]
+        }
+
+    def prompt(self, text):
+        label_lines = "\n".join(
+            f"- {label}: {description}" if description else f"- {label}"
+            for label, description in self.labels.items()
+        )
+        return (
+            "Classify the following document into exactly one of these labels:\n"
+            f"{label_lines}\n\n"
+            "Respond with only a JSON object matching this schema:\n"
+            f"{json.dumps(self.schema())}\n\n"
+            f"Document:\n{text}"
+        )
+
+    def validate(self, content):
+        """Parse a model answer and check it against the schema."""
+        try:
+            answer = json.loads(content)
+        except json.JSONDecodeError as e:
+            raise InvalidClassification(f"Response is not JSON: {str(e)}")
+        if not isinstance(answer, dict) or answer.get('label') not in self.labels:
+            raise InvalidClassification(f"Label not in label set: {answer.get('label') if isinstance(answer, dict) else answer!r}")
+        try:
+            confidence = min(max(float(answer.get('confidence', 0)), 0.0), 1.0)
+        except (TypeError, ValueError):
+            raise InvalidClassification(f"Invalid confidence: {answer.get('confidence')!r}")
+        return {'label': answer['label'], 'confidence': confidence, 'reason': str(answer.get('reason', ''))}
+
+
+def mean_pool(document_keys, vectors):
+    """Average unit-length chunk vectors per document; returns (keys, unit-length document vectors)."""
+    vectors = normalize(vectors)
+    keys, inverse = np.unique(np.asarray(document_keys, dtype=object), return_inverse=True)
+    # Sum contiguous runs of each document's rows instead of a slow unbuffered np.add.at
+    order = np.argsort(inverse, kind='stable')
+    counts = np.bincount(inverse, minlength=len(keys))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    sums = np.add.reduceat(vectors[order], starts, axis=0)
+    return list(keys), normalize(sums / counts[:, None])
+
+
+class ZeroShotClassifier:
+    """Nearest-prototype classifier over embedding vectors.
+
+    Confidence is the softmax probability of the best label over cosine similarities scaled by
+    1 / temperature. Cosine similarities between texts embedded by one model sit in a narrow band,
+    so a small temperature is needed to spread them out.
+    """
+
+    def __init__(self, labels, label_vectors, temperature=0.02, threshold=0.5):
+        self.labels = list(labels)
+        self.label_vectors = normalize(label_vectors)
+        self.temperature = temperature
+        self.threshold = threshold
+
+    @property
+    def dimension(self):
+        return self.label_vectors.shape[1]
+
+    @staticmethod
+    def label_texts(label_set):
+        return [
+            f"{label}: {description}" if description else label
+            for label, description in label_set.labels.items()
+        ]
+
+    @classmethod
+    def build(cls, label_set, embed, **kwargs):
+        """Embed each label (with its description) once; embed(texts) returns one vector per text."""
+        return cls(label_set.labels, embed(cls.label_texts(label_set)), **kwargs)
+
+    def classify(self, document_vectors):
+        """Best label, confidence, cosine similarity and whether it is confident, per document."""
+        similarities = normalize(document_vectors) @ self.label_vectors.T
+        logits = similarities / self.temperature
+        probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+        rows = np.arange(len(best))
+        return [
+            {
+                'label': self.labels[label],
+                'confidence': float(confidence),
+                'similarity': float(similarity),
+                'confident': bool(confidence >= self.threshold)
+            }
+            for label, confidence, similarity in zip(best, probabilities[rows, best], similarities[rows, best])
+        ]
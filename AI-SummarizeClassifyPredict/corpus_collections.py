@@ -0,0 +1,378 @@
+# Named document collections
+# Every chunk belongs to one collection (a team's corpus, or a private one per session), and each
+# collection keeps its own vectorizer and projection state. Re-ingesting a collection replaces only
+# its own rows, so several teams can share one deployment and ingest at the same time.
+# Rebuilds are blue-green: a new index version is written beside the active one, which keeps serving,
+# and a collection_state pointer is switched to it in one short transaction. The previous version is
+# retired rather than deleted, so it can be rolled back to until it is garbage-collected.
+# Each version is one typed vector space: every vector in it comes from the same embedding model and
+# version and has the same dimension. A collection keeps one active version per space, so TF-IDF and
+# Mistral-Embed indexes of the same documents coexist and are never compared with each other.
+# Every cutover bumps the collection's generation and sends it on CORPUS_CHANNEL, so other
+# processes can drop their cached indexes (see corpus_events).
+# The helpers take a psycopg2 cursor so they can run inside the caller's transaction.
+
+import json
+import pickle
+import re
+
+from projection import PCAProjection
+
+DEFAULT_COLLECTION = 'default'
+COLLECTION_NAME_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+
+BUILDING = 'building'
+ACTIVE = 'active'
+RETIRED = 'retired'
+
+# (embedding model, model version) of each vectorizer; bump the version when the model or the
+# TF-IDF settings change, since vectors from different versions must not be compared
+VECTOR_SPACES = {
+    'TF-IDF': ('tfidf', 'max-features-100'),
+    'Mistral-Embed': ('mistral-embed', 'mistral-embed-2312'),
+}
+MISTRAL_EMBED_DIMENSION = 1024
+
+# Postgres notification channel; payloads are {"collection": ..., "generation": ...}
+CORPUS_CHANNEL = 'corpus_changed'
+
+# Rows of the most recently activated version; parameters are (collection, collection)
+ACTIVE_ROWS = "collection = %s AND index_version = (SELECT active_version FROM collection_state WHERE collection = %s)"
+# Rows of the active version in one vector space; parameters are (collection, collection, ACTIVE, *space)
+ACTIVE_SPACE_ROWS = """collection = %s AND index_version = (
+    SELECT version FROM index_versions
+    WHERE collection = %s AND status = %s AND embedding_model = %s AND model_version = %s
+    ORDER BY activated_at DESC LIMIT 1
+)"""
+
+
+def validate_collection(name):
+    """Return the normalized collection name, or raise ValueError."""
+    name = (name or '').strip()
+    if not COLLECTION_NAME_PATTERN.match(name):
+        raise ValueError(
+            "Collection names must be 1-64 letters, digits, '.', '_' or '-', starting with a letter or digit"
+        )
+    return name
+
+
+def vector_space(vectorizer_type):
+    """(embedding model, model version) for a vectorizer type, or None for any space."""
+    if vectorizer_type is None:
+        return None
+    if vectorizer_type not in VECTOR_SPACES:
+        raise ValueError(f"Unknown vectorizer type: {vectorizer_type}")
+    return VECTOR_SPACES[vectorizer_type]
+
+
+def session_collection(session_id):
+    """Private collection name for one user session."""
+    return f"session-{session_id.replace('-', '')[:12]}"
+
+
+def create_collection_tables(cur):
+    """Per-collection state and index version tables, migrating data stored by earlier versions.
+    
+    Takes exclusive locks on embeddings and scans it for unversioned rows; run it once at startup,
+    not per request.
+    """
+    # vectorizer_type, vectorizer and projection hold pre-versioning state and are only read by the migration
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS collection_state (
+            collection TEXT PRIMARY KEY,
+            vectorizer_type TEXT,
+            vectorizer BYTEA,
+            projection BYTEA,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cur.execute("ALTER TABLE collection_state ADD COLUMN IF NOT EXISTS active_version BIGINT")
+    cur.execute("ALTER TABLE collection_state ADD COLUMN IF NOT EXISTS generation BIGINT NOT NULL DEFAULT 0")
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS index_versions (
+            version BIGSERIAL PRIMARY KEY,
+            collection TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'building',
+            vectorizer_type TEXT,
+            vectorizer BYTEA,
+            projection BYTEA,
+            chunk_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            activated_at TIMESTAMP,
+            retired_at TIMESTAMP
+        )
+    ''')
+    for column, column_type in (('embedding_model', 'TEXT'), ('model_version', 'TEXT'), ('dimension', 'INTEGER')):
+        cur.execute(f"ALTER TABLE index_versions ADD COLUMN IF NOT EXISTS {column} {column_type}")
+    cur.execute("CREATE INDEX IF NOT EXISTS index_versions_collection_idx ON index_versions (collection, status)")
+    cur.execute("ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS index_version BIGINT")
+    cur.execute("CREATE INDEX IF NOT EXISTS embeddings_collection_id_idx ON embeddings (collection, id)")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS embeddings_collection_version_idx ON embeddings (collection, index_version, id)"
+    )
+
+    # The single-corpus state is adopted as the default collection
+    cur.execute('''
+        INSERT INTO collection_state (collection, vectorizer, projection)
+        SELECT %s,
+               (SELECT vectorizer FROM model_state WHERE id = 1),
+               (SELECT projection FROM projection_state WHERE id = 1)
+        WHERE EXISTS (SELECT 1 FROM model_state WHERE id = 1)
+           OR EXISTS (SELECT 1 FROM projection_state WHERE id = 1)
+        ON CONFLICT (collection) DO NOTHING
+    ''', (DEFAULT_COLLECTION,))
+
+    # Rows stored before versioning become their collection's first active version
+    cur.execute("""
+        SELECT collection FROM embeddings WHERE index_version IS NULL
+        UNION
+        SELECT collection FROM collection_state WHERE active_version IS NULL
+    """)
+    for (collection,) in cur.fetchall():
+        cur.execute(
+            "SELECT vectorizer_type, vectorizer, projection, active_version FROM collection_state WHERE collection = %s",
+            (collection,)
+        )
+        vectorizer_type, vectorizer, projection, version = cur.fetchone() or (None, None, None, None)
+        if version is None:
+            cur.execute("""
+                INSERT INTO index_versions (collection, status, vectorizer_type, vectorizer, projection, activated_at)
+                VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP) RETURNING version
+            """, (collection, ACTIVE, vectorizer_type, vectorizer, projection))
+            version = cur.fetchone()[0]
+        cur.execute(
+            "UPDATE embeddings SET index_version = %s WHERE collection = %s AND index_version IS NULL",
+            (version, collection)
+        )
+        activate_index_version(cur, collection, version)
+
+    # Versions built before vector spaces were recorded are typed by their most common dimension;
+    # rows of any other dimension are never loaded
+    cur.execute("""
+        SELECT v.version, v.vectorizer_type,
+               (SELECT MODE() WITHIN GROUP (ORDER BY array_length(e.embedding, 1))
+                FROM embeddings e WHERE e.collection = v.collection AND e.index_version = v.version)
+        FROM index_versions v WHERE v.embedding_model IS NULL
+    """)
+    for version, vectorizer_type, dimension in cur.fetchall():
+        if vectorizer_type not in VECTOR_SPACES:
+            vectorizer_type = 'Mistral-Embed' if dimension == MISTRAL_EMBED_DIMENSION else 'TF-IDF'
+        embedding_model, model_version = VECTOR_SPACES[vectorizer_type]
+        cur.execute("""
+            UPDATE index_versions
+            SET vectorizer_type = %s, embedding_model = %s, model_version = %s, dimension = %s
+            WHERE version = %s
+        """, (vectorizer_type, embedding_model, model_version, dimension, version))
+
+
+def active_rows_clause(collection, space=None):
+    """SQL predicate and parameters selecting the rows of a collection's active version in space.
+
+    As in _select_active, space None means the most recently activated version of any space.
+    """
+    if space is None:
+        return ACTIVE_ROWS, [collection, collection]
+    return ACTIVE_SPACE_ROWS, [collection, collection, ACTIVE, *space]
+
+
+def _select_active(cur, columns, collection, space=None):
+    """Fetch columns of the active version in space, or of the most recently built one if space is None."""
+    if space is None:
+        cur.execute(f"""
+            SELECT {columns} FROM collection_state c JOIN index_versions v ON v.version = c.active_version
+            WHERE c.collection = %s
+        """, (collection,))
+    else:
+        cur.execute(f"""
+            SELECT {columns} FROM index_versions v
+            WHERE v.collection = %s AND v.status = %s AND v.embedding_model = %s AND v.model_version = %s
+            ORDER BY v.activated_at DESC LIMIT 1
+        """, (collection, ACTIVE, *space))
+    return cur.fetchone()
+
+
+def load_collection_state(cur, collection, space=None):
+    """State of a collection's active version in space (see _select_active), or None.
+
+    Keys: version, vectorizer_type, embedding_model, model_version, dimension, vectorizer, projection, activated_at.
+    """
+    row = _select_active(cur, """
+        v.version, v.vectorizer_type, v.embedding_model, v.model_version, v.dimension,
+        v.vectorizer, v.projection, v.activated_at
+    """, collection, space)
+    if row is None:
+        return None
+    version, vectorizer_type, embedding_model, model_version, dimension, vectorizer, projection, activated_at = row
+    return {
+        'version': version,
+        'vectorizer_type': vectorizer_type,
+        'embedding_model': embedding_model,
+        'model_version': model_version,
+        'dimension': dimension,
+        'vectorizer': pickle.loads(bytes(vectorizer)) if vectorizer else None,
+        'projection': PCAProjection.from_bytes(bytes(projection)) if projection else None,
+        'activated_at': activated_at
+    }
+
+
+def begin_index_version(cur, collection, vectorizer_type, dimension, vectorizer=None, projection=None):
+    """Register a staged version of a collection, invisible to queries until activated; returns its number."""
+    embedding_model, model_version = vector_space(vectorizer_type)
+    cur.execute("""
+        INSERT INTO index_versions
+            (collection, status, vectorizer_type, embedding_model, model_version, dimension, vectorizer, projection)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING version
+    """, (
+        collection, BUILDING, vectorizer_type, embedding_model, model_version, dimension,
+        pickle.dumps(vectorizer) if vectorizer is not None else None,
+        projection.to_bytes() if projection is not None else None
+    ))
+    return cur.fetchone()[0]
+
+
+def activate_index_version(cur, collection, version):
+    """Point queries at version; the previously active version of its space is retired, not deleted.
+
+    Listeners on CORPUS_CHANNEL are notified when the transaction commits.
+    """
+    # Upserting the pointer first locks the collection, so concurrent cutovers are serialized
+    cur.execute("""
+        INSERT INTO collection_state (collection, active_version, generation) VALUES (%s, %s, 1)
+        ON CONFLICT (collection)
+        DO UPDATE SET active_version = EXCLUDED.active_version,
+                      generation = collection_state.generation + 1,
+                      last_updated = CURRENT_TIMESTAMP
+        RETURNING generation
+    """, (collection, version))
+    generation = cur.fetchone()[0]
+    cur.execute("""
+        UPDATE index_versions old SET status = %s, retired_at = CURRENT_TIMESTAMP
+        FROM index_versions new
+        WHERE new.version = %s AND old.collection = %s AND old.status = %s AND old.version <> new.version
+          AND old.embedding_model IS NOT DISTINCT FROM new.embedding_model
+          AND old.model_version IS NOT DISTINCT FROM new.model_version
+    """, (RETIRED, version, collection, ACTIVE))
+    cur.execute("""
+        UPDATE index_versions
+        SET status = %s, activated_at = CURRENT_TIMESTAMP, retired_at = NULL,
+            chunk_count = (SELECT COUNT(*) FROM embeddings WHERE collection = %s AND index_version = %s)
+        WHERE collection = %s AND version = %s
+    """, (ACTIVE, collection, version, collection, version))
+    if cur.rowcount != 1:
+        raise ValueError(f"Index version {version} does not belong to collection '{collection}'")
+    cur.execute(
+        "SELECT pg_notify(%s, %s)",
+        (CORPUS_CHANNEL, json.dumps({'collection': collection, 'generation': generation}))
+    )
+
+
+def discard_index_version(cur, collection, version):
+    """Delete a version's rows and state, e.g. a failed build or one past the rollback window."""
+    cur.execute("DELETE FROM embeddings WHERE collection = %s AND index_version = %s", (collection, version))
+    cur.execute("DELETE FROM index_versions WHERE collection = %s AND version = %s", (collection, version))
+
+
+def rollback_collection(cur, collection, space=None):
+    """Reactivate the most recently retired version (in space, if given); returns it, or None if none is retained."""
+    space_clause, params = "", [collection, RETIRED]
+    if space is not None:
+        space_clause = "AND embedding_model = %s AND model_version = %s"
+        params.extend(space)
+    cur.execute(f"""
+        SELECT version FROM index_versions WHERE collection = %s AND status = %s {space_clause}
+        ORDER BY retired_at DESC, version DESC LIMIT 1
+    """, params)
+    row = cur.fetchone()
+    if row is None:
+        return None
+    activate_index_version(cur, collection, row[0])
+    return row[0]
+
+
+def garbage_collect_versions(cur, collection, keep=1, stale_build_hours=24):
+    """Delete retired versions beyond the keep most recent per space, and builds abandoned for stale_build_hours.
+
+    Returns the deleted version numbers.
+    """
+    cur.execute("""
+        SELECT version FROM (
+            SELECT version, ROW_NUMBER() OVER (
+                PARTITION BY embedding_model, model_version ORDER BY retired_at DESC, version DESC
+            ) AS age
+            FROM index_versions WHERE collection = %s AND status = %s
+        ) retired WHERE age > %s
+        UNION
+        SELECT version FROM index_versions
+        WHERE collection = %s AND status = %s AND created_at < CURRENT_TIMESTAMP - make_interval(hours => %s)
+    """, (collection, RETIRED, keep, collection, BUILDING, stale_build_hours))
+    versions = [row[0] for row in cur.fetchall()]
+    for version in versions:
+        discard_index_version(cur, collection, version)
+    return versions
+
+
+def build_index_version(conn, collection, vectorizer_type, dimension, write_chunks, vectorizer=None, projection=None,
+                        keep=1):
+    """Blue-green rebuild of one vector space of a collection on its own connection; returns the new version.
+
+    write_chunks(cursor, version) stores the new rows, all of the given dimension. They are committed
+    as a staged version that queries ignore, then made active in one short transaction, after which
+    retired versions beyond the keep most recent are deleted. A failed build is discarded and the
+    active version keeps serving.
+    """
+    with conn.cursor() as cur:
+        version = begin_index_version(cur, collection, vectorizer_type, dimension, vectorizer, projection)
+        conn.commit()
+        try:
+            write_chunks(cur, version)
+            conn.commit()
+            activate_index_version(cur, collection, version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            try:
+                discard_index_version(cur, collection, version)
+                conn.commit()
+            except Exception:
+                # Left as a stale build for garbage_collect_versions
+                conn.rollback()
+            raise
+        garbage_collect_versions(cur, collection, keep)
+        conn.commit()
+    return version
+
+
+def collection_signature(cur, collection, space=None):
+    """Cheap fingerprint of one collection's active version in space, used to know when to rebuild its index."""
+    row = _select_active(cur, "v.version, v.chunk_count, v.activated_at", collection, space)
+    return tuple(row) if row else (None, 0, None)
+
+
+def collection_generations(cur):
+    """{collection: generation}; the generation changes with every cutover or rollback."""
+    cur.execute("SELECT collection, generation FROM collection_state")
+    return dict(cur.fetchall())
+
+
+def list_collections(cur):
+    """(collection, chunk count) for every collection with an active version."""
+    cur.execute("""
+        SELECT c.collection, v.chunk_count
+        FROM collection_state c JOIN index_versions v ON v.version = c.active_version
+        ORDER BY c.collection
+    """)
+    return [tuple(row) for row in cur.fetchall()]
+
+
+def list_index_versions(cur, collection):
+    """Retained versions of a collection, newest first."""
+    cur.execute("""
+        SELECT version, status, vectorizer_type, embedding_model, model_version, dimension, chunk_count,
+               created_at, activated_at, retired_at
+        FROM index_versions WHERE collection = %s ORDER BY version DESC
+    """, (collection,))
+    columns = (
+        'version', 'status', 'vectorizer_type', 'embedding_model', 'model_version', 'dimension', 'chunk_count',
+        'created_at', 'activated_at', 'retired_at'
+    )
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
@@ -0,0 +1,117 @@
+# Cross-process corpus change notifications
+# Every index cutover bumps its collection's generation and sends a NOTIFY on CORPUS_CHANNEL. A
+# CorpusWatcher keeps one LISTEN connection per process on a background thread and tracks the
+# latest generation of each collection, so caches keyed by watcher.token(collection) are dropped
+# as soon as any replica re-ingests, without querying Postgres on every rerun. While the listener
+# is disconnected token() returns None and callers fall back to reading the database.
+
+import json
+import logging
+import select
+import threading
+
+from corpus_collections import CORPUS_CHANNEL, collection_generations
+
+logger = logging.getLogger(__name__)
+
+
+class CorpusWatcher:
+    """Tracks collection generations from Postgres notifications on a background thread.
+
+    connect() must return a new psycopg2 connection; it is switched to autocommit for LISTEN.
+    """
+
+    def __init__(self, connect, channel=CORPUS_CHANNEL, reconnect_seconds=5.0, poll_seconds=5.0):
+        self.connect = connect
+        self.channel = channel
+        self.reconnect_seconds = reconnect_seconds
+        self.poll_seconds = poll_seconds
+        self.generations = {}
+        self.epoch = 0
+        self.connected = False
+        self.connected_event = threading.Event()
+        self.notifications = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="corpus-watcher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def wait_connected(self, timeout=None):
+        """True once the listener is connected, or False after timeout seconds."""
+        return self.connected_event.wait(timeout)
+
+    def token(self, collection):
+        """Cache key part that changes whenever the collection changes, or None while disconnected."""
+        with self.lock:
+            if not self.connected:
+                return None
+            # The epoch changes on reconnect, since notifications may have been missed meanwhile
+            return (self.epoch, self.generations.get(collection, 0))
+
+    def _listen(self, conn):
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            # Listen before reading the generations so no change falls between the two
+            cur.execute(f"LISTEN {self.channel}")
+            generations = collection_generations(cur)
+        with self.lock:
+            self.generations = generations
+            self.epoch += 1
+            self.connected = True
+            self.connected_event.set()
+        logger.info(f"Listening for corpus changes on '{self.channel}' ({len(generations)} collections)")
+
+        while not self.stopped.is_set():
+            if select.select([conn], [], [], self.poll_seconds) == ([], [], []):
+                continue
+            conn.poll()
+            while conn.notifies:
+                self._apply(conn.notifies.pop(0).payload)
+
+    def _apply(self, payload):
+        try:
+            change = json.loads(payload)
+            collection, generation = change['collection'], int(change['generation'])
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed corpus notification: {payload!r}")
+            return
+        with self.lock:
+            self.notifications += 1
+            # Notifications can arrive out of order across sessions; generations only move forward
+            if generation > self.generations.get(collection, 0):
+                self.generations[collection] = generation
+        logger.info(f"Collection '{collection}' changed (generation {generation})")
+
+    def _run(self):
+        while not self.stopped.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                self._listen(conn)
+            except Exception as e:
+                logger.warning(f"Corpus change listener disconnected: {str(e)}")
+            finally:
+                with self.lock:
+                    self.connected = False
+                    self.connected_event.clear()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self.stopped.wait(self.reconnect_seconds)
+
+    def status(self):
+        with self.lock:
+            return {
+                'connected': self.connected,
+                'epoch': self.epoch,
+                'notifications': self.notifications,
+                'collections': len(self.generations)
+            }
@@ -0,0 +1,162 @@
+# Hierarchical map-reduce summarization
+# Every chunk is summarized in parallel (map), then partial summaries are merged in groups that fit
+# the token budget until one pass fits (reduce). Map and merge outputs don't depend on the requested
+# summary style, so they are cached and a style change only re-runs the final step.
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+MAP_PROMPT = (
+    "Summarize the following excerpt from a larger document. Keep key facts, figures, names, "
+    "decisions and conclusions; it will be combined with summaries of the other excerpts:\n\n{text}"
+)
+MERGE_PROMPT = (
+    "Combine the following partial summaries of one document set into a single summary. "
+    "Keep key facts, figures, names, decisions and conclusions, and remove repetition:\n\n{text}"
+)
+SUMMARY_SEPARATOR = "\n\n"
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+
+class RateLimiter:
+    """Spaces out calls across threads to at most rate per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class SummaryCache:
+    """Thread-safe LRU of map/merge outputs keyed by model and input text."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model, prompt):
+        return hashlib.sha256(f"{model}\0{prompt}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class MapReduceSummarizer:
+    """Summarize arbitrarily many chunks with a completion function.
+
+    complete(prompt, max_tokens) must return the completion text and raise on failure, so errors
+    are never cached as summaries.
+    """
+
+    def __init__(self, complete, model, cache=None, max_workers=4, requests_per_second=2.0,
+                 token_budget=6000, partial_max_tokens=300):
+        self.complete = complete
+        self.model = model
+        self.cache = cache if cache is not None else SummaryCache()
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.token_budget = token_budget
+        self.partial_max_tokens = partial_max_tokens
+
+    def _summarize(self, prompt):
+        """One cached, rate-limited completion."""
+        key = self.cache.key(self.model, prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        self.rate_limiter.wait()
+        summary = self.complete(prompt, self.partial_max_tokens).strip()
+        self.cache.put(key, summary)
+        return summary
+
+    def _run_parallel(self, prompts, on_progress=None):
+        """Complete prompts concurrently, returning results in input order."""
+        results = [None] * len(prompts)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self._summarize, prompt): i for i, prompt in enumerate(prompts)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                if on_progress:
+                    on_progress(done, len(prompts))
+        return results
+
+    def map(self, chunks, on_progress=None):
+        """Summarize every chunk; chunks already summarized with this model come from the cache."""
+        return self._run_parallel([MAP_PROMPT.format(text=chunk) for chunk in chunks], on_progress)
+
+    def group(self, summaries):
+        """Split summaries into consecutive groups whose combined size fits the token budget."""
+        groups = [[]]
+        size = 0
+        for summary in summaries:
+            tokens = estimate_tokens(summary)
+            # At least two summaries per group so every level shrinks the list
+            if len(groups[-1]) >= 2 and size + tokens > self.token_budget:
+                groups.append([])
+                size = 0
+            groups[-1].append(summary)
+            size += tokens
+        return groups
+
+    def reduce(self, summaries, on_progress=None):
+        """Merge partial summaries level by level until they fit the token budget together."""
+        level = 0
+        while len(summaries) > 1 and estimate_tokens(SUMMARY_SEPARATOR.join(summaries)) > self.token_budget:
+            level += 1
+            groups = self.group(summaries)
+            logger.info(f"Reduce level {level}: merging {len(summaries)} summaries in {len(groups)} groups")
+            prompts = [MERGE_PROMPT.format(text=SUMMARY_SEPARATOR.join(group)) for group in groups]
+            summaries = self._run_parallel(prompts, on_progress)
+        return SUMMARY_SEPARATOR.join(summaries)
+
+    def summarize(self, chunks, finalize, on_progress=None):
+        """Map, reduce, then call finalize(text) once, e.g. to write the summary in the selected style.
+
+        on_progress(stage, done, total) is called from the calling thread.
+        """
+        def progress(stage):
+            return (lambda done, total: on_progress(stage, done, total)) if on_progress else None
+
+        started = time.perf_counter()
+        summaries = self.map(chunks, progress("map"))
+        combined = self.reduce(summaries, progress("reduce"))
+        logger.info(f"Map-reduce over {len(chunks)} chunks took {time.perf_counter() - started:.1f}s "
+                    f"(cache hits {self.cache.hits}, misses {self.cache.misses})")
+        return finalize(combined)
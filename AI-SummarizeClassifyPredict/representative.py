@@ -0,0 +1,61 @@
+# Representative chunk selection
+# Clusters a document set's chunk embeddings with mini-batch spherical k-means and picks the chunk
+# closest to each centroid (the medoid), so a fixed-size prompt covers every part of the corpus
+# instead of whichever chunks were inserted last.
+
+import numpy as np
+
+from vector_index import normalize
+
+
+def kmeans_plus_plus(vectors, k, rng):
+    """Spread initial centres by sampling proportionally to squared distance from chosen ones."""
+    centers = [vectors[rng.integers(len(vectors))]]
+    # For unit vectors, squared Euclidean distance is 2 - 2 * cosine
+    distances = np.maximum(2 - 2 * (vectors @ centers[0]), 0)
+    for _ in range(1, k):
+        total = distances.sum()
+        if total <= 0:
+            break
+        center = vectors[rng.choice(len(vectors), p=distances / total)]
+        centers.append(center)
+        distances = np.minimum(distances, np.maximum(2 - 2 * (vectors @ center), 0))
+    return np.array(centers, dtype=np.float32)
+
+
+def minibatch_kmeans(vectors, k, batch_size=1024, iterations=50, seed=0):
+    """Spherical mini-batch k-means; returns unit-length centres (at most k of them)."""
+    vectors = normalize(vectors)
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(len(vectors), 10 * batch_size), replace=False)]
+    centers = kmeans_plus_plus(sample, min(k, len(vectors)), rng)
+    counts = np.zeros(len(centers))
+
+    for _ in range(iterations):
+        batch = vectors[rng.choice(len(vectors), size=min(batch_size, len(vectors)), replace=False)]
+        labels = (batch @ centers.T).argmax(axis=1)
+        # Per-centre sums of the batch via a one-hot product, then a per-centre learning rate of 1/count
+        one_hot = np.zeros((len(batch), len(centers)), dtype=np.float32)
+        one_hot[np.arange(len(batch)), labels] = 1
+        batch_counts = one_hot.sum(axis=0)
+        sums = one_hot.T @ batch
+        counts += batch_counts
+        updated = batch_counts > 0
+        centers[updated] += (sums[updated] - batch_counts[updated, None] * centers[updated]) / counts[updated, None]
+        centers = normalize(centers)
+    return centers
+
+
+def select_representatives(vectors, k, seed=0):
+    """Indices of up to k medoid rows, one per non-empty cluster, in their original order."""
+    vectors = normalize(vectors)
+    if len(vectors) <= k:
+        return list(range(len(vectors)))
+    centers = minibatch_kmeans(vectors, k, seed=seed)
+    similarities = vectors @ centers.T
+    labels = similarities.argmax(axis=1)
+    # Only a cluster's own members can be its medoid
+    member_scores = np.where(labels[:, None] == np.arange(len(centers)), similarities, -np.inf)
+    medoids = member_scores.argmax(axis=0)
+    non_empty = np.isfinite(member_scores[medoids, np.arange(len(centers))])
+    return sorted(set(medoids[non_empty].tolist()))
@@ -0,0 +1,109 @@
+# S3 inventory scanner
+# Lists every object under one or more prefixes (not just the first 1000 keys) and caches the
+# result for a short TTL. Each prefix starts as one key range; a range whose first page comes back
+# full is split where its keys start to differ, and the pieces are listed in parallel, so dense
+# "folders" such as docs/ or uploads/2024/ fan out instead of being paginated serially.
+
+import logging
+import os
+import string
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = ('.pdf', '.txt', '.doc', '.docx')
+
+# Characters key ranges may be split at (ASCII, so string order matches S3's byte-wise key order)
+SHARD_BOUNDARIES = string.digits + string.ascii_uppercase + string.ascii_lowercase
+PAGE_SIZE = 1000
+
+
+class S3Inventory:
+    """Paginated, parallel listing of an S3 bucket with a short-lived cache."""
+
+    def __init__(self, s3_client, bucket_name, ttl=60, max_workers=32):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def list_objects(self, prefixes=('',), suffixes=SUPPORTED_EXTENSIONS, refresh=False):
+        """Return key, ETag, size and last-modified time for every object under the prefixes."""
+        prefixes = tuple(prefixes)
+        with self._lock:
+            cached = self._cache.get(prefixes)
+        if cached and not refresh and time.monotonic() - cached[0] < self.ttl:
+            objects = cached[1]
+        else:
+            started = time.monotonic()
+            objects = self._scan(prefixes)
+            logger.info(f"Listed {len(objects)} objects from {self.bucket_name} in {time.monotonic() - started:.2f}s")
+            with self._lock:
+                self._cache[prefixes] = (time.monotonic(), objects)
+
+        if suffixes:
+            return [obj for obj in objects if obj['key'].lower().endswith(suffixes)]
+        return list(objects)
+
+    def invalidate(self):
+        """Drop cached listings, e.g. after an upload."""
+        with self._lock:
+            self._cache.clear()
+
+    def _scan(self, prefixes):
+        objects = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(self._list_range, prefix, None, None) for prefix in prefixes}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    listed, remaining = future.result()
+                    objects.extend(listed)
+                    pending.update(executor.submit(self._list_range, *shard) for shard in remaining)
+
+        # Overlapping prefixes would list the same keys twice
+        unique = {obj['key']: obj for obj in objects}
+        return sorted(unique.values(), key=lambda obj: obj['key'])
+
+    @staticmethod
+    def _split(prefix, keys, last_key):
+        """Cut the rest of a range whose first page held keys into contiguous (prefix, start_after, last_key) ranges.
+
+        The keys continue past the page, so the remainder is cut at every character position from the
+        end of the prefix to where the page's keys differ, using the characters seen in the page as
+        split points. Any range that fills a page is split again.
+        """
+        start_after = keys[-1]
+        alphabet = sorted(set(SHARD_BOUNDARIES).intersection(''.join(key[len(prefix):] for key in keys)))
+        varying = len(os.path.commonprefix([keys[0], start_after]))
+        points = set()
+        for depth in range(len(prefix), varying + 1):
+            stem, current = start_after[:depth], start_after[depth:depth + 1]
+            points.update(stem + c for c in alphabet if c > current)
+        bounds = [start_after] + sorted(point for point in points if last_key is None or point < last_key) + [last_key]
+        return [(prefix, lower, upper) for lower, upper in zip(bounds, bounds[1:])]
+
+    def _list_range(self, prefix, start_after, last_key):
+        """First page of the keys after start_after up to and including last_key, plus the ranges left to list."""
+        params = {'Bucket': self.bucket_name, 'Prefix': prefix, 'MaxKeys': PAGE_SIZE}
+        if start_after:
+            params['StartAfter'] = start_after
+        page = self.s3_client.list_objects_v2(**params)
+
+        objects = []
+        for obj in page.get('Contents', []):
+            if last_key is not None and obj['Key'] > last_key:
+                return objects, []
+            objects.append({
+                'key': obj['Key'],
+                'etag': obj['ETag'].strip('"'),
+                'size': obj['Size'],
+                'last_modified': obj['LastModified']
+            })
+        if not page.get('IsTruncated') or not objects:
+            return objects, []
+        return objects, self._split(prefix, [obj['key'] for obj in objects], last_key)
@@ -0,0 +1,91 @@
+# Direct-ingest uploads
+# Sends documents to S3 concurrently with multipart transfers, skips content already in the bucket,
+# and hands the in-memory bytes back to the caller so ingestion doesn't download them again.
+
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from boto3.s3.transfer import TransferConfig
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * MB,
+    multipart_chunksize=8 * MB,
+    max_concurrency=4,
+    use_threads=True
+)
+
+
+def compute_etag(content, transfer_config=TRANSFER_CONFIG):
+    """Return the ETag S3 assigns to content uploaded with transfer_config."""
+    if len(content) < transfer_config.multipart_threshold:
+        return hashlib.md5(content).hexdigest()
+    chunk_size = transfer_config.multipart_chunksize
+    part_digests = [
+        hashlib.md5(content[i:i + chunk_size]).digest()
+        for i in range(0, len(content), chunk_size)
+    ]
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+class DirectUploader:
+    """Concurrent uploader that deduplicates by content hash against the bucket inventory."""
+
+    def __init__(self, s3_client, bucket_name, inventory, transfer_config=TRANSFER_CONFIG, max_workers=8):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.inventory = inventory
+        self.transfer_config = transfer_config
+        self.max_workers = max_workers
+
+    def upload(self, documents):
+        """Upload (key, content, content_type) tuples; yields one result dict per document as it finishes.
+
+        Each result carries the bytes it was given, so callers can extract and embed them directly.
+        """
+        # The inventory is invalidated after every upload, so this also sees earlier uploads
+        existing = {obj['etag']: obj['key'] for obj in self.inventory.list_objects(suffixes=None)}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(self._upload_one, key, content, content_type, existing)
+                for key, content, content_type in documents
+            ]
+            uploaded_any = False
+            for future in as_completed(futures):
+                result = future.result()
+                uploaded_any = uploaded_any or result['status'] == 'uploaded'
+                yield result
+
+        if uploaded_any:
+            self.inventory.invalidate()
+
+    def _upload_one(self, key, content, content_type, existing):
+        etag = compute_etag(content, self.transfer_config)
+        result = {'key': key, 'requested_key': key, 'etag': etag, 'size': len(content), 'content': content, 'status': 'uploaded', 'error': None}
+
+        if etag in existing:
+            # Same bytes are already stored; point the caller at the existing object
+            result['key'] = existing[etag]
+            result['status'] = 'skipped'
+            logger.info(f"Skipping upload of {key}: identical content already stored as {existing[etag]}")
+            return result
+
+        try:
+            self.s3_client.upload_fileobj(
+                io.BytesIO(content),
+                self.bucket_name,
+                key,
+                ExtraArgs={'ContentType': content_type},
+                Config=self.transfer_config
+            )
+        except Exception as e:
+            logger.error(f"S3 upload failed for {key}: {str(e)}")
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        return result
@@ -0,0 +1,302 @@
+# In-memory retrieval index
+# Holds normalized chunk vectors for cosine search. Candidates can be scanned in a compact form,
+# as int8 or 1-bit codes and/or in a PCA-reduced space, and the best ones are then rescored
+# against full float32 vectors read lazily from a memory-mapped file.
+
+import bisect
+import logging
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ('none', 'int8', 'binary')
+
+# Candidates rescored per result; binary codes need a deeper pool than int8 or reduced floats
+DEFAULT_RESCORE_FACTOR = {'none': 4, 'int8': 4, 'binary': 10}
+
+SCAN_BLOCK_ROWS = 16384
+# Queries scored per matrix product; capped so the score block stays around 128 MB
+QUERY_BLOCK_SIZE = 256
+SCORE_BLOCK_ELEMENTS = 32 * 1024 * 1024
+BINARY_QUERY_GROUP = 16
+
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def pack_signs(vectors):
+    """Pack the sign bit of each coordinate into uint64 words (zero-padded)."""
+    bits = np.packbits(vectors > 0, axis=1)
+    padding = -bits.shape[1] % 8
+    if padding:
+        bits = np.pad(bits, ((0, 0), (0, padding)))
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+def popcount(words):
+    """Count set bits per uint64 word; numpy >= 2.0 has a native kernel."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return POPCOUNT[words.view(np.uint8)].reshape(*words.shape, 8).sum(axis=-1)
+
+
+def normalize(vectors):
+    """Return float32 row vectors scaled to unit length."""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def top_indices(scores, k):
+    """Indices of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def mmr_select(relevance, vectors, top_k, lambda_mult=0.5):
+    """Maximal Marginal Relevance: greedily pick positions trading relevance against redundancy.
+
+    relevance holds each candidate's similarity to the query and vectors the unit-length candidate
+    vectors; lambda_mult=1 is plain relevance order, lower values favour diversity.
+    """
+    top_k = min(top_k, len(relevance))
+    pairwise = vectors @ vectors.T
+    redundancy = np.full(len(relevance), -np.inf, dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    selected = []
+    for _ in range(top_k):
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0)
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * penalty, -np.inf)
+        best = int(scores.argmax())
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return selected
+
+
+def _memory_map(vectors, directory=None):
+    """Write vectors to a temporary .npy file and return a read-only memory map of it."""
+    handle = tempfile.NamedTemporaryFile(suffix='.npy', dir=directory, delete=False)
+    handle.close()
+    np.save(handle.name, vectors)
+    mapped = np.load(handle.name, mmap_mode='r')
+    weakref.finalize(mapped, _remove_file, handle.name)
+    return mapped
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class VectorIndex:
+    """Cosine-similarity index over chunk vectors with optional quantization and projection."""
+
+    def __init__(self, ids, chunks, vectors, mode='none', projection=None, reduced_vectors=None,
+                 rescore=True, mmap_dir=None, metadata=None, normalized=False):
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        # Vectors already of unit length, e.g. memory-mapped from a snapshot, are used without a copy
+        if not len(chunks):
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        elif not (normalized and isinstance(vectors, np.ndarray) and vectors.dtype == np.float32):
+            vectors = normalize(vectors)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.chunks = list(chunks)
+        self.mode = mode
+        self.projection = projection
+        self.rescore_full = rescore
+        self.dimension = vectors.shape[1]
+        self.scan_vectors = None
+        self.codes = None
+        self.scales = None
+
+        # Per-row metadata columns (document_key, file_type, uploaded_at, collection) for filtering
+        self.metadata = metadata or {}
+        self._postings = {}
+        self._time_order = None
+
+        if not len(self.chunks):
+            self.full_vectors = vectors
+            return
+
+        if projection is None:
+            scan_vectors = vectors
+        else:
+            # Reduced vectors stored at ingest save re-projecting the corpus on every load
+            scan_vectors = normalize(reduced_vectors if reduced_vectors is not None else projection.transform(vectors))
+        self.scan_dimension = scan_vectors.shape[1]
+
+        if mode == 'none':
+            self.scan_vectors = scan_vectors
+        elif mode == 'int8':
+            # Per-dimension symmetric scale so each coordinate uses the full int8 range
+            self.scales = np.abs(scan_vectors).max(axis=0) / 127
+            self.scales[self.scales == 0] = 1
+            self.codes = np.round(scan_vectors / self.scales).astype(np.int8)
+        else:
+            self.codes = pack_signs(scan_vectors)
+
+        if self._scans_full_vectors():
+            self.full_vectors = vectors
+        else:
+            # Full-precision vectors are only paged in for the rows being rescored
+            self.full_vectors = vectors if isinstance(vectors, np.memmap) else _memory_map(vectors, mmap_dir)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def _scans_full_vectors(self):
+        return self.mode == 'none' and self.projection is None
+
+    def memory_bytes(self):
+        """Bytes of vector data held in RAM (memory-mapped rescoring vectors excluded)."""
+        if not len(self):
+            return 0
+        if self._scans_full_vectors():
+            return 0 if isinstance(self.full_vectors, np.memmap) else self.full_vectors.nbytes
+        if self.scan_vectors is not None:
+            return self.scan_vectors.nbytes
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def full_precision_bytes(self):
+        return len(self) * self.dimension * 4
+
+    def _posting(self, column):
+        """Map each value of a metadata column to the sorted rows that carry it (built on first use)."""
+        if column not in self._postings:
+            values = self.metadata.get(column, [None] * len(self))
+            rows_by_value = {}
+            for row, value in enumerate(values):
+                rows_by_value.setdefault(value, []).append(row)
+            self._postings[column] = {value: np.array(rows, dtype=np.int64) for value, rows in rows_by_value.items()}
+        return self._postings[column]
+
+    def filter_rows(self, filters):
+        """Rows matching every filter, or None when nothing is filtered.
+
+        Supported filters: document_keys, file_types, collections (lists of allowed values) and
+        uploaded_after / uploaded_before (datetimes, inclusive).
+        """
+        if not filters:
+            return None
+        rows = None
+        for name, column in (('document_keys', 'document_key'), ('file_types', 'file_type'), ('collections', 'collection')):
+            if filters.get(name) is None:
+                continue
+            posting = self._posting(column)
+            matches = [posting[value] for value in set(filters[name]) if value in posting]
+            selected = np.unique(np.concatenate(matches)) if matches else np.array([], dtype=np.int64)
+            rows = selected if rows is None else np.intersect1d(rows, selected, assume_unique=True)
+
+        if filters.get('uploaded_after') is not None or filters.get('uploaded_before') is not None:
+            if self._time_order is None:
+                times = self.metadata.get('uploaded_at', [None] * len(self))
+                dated = [row for row, value in enumerate(times) if value is not None]
+                order = sorted(dated, key=lambda row: times[row])
+                self._time_order = (np.array(order, dtype=np.int64), [times[row] for row in order])
+            order, sorted_times = self._time_order
+            lower = 0 if filters.get('uploaded_after') is None else bisect.bisect_left(sorted_times, filters['uploaded_after'])
+            upper = len(order) if filters.get('uploaded_before') is None else bisect.bisect_right(sorted_times, filters['uploaded_before'])
+            selected = np.sort(order[lower:upper])
+            rows = selected if rows is None else np.intersect1d(rows, selected, assume_unique=True)
+        return rows
+
+    def search(self, query_vectors, top_k=5, rescore_factor=None, rows=None):
+        """Return, for each query, a best-first list of (row, cosine similarity).
+
+        If rows is given (see filter_rows), only those rows are scored.
+        """
+        rescore_factor = rescore_factor or DEFAULT_RESCORE_FACTOR[self.mode]
+        queries = normalize(query_vectors)
+        subset = None if rows is None else np.sort(np.asarray(rows, dtype=np.int64))
+        if not len(self) or (subset is not None and not len(subset)):
+            return [[] for _ in queries]
+        if queries.shape[1] != self.dimension:
+            raise ValueError(f"Query dimension {queries.shape[1]} does not match index dimension {self.dimension}")
+
+        scan_queries = queries if self.projection is None else normalize(self.projection.transform(queries))
+        # Scores are exact when scanning full float vectors; reduced floats are used as-is if rescoring is off
+        exact = self._scans_full_vectors() or (self.mode == 'none' and not self.rescore_full)
+
+        n_rows = len(self) if subset is None else len(subset)
+        block_size = max(1, min(QUERY_BLOCK_SIZE, SCORE_BLOCK_ELEMENTS // n_rows))
+        results = []
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            scores = self._scan_scores(scan_queries[start:start + block_size], subset)
+            if exact:
+                for row_scores in scores:
+                    positions = top_indices(row_scores, top_k)
+                    row_ids = positions if subset is None else subset[positions]
+                    results.append([(int(row), float(row_scores[position])) for row, position in zip(row_ids, positions)])
+                continue
+
+            n_candidates = max(top_k * rescore_factor, top_k)
+            for query, row_scores in zip(block, scores):
+                positions = top_indices(row_scores, n_candidates)
+                results.append(self.rescore(query, positions if subset is None else subset[positions], top_k))
+        return results
+
+    def search_diverse(self, query_vectors, top_k=5, lambda_mult=0.5, candidate_factor=4, rows=None):
+        """Like search, but re-rank a pool of candidate_factor * top_k results with MMR."""
+        queries = normalize(query_vectors)
+        pools = self.search(queries, top_k * candidate_factor, rows=rows)
+        results = []
+        for query, pool in zip(queries, pools):
+            if len(pool) <= top_k:
+                results.append(pool)
+                continue
+            candidates = np.array([row for row, _ in pool], dtype=np.int64)
+            order = np.argsort(candidates)  # Sequential reads from the memory map
+            vectors = np.empty((len(candidates), self.dimension), dtype=np.float32)
+            vectors[order] = self.full_vectors[candidates[order]]
+            relevance = vectors @ query
+            results.append([
+                (int(candidates[i]), float(relevance[i]))
+                for i in mmr_select(relevance, vectors, top_k, lambda_mult)
+            ])
+        return results
+
+    def rescore(self, query, candidates, top_k):
+        """Rank candidate rows by exact cosine similarity against the float32 vectors."""
+        candidates = np.sort(candidates)  # Sequential reads from the memory map
+        exact = np.asarray(self.full_vectors[candidates]) @ query
+        order = top_indices(exact, top_k)
+        return [(int(candidates[i]), float(exact[i])) for i in order]
+
+    def _scan_scores(self, queries, subset=None):
+        """Score each query against every row (or only the subset rows) in the scan representation."""
+        def select(array):
+            return array if subset is None else array[subset]
+
+        if self._scans_full_vectors():
+            return queries @ select(self.full_vectors).T
+        if self.mode == 'none':
+            return queries @ select(self.scan_vectors).T
+
+        codes = select(self.codes)
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        if self.mode == 'int8':
+            scaled_queries = queries * self.scales
+            for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+                block = codes[start:start + SCAN_BLOCK_ROWS].astype(np.float32)
+                scores[:, start:start + len(block)] = scaled_queries @ block.T
+        else:
+            query_bits = pack_signs(queries)
+            for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+                block = codes[start:start + SCAN_BLOCK_ROWS]
+                # XOR a few queries at a time to bound the (queries, rows, words) intermediate
+                for q in range(0, len(queries), BINARY_QUERY_GROUP):
+                    bits = query_bits[q:q + BINARY_QUERY_GROUP]
+                    hamming = popcount(block[None, :, :] ^ bits[:, None, :]).sum(axis=2, dtype=np.int32)
+                    scores[q:q + len(bits), start:start + len(block)] = -hamming
+        return scores
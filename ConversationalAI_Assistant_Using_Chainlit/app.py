@@ -5,11 +5,10 @@
 # Import required libraries
 import chainlit as cl
 import os
+import asyncio
 import aiohttp
 from typing import Dict, List
-import PyPDF2
-from docx import Document
-import io
+from extractors import extract_pages
 
 # API configuration for Mistral
 MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')  # Get API key from environment variables
@@ -22,23 +21,14 @@ async def process_file(file: cl.File) -> str:
     """
     try:
         file_ext = os.path.splitext(file.name)[1].lower()  # Extract file extension
-        
-        # Handle text files - direct UTF-8 decode
-        if file_ext == '.txt':
-            return file.content.decode('utf-8')
-        
-        # Handle PDF files - extract text from all pages
-        elif file_ext == '.pdf':
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(file.content))
-            return "\n".join(page.extract_text() for page in pdf_reader.pages)
-        
-        # Handle Word documents - extract text from paragraphs
-        elif file_ext in ['.docx', '.doc']:
-            doc = Document(io.BytesIO(file.content))
-            return "\n".join(paragraph.text for paragraph in doc.paragraphs)
-        
-        else:
+        if file_ext not in ['.txt', '.pdf', '.doc', '.docx']:
             return f"Unsupported file format: {file.name}"
+        
+        # Extract text with the fastest available backend for this file type, off the event loop
+        pages = await asyncio.to_thread(extract_pages, file.name, file.content)
+        if pages is None:
+            return f"Error processing file: could not extract text from {file.name}"
+        return "\n".join(pages)
     except Exception as e:
         return f"Error processing file: {str(e)}"
 
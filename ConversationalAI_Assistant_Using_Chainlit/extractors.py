@@ -0,0 +1,249 @@
+# Document extractor registry
+# Maps file extensions to text extraction backends in order of preference. Each backend returns a
+# list of page texts; if one fails or runs past the per-document timeout, the next one is tried.
+# Backends run in a small pool of worker processes, so a parser stuck on a pathological file is
+# terminated at the timeout instead of burning a CPU for the rest of the process's life.
+
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+logger = logging.getLogger(__name__)
+
+# Optional faster backends
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+try:
+    from pdfminer.high_level import extract_text as pdfminer_extract_text
+except ImportError:
+    pdfminer_extract_text = None
+
+try:
+    import PyPDF2
+except ImportError:
+    PyPDF2 = None
+
+try:
+    from docx import Document
+except ImportError:
+    Document = None
+
+# Timeout grows with document size: base seconds plus seconds per MB
+BASE_TIMEOUT_SECONDS = float(os.getenv('EXTRACTION_BASE_TIMEOUT', '10'))
+TIMEOUT_SECONDS_PER_MB = float(os.getenv('EXTRACTION_TIMEOUT_PER_MB', '5'))
+# Documents parsed at the same time, each in its own worker process
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', str(min(os.cpu_count() or 1, 4))))
+WORKER_START_TIMEOUT_SECONDS = 30
+
+EXTRACTORS = {}
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+class ExtractionError(Exception):
+    """An extractor raised in its worker process; the message names the original exception."""
+
+
+def register_extractor(name, extensions, available=True):
+    """Register a backend for the given extensions; registration order sets preference."""
+    def decorator(func):
+        if available:
+            for extension in extensions:
+                EXTRACTORS.setdefault(extension, []).append((name, func))
+        return func
+    return decorator
+
+
+def available_extractors(extension):
+    """Return the (name, function) backends registered for an extension."""
+    return list(EXTRACTORS.get(extension.lower().lstrip('.'), EXTRACTORS['txt']))
+
+
+def automatic_timeout(content):
+    return BASE_TIMEOUT_SECONDS + TIMEOUT_SECONDS_PER_MB * len(content) / (1024 * 1024)
+
+
+def _serve(connection):
+    """Worker process loop: run (extractor, content) requests until the pipe is closed."""
+    connection.send('ready')
+    while True:
+        try:
+            func, content = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send((True, func(content)))
+        except Exception as e:
+            # Exceptions from parser libraries don't always pickle, so only the description is sent back
+            connection.send((False, f"{type(e).__name__}: {str(e)}"))
+
+
+class _Worker:
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,), name="extractor", daemon=True)
+        self.process.start()
+        child.close()
+        # Interpreter start-up and imports don't count against the first document's timeout
+        if not self.connection.poll(WORKER_START_TIMEOUT_SECONDS) or self.connection.recv() != 'ready':
+            self.kill()
+            raise ExtractionError("Extraction worker failed to start")
+
+    def run(self, func, content, timeout):
+        """(succeeded, pages or error message); raises ExtractionTimeout if there's no answer in time."""
+        self.connection.send((func, content))
+        if not self.connection.poll(timeout):
+            raise ExtractionTimeout(f"Extraction exceeded {timeout:.1f}s")
+        return self.connection.recv()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class ExtractorPool:
+    """At most size worker processes; one that times out or breaks is terminated and replaced."""
+
+    def __init__(self, size=EXTRACTION_WORKERS):
+        # spawn, since forking a process with open connections and threads isn't safe
+        self.context = multiprocessing.get_context('spawn')
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def run(self, func, content, timeout):
+        with self.slots:
+            with self.lock:
+                worker = self.idle.pop() if self.idle else None
+            if worker is None or not worker.process.is_alive():
+                worker = _Worker(self.context)
+            try:
+                succeeded, value = worker.run(func, content, timeout)
+            except BaseException:
+                # Timed out or interrupted: the process may still be parsing, so it can't be reused
+                worker.kill()
+                raise
+            with self.lock:
+                self.idle.append(worker)
+        if not succeeded:
+            raise ExtractionError(value)
+        return value
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def extractor_pool():
+    """The process-wide ExtractorPool, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ExtractorPool()
+        return _pool
+
+
+def run_with_timeout(func, content, timeout):
+    """Run a registered extractor in a worker process, terminating it if it runs past timeout."""
+    return extractor_pool().run(func, content, timeout)
+
+
+def extract_pages(filename, content, timeout=None):
+    """Extract per-page text with the preferred backend for the file type, falling back on errors.
+
+    Returns None if every backend fails.
+    """
+    extension = filename.lower().split('.')[-1]
+    timeout = timeout or automatic_timeout(content)
+    for name, extractor in available_extractors(extension):
+        try:
+            return run_with_timeout(extractor, content, timeout)
+        except Exception as e:
+            logger.warning(f"{name} extraction failed for {filename}: {str(e)}")
+    logger.error(f"All extractors failed for {filename}")
+    return None
+
+
+@register_extractor('pdfium', ['pdf'], available=pdfium is not None)
+def extract_pdf_pdfium(content):
+    pdf = pdfium.PdfDocument(content)
+    try:
+        pages = []
+        for page in pdf:
+            text_page = page.get_textpage()
+            pages.append(text_page.get_text_range())
+            text_page.close()
+            page.close()
+        return pages
+    finally:
+        pdf.close()
+
+
+@register_extractor('pdfminer', ['pdf'], available=pdfminer_extract_text is not None)
+def extract_pdf_pdfminer(content):
+    text = pdfminer_extract_text(io.BytesIO(content))
+    # pdfminer separates pages with form feeds
+    return text.split('\f')[:-1] if text.endswith('\f') else text.split('\f')
+
+
+@register_extractor('pypdf2', ['pdf'], available=PyPDF2 is not None)
+def extract_pdf_pypdf2(content):
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
+    return [page.extract_text() for page in pdf_reader.pages]
+
+
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+@register_extractor('docx-iterparse', ['docx', 'doc'])
+def extract_docx_iterparse(content):
+    """Stream paragraphs out of word/document.xml without building the python-docx object model."""
+    paragraphs = []
+    current = []
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        with archive.open('word/document.xml') as document_xml:
+            for event, element in iterparse(document_xml, events=('end',)):
+                tag = element.tag
+                if tag == WORD_NAMESPACE + 't':
+                    current.append(element.text or '')
+                elif tag == WORD_NAMESPACE + 'tab':
+                    current.append('\t')
+                elif tag in (WORD_NAMESPACE + 'br', WORD_NAMESPACE + 'cr'):
+                    current.append('\n')
+                elif tag == WORD_NAMESPACE + 'p':
+                    paragraphs.append(''.join(current))
+                    current = []
+                    element.clear()
+    return ['\n'.join(paragraphs)]
+
+
+@register_extractor('python-docx', ['docx', 'doc'], available=Document is not None)
+def extract_docx_python_docx(content):
+    doc = Document(io.BytesIO(content))
+    text = [paragraph.text for paragraph in doc.paragraphs]
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                text.append(cell.text)
+    return ['\n'.join(text)]
+
+
+@register_extractor('text', ['txt'])
+def extract_plain_text(content):
+    try:
+        return [content.decode('utf-8')]
+    except UnicodeDecodeError:
+        return [content.decode('latin-1')]
@@ -0,0 +1,671 @@
+# HTTP API for RAG-DocuMind
+# Serves retrieval and answer generation over the same embeddings table the Streamlit app builds.
+# Run with: uvicorn api:app --host 0.0.0.0 --port 8000
+
+import asyncio
+import json
+import logging
+import os
+import pickle
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import asyncpg
+import httpx
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from context_reduction import compress, context_stats, cutoff, sentence_units
+from corpus_collections import CORPUS_CHANNEL, DEFAULT_COLLECTION, validate_collection, vector_space
+from model_router import ModelRouter
+from projection import PCAProjection
+from snapshots import open_snapshot
+from vector_index import VectorIndex
+
+# Load environment variables
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Configuration from environment variables
+POSTGRES_HOST = os.getenv('POSTGRES_HOST')
+POSTGRES_PORT = os.getenv('POSTGRES_PORT')
+POSTGRES_DB = os.getenv('POSTGRES_DB')
+POSTGRES_USER = os.getenv('POSTGRES_USER')
+POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
+MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
+MISTRAL_API_ENDPOINT = "https://api.mistral.ai/v1/chat/completions"
+MISTRAL_EMBED_API_ENDPOINT = "https://api.mistral.ai/v1/embeddings"
+DB_SETTINGS = dict(
+    host=POSTGRES_HOST, port=POSTGRES_PORT, database=POSTGRES_DB, user=POSTGRES_USER, password=POSTGRES_PASSWORD
+)
+
+# Service tuning
+API_VECTORIZER_TYPE = os.getenv('API_VECTORIZER_TYPE', 'Mistral-Embed')  # Must match how the index was embedded
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))
+MAX_CONCURRENT_GENERATIONS = int(os.getenv('MAX_CONCURRENT_GENERATIONS', '32'))
+BATCH_WINDOW_MS = float(os.getenv('BATCH_WINDOW_MS', '10'))
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', '32'))
+MAX_TOP_K = int(os.getenv('MAX_TOP_K', '50'))
+# How long shutdown waits for batches already being served before cancelling them
+BATCH_DRAIN_SECONDS = float(os.getenv('BATCH_DRAIN_SECONDS', '10'))
+INDEX_REFRESH_SECONDS = float(os.getenv('INDEX_REFRESH_SECONDS', '30'))  # Only while the change listener is down
+LISTENER_RECONNECT_SECONDS = float(os.getenv('LISTENER_RECONNECT_SECONDS', '5'))
+# Collections loaded in the background at startup; GET /ready returns 503 until they are resident
+WARM_START_COLLECTIONS = [name.strip() for name in os.getenv('WARM_START_COLLECTIONS', 'default').split(',') if name.strip()]
+INDEX_QUANTIZATION = os.getenv('INDEX_QUANTIZATION', 'none')  # none, int8 or binary
+# Directory or s3:// URI of exported index snapshots; active versions found there load without reading their rows
+INDEX_SNAPSHOT_ROOT = os.getenv('INDEX_SNAPSHOT_ROOT')
+PROJECTION_RESCORE = os.getenv('PROJECTION_RESCORE', 'true').lower() == 'true'
+METADATA_COLUMNS = ('document_key', 'file_type', 'uploaded_at', 'collection')
+RETRIEVAL_MMR_LAMBDA = float(os.getenv('RETRIEVAL_MMR_LAMBDA', '0.7'))  # 1.0 disables MMR re-ranking
+MMR_CANDIDATE_FACTOR = int(os.getenv('MMR_CANDIDATE_FACTOR', '4'))
+CONTEXT_REDUCTION = os.getenv('CONTEXT_REDUCTION', 'true').lower() == 'true'
+AUTO_MODEL = "auto"
+GENERATION_SLO_SECONDS = float(os.getenv('GENERATION_SLO_SECONDS', '8'))
+
+
+class CorpusIndex:
+    """In-memory copy of one collection's API_VECTORIZER_TYPE vector space, reloaded only when it changes."""
+
+    def __init__(self, pool, collection=DEFAULT_COLLECTION, watched=lambda: False):
+        self.pool = pool
+        self.collection = collection
+        self.vector_index = VectorIndex([], [], [], mode=INDEX_QUANTIZATION)
+        self.vectorizer = None
+        self.signature = None
+        self.checked_at = 0.0
+        self.stale = False
+        self.watched = watched
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """Re-check the collection on the next request, e.g. after a change notification."""
+        self.stale = True
+
+    def _is_fresh(self):
+        if self.signature is None or self.stale:
+            return False
+        # While changes are pushed by the listener there is nothing to poll for
+        return self.watched() or time.monotonic() - self.checked_at < INDEX_REFRESH_SECONDS
+
+    async def ensure_fresh(self):
+        """Reload chunks, vectors and the TF-IDF vectorizer if the collection changed since the last check."""
+        if self._is_fresh():
+            return
+        async with self._lock:
+            if self._is_fresh():
+                return
+            # Cleared before reading, so a notification arriving during the reload marks it stale again
+            self.stale = False
+            async with self.pool.acquire() as conn:
+                # The active version's rows never change, so its number is the signature
+                state = await conn.fetchrow("""
+                    SELECT version, activated_at, dimension, vectorizer, projection FROM index_versions
+                    WHERE collection = $1 AND status = 'active' AND embedding_model = $2 AND model_version = $3
+                    ORDER BY activated_at DESC LIMIT 1
+                """, self.collection, *vector_space(API_VECTORIZER_TYPE))
+                signature = (state['version'], state['activated_at']) if state else (None, None)
+                snapshot = None
+                if signature != self.signature and state and INDEX_SNAPSHOT_ROOT:
+                    snapshot = await asyncio.to_thread(self._open_snapshot, state['version'])
+                if signature != self.signature and snapshot is not None:
+                    await asyncio.to_thread(self._build_from_snapshot, snapshot)
+                    self.signature = signature
+                    logger.info(
+                        f"Loaded {len(self.vector_index)} chunks of '{self.collection}' version {signature[0]} "
+                        "into the API index from its snapshot"
+                    )
+                elif signature != self.signature:
+                    # One version is one fixed-dimension space, so the rows load as a homogeneous matrix
+                    rows = await conn.fetch("""
+                        SELECT id, chunk, embedding, embedding_reduced, document_key, file_type, uploaded_at, collection
+                        FROM embeddings
+                        WHERE collection = $1 AND index_version = $2 AND array_length(embedding, 1) = $3 AND chunk <> ''
+                        ORDER BY id
+                    """, self.collection, signature[0], state and state['dimension'])
+                    vectorizer = None
+                    if API_VECTORIZER_TYPE == "TF-IDF" and state and state['vectorizer']:
+                        vectorizer = pickle.loads(state['vectorizer'])
+                    projection_state = state['projection'] if state else None
+                    await asyncio.to_thread(self._build, rows, vectorizer, projection_state)
+                    self.signature = signature
+                    logger.info(
+                        f"Loaded {len(self.vector_index)} chunks of '{self.collection}' version {signature[0]} "
+                        "into the API index"
+                    )
+            self.checked_at = time.monotonic()
+
+    def _open_snapshot(self, version):
+        try:
+            return open_snapshot(INDEX_SNAPSHOT_ROOT, self.collection, version)
+        except Exception as e:
+            logger.warning(f"Loading '{self.collection}' version {version} from Postgres, its snapshot failed: {str(e)}")
+            return None
+
+    def _build_from_snapshot(self, snapshot):
+        # Full vectors stay memory-mapped from the snapshot file and are paged in as they are scanned
+        self.vector_index = VectorIndex(
+            snapshot.ids,
+            snapshot.chunks,
+            snapshot.vectors,
+            mode=INDEX_QUANTIZATION,
+            projection=snapshot.projection,
+            reduced_vectors=snapshot.reduced_vectors,
+            rescore=PROJECTION_RESCORE,
+            metadata=snapshot.metadata,
+            normalized=snapshot.normalized
+        )
+        self.vectorizer = snapshot.vectorizer if API_VECTORIZER_TYPE == "TF-IDF" else None
+
+    def _build(self, rows, vectorizer, projection_state=None):
+        # Reduce queries with the projection fitted at ingest, if there is one for these vectors
+        projection = None
+        reduced_vectors = None
+        if projection_state and rows:
+            projection = PCAProjection.from_bytes(projection_state)
+            if projection.source_dimension != len(rows[0]['embedding']):
+                projection = None
+            elif all(row['embedding_reduced'] and len(row['embedding_reduced']) == projection.dimension for row in rows):
+                reduced_vectors = [row['embedding_reduced'] for row in rows]
+
+        self.vector_index = VectorIndex(
+            [row['id'] for row in rows],
+            [row['chunk'] for row in rows],
+            [row['embedding'] for row in rows],
+            mode=INDEX_QUANTIZATION,
+            projection=projection,
+            reduced_vectors=reduced_vectors,
+            rescore=PROJECTION_RESCORE,
+            metadata={column: [row[column] for row in rows] for column in METADATA_COLUMNS}
+        )
+        self.vectorizer = vectorizer
+
+    def search(self, query_vectors, top_ks, filters=None):
+        """Score all queries in one pass per distinct filter and return the top-k results for each."""
+        index = self.vector_index
+        filters = filters or [None] * len(top_ks)
+        groups = {}
+        for position, query_filters in enumerate(filters):
+            key = json.dumps(query_filters, sort_keys=True, default=str)
+            groups.setdefault(key, (query_filters, []))[1].append(position)
+
+        results = [None] * len(top_ks)
+        for query_filters, positions in groups.values():
+            # Filtered queries only score the rows matching their filter
+            rows = index.filter_rows(query_filters)
+            group_vectors = [query_vectors[p] for p in positions]
+            group_top_k = max(top_ks[p] for p in positions)
+            if RETRIEVAL_MMR_LAMBDA < 1:
+                matches = index.search_diverse(
+                    group_vectors, group_top_k, RETRIEVAL_MMR_LAMBDA, MMR_CANDIDATE_FACTOR, rows=rows
+                )
+            else:
+                matches = index.search(group_vectors, group_top_k, rows=rows)
+            for position, result in zip(positions, matches):
+                results[position] = [
+                    {"chunk": index.chunks[row], "similarity": similarity}
+                    for row, similarity in result[:top_ks[position]]
+                ]
+        return results
+
+
+class QueryBatcher:
+    """Collects queries that arrive within a short window and serves them with one embed call."""
+
+    def __init__(self, service):
+        self.service = service
+        self.queue = asyncio.Queue()
+        self._task = None
+        # The event loop only keeps weak references to tasks, so in-flight batches are held here
+        self._processing = set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop batching, let in-flight batches finish for up to BATCH_DRAIN_SECONDS and fail queued queries."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._processing:
+            _, unfinished = await asyncio.wait(set(self._processing), timeout=BATCH_DRAIN_SECONDS)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+        while not self.queue.empty():
+            future = self.queue.get_nowait()[4]
+            if not future.done():
+                future.set_exception(HTTPException(status_code=503, detail="Service is shutting down"))
+
+    async def submit(self, query, top_k, filters=None, collection=DEFAULT_COLLECTION):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((query, top_k, filters, collection, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + BATCH_WINDOW_MS / 1000
+            while len(batch) < MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Process in the background so the next batch can form while this one waits on the API
+            task = asyncio.create_task(self._process(batch))
+            self._processing.add(task)
+            task.add_done_callback(self._processing.discard)
+
+    async def _process(self, batch):
+        # Each collection has its own index (and possibly vectorizer), so batch per collection
+        groups = {}
+        for item in batch:
+            groups.setdefault(item[3], []).append(item)
+        try:
+            await asyncio.gather(*(self._process_collection(collection, items) for collection, items in groups.items()))
+        finally:
+            # A batch cancelled at shutdown must not leave its callers waiting
+            for _, _, _, _, future in batch:
+                if not future.done():
+                    future.cancel()
+
+    async def _process_collection(self, collection, batch):
+        try:
+            results = await self.service.retrieve_batch(
+                [query for query, _, _, _, _ in batch],
+                [top_k for _, top_k, _, _, _ in batch],
+                [filters for _, _, filters, _, _ in batch],
+                collection
+            )
+            for (_, _, _, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            logger.error(f"Batch retrieval error for collection '{collection}': {str(e)}")
+            for _, _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+class RAGService:
+    """Shared pool, HTTP client and collection indexes used by every request handled by this process."""
+
+    def __init__(self):
+        self.pool = None
+        self.http = None
+        self.listener = None
+        self.listen_task = None
+        self.warmup_task = None
+        self.warmup = {'ready': False, 'seconds': None, 'collections': {}}
+        self.stopping = False
+        self.indexes = {}
+        self.batcher = None
+        self.generation_slots = asyncio.Semaphore(MAX_CONCURRENT_GENERATIONS)
+        self.router = ModelRouter(slo_seconds=GENERATION_SLO_SECONDS)
+
+    async def start(self):
+        self.pool = await asyncpg.create_pool(**DB_SETTINGS, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE)
+        await self.listen()
+        # Listening first means the warmed indexes are invalidated by any change made meanwhile
+        self.warmup_task = asyncio.create_task(self.warm_up())
+        self.http = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {MISTRAL_API_KEY}"},
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS),
+            timeout=httpx.Timeout(60.0, connect=10.0)
+        )
+        self.batcher = QueryBatcher(self)
+        self.batcher.start()
+
+    async def stop(self):
+        self.stopping = True
+        if self.warmup_task:
+            self.warmup_task.cancel()
+        await self.batcher.stop()
+        await self.http.aclose()
+        if self.watching():
+            await self.listener.close()
+        await self.pool.close()
+
+    async def listen(self):
+        """Drop cached collection indexes as soon as any process cuts one over (see corpus_events)."""
+        try:
+            self.listener = await asyncpg.connect(**DB_SETTINGS)
+            await self.listener.add_listener(CORPUS_CHANNEL, self._on_corpus_changed)
+            self.listener.add_termination_listener(self._on_listener_closed)
+            logger.info(f"Listening for corpus changes on '{CORPUS_CHANNEL}'")
+        except Exception as e:
+            logger.warning(f"Corpus change listener unavailable, polling every {INDEX_REFRESH_SECONDS}s: {str(e)}")
+            self.listener = None
+            asyncio.get_running_loop().call_later(LISTENER_RECONNECT_SECONDS, self._reconnect)
+            return
+        # Changes may have been missed while no listener was connected
+        for index in self.indexes.values():
+            index.invalidate()
+
+    async def warm_up(self):
+        """Load WARM_START_COLLECTIONS so the first queries after a deploy don't pay for it."""
+        started = time.perf_counter()
+        for collection in WARM_START_COLLECTIONS:
+            collection_started = time.perf_counter()
+            index = self.collection_index(collection)
+            try:
+                await index.ensure_fresh()
+                result = {'chunks': len(index.vector_index)}
+            except Exception as e:
+                # Not fatal: the first query for the collection loads it instead
+                logger.warning(f"Warm-up of collection '{collection}' failed: {str(e)}")
+                result = {'error': str(e)}
+            result['seconds'] = round(time.perf_counter() - collection_started, 3)
+            self.warmup['collections'][collection] = result
+        self.warmup['seconds'] = round(time.perf_counter() - started, 3)
+        self.warmup['ready'] = True
+        logger.info(f"Warm-up finished in {self.warmup['seconds']:.1f}s: {self.warmup['collections']}")
+
+    def watching(self):
+        return self.listener is not None and not self.listener.is_closed()
+
+    def _on_corpus_changed(self, connection, pid, channel, payload):
+        try:
+            collection = json.loads(payload)['collection']
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Ignoring malformed corpus notification: {payload!r}")
+            return
+        if collection in self.indexes:
+            self.indexes[collection].invalidate()
+
+    def _on_listener_closed(self, connection):
+        logger.warning("Corpus change listener disconnected")
+        self.listener = None
+        self._reconnect()
+
+    def _reconnect(self):
+        if not self.stopping:
+            self.listen_task = asyncio.get_running_loop().create_task(self.listen())
+
+    async def embed(self, texts):
+        """Call Mistral Embed API for a list of texts in a single request."""
+        texts = [text[:8000] for text in texts]
+        max_retries = 3
+        retry_delay = 5  # seconds
+        for retry in range(max_retries):
+            response = await self.http.post(
+                MISTRAL_EMBED_API_ENDPOINT,
+                json={"input": texts, "model": "mistral-embed"}
+            )
+            if response.status_code == 429 and retry < max_retries - 1:
+                wait_time = int(response.headers.get('Retry-After', retry_delay * (retry + 1)))
+                logger.warning(f"Rate limit hit, waiting {wait_time} seconds...")
+                await asyncio.sleep(wait_time)
+                continue
+            response.raise_for_status()
+            return [item["embedding"] for item in response.json().get("data", [])]
+
+    def collection_index(self, collection=DEFAULT_COLLECTION):
+        if collection not in self.indexes:
+            self.indexes[collection] = CorpusIndex(self.pool, collection, self.watching)
+        return self.indexes[collection]
+
+    async def retrieve_batch(self, queries, top_ks, filters=None, collection=DEFAULT_COLLECTION):
+        """Embed a batch of queries and rank one collection for all of them at once."""
+        index = self.collection_index(collection)
+        await index.ensure_fresh()
+        if API_VECTORIZER_TYPE == "TF-IDF":
+            if index.vectorizer is None:
+                raise HTTPException(status_code=503, detail="TF-IDF vectorizer is not fitted")
+            query_vectors = await asyncio.to_thread(lambda: index.vectorizer.transform(queries).toarray())
+        else:
+            query_vectors = await self.embed(queries)
+        return await asyncio.to_thread(index.search, list(query_vectors), top_ks, filters)
+
+    async def embed_texts(self, texts, collection=DEFAULT_COLLECTION):
+        if API_VECTORIZER_TYPE == "TF-IDF":
+            index = self.collection_index(collection)
+            if index.vectorizer is None:
+                return None
+            return await asyncio.to_thread(lambda: index.vectorizer.transform(texts).toarray())
+        return await self.embed(texts)
+
+    async def reduce_context(self, query, relevant_chunks, collection=DEFAULT_COLLECTION):
+        """Score cutoff plus query-focused sentence compression; returns (chunks, stats)."""
+        kept = cutoff(relevant_chunks)
+        units = sentence_units(kept)
+        if units:
+            try:
+                vectors = await self.embed_texts([query] + [sentence for _, sentence in units], collection)
+                if vectors is not None and len(vectors) == len(units) + 1:
+                    kept = compress(kept, units, vectors[0], vectors[1:])
+            except httpx.HTTPError as e:
+                logger.warning(f"Sentence embedding failed, using uncompressed context: {str(e)}")
+        stats = context_stats(relevant_chunks, kept)
+        logger.info(f"Context reduction: {stats}")
+        return kept, stats
+
+    async def generate(self, prompt, model, temperature, max_tokens):
+        async with self.generation_slots:
+            started = time.perf_counter()
+            try:
+                response = await self.http.post(MISTRAL_API_ENDPOINT, json={
+                    "model": model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": temperature,
+                    "max_tokens": max_tokens
+                })
+                response.raise_for_status()
+            except httpx.HTTPError:
+                self.router.record(model, time.perf_counter() - started, success=False)
+                raise
+            self.router.record(model, time.perf_counter() - started)
+            return response.json().get("choices", [{}])[0].get("message", {}).get("content", "")
+
+    async def generate_routed(self, decision, prompt, temperature, max_tokens):
+        """Generate with the routed model, retrying once on its fallback; returns (response, model)."""
+        try:
+            return await self.generate(prompt, decision.model, temperature, max_tokens), decision.model
+        except httpx.HTTPError as e:
+            if not decision.fallback:
+                raise
+            logger.warning(f"{decision.model} failed ({str(e)}), falling back to {decision.fallback}")
+            self.router.record_fallback(decision.model, decision.fallback)
+            return await self.generate(prompt, decision.fallback, temperature, max_tokens), decision.fallback
+
+    async def generate_stream(self, prompt, model, temperature, max_tokens):
+        """Yield answer text as Mistral streams it back."""
+        async with self.generation_slots:
+            started = time.perf_counter()
+            async with self.http.stream("POST", MISTRAL_API_ENDPOINT, json={
+                "model": model,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "stream": True
+            }) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    payload = line[len("data: "):]
+                    if payload == "[DONE]":
+                        break
+                    delta = json.loads(payload).get("choices", [{}])[0].get("delta", {})
+                    if delta.get("content"):
+                        yield delta["content"]
+            self.router.record(model, time.perf_counter() - started)
+
+
+def request_collection(request):
+    try:
+        return validate_collection(request.collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def upstream_error(e):
+    """HTTPException for a failed Mistral call: 429 once its rate-limit retries are used up, else 502."""
+    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429:
+        retry_after = e.response.headers.get('Retry-After')
+        return HTTPException(
+            status_code=429,
+            detail="Mistral API rate limit exceeded, retry later",
+            headers={'Retry-After': retry_after} if retry_after else None
+        )
+    return HTTPException(status_code=502, detail=f"Error calling Mistral API: {str(e)}")
+
+
+async def retrieve_chunks(request, collection):
+    """Batched retrieval for a request, with embedding and index errors mapped to HTTP errors."""
+    try:
+        return await service.batcher.submit(
+            request.query, request.top_k, request.filters and request.filters.to_dict(), collection
+        )
+    except httpx.HTTPError as e:
+        logger.error(f"Mistral embedding error: {str(e)}")
+        raise upstream_error(e)
+    except ValueError as e:
+        # The query was embedded in another space than the index, e.g. a dimension mismatch
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def build_prompt(query, relevant_chunks):
+    """Build the same RAG prompt the Streamlit query tab uses."""
+    context = " ".join(chunk["chunk"] for chunk in relevant_chunks)
+    return f"Context: {context}\n\nQuestion: {query}\n\nPlease provide a detailed answer based on the context above."
+
+
+class RetrievalFilters(BaseModel):
+    document_keys: Optional[List[str]] = None
+    file_types: Optional[List[str]] = None
+    collections: Optional[List[str]] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+
+    def to_dict(self):
+        # Timestamps are stored as naive UTC
+        filters = {name: value for name, value in self.model_dump().items() if value is not None}
+        for name in ('uploaded_after', 'uploaded_before'):
+            if name in filters and filters[name].tzinfo is not None:
+                filters[name] = filters[name].astimezone(timezone.utc).replace(tzinfo=None)
+        return filters or None
+
+
+class RetrieveRequest(BaseModel):
+    query: str
+    top_k: int = Field(5, gt=0, le=MAX_TOP_K)
+    collection: str = DEFAULT_COLLECTION
+    filters: Optional[RetrievalFilters] = None
+
+
+class AnswerRequest(BaseModel):
+    query: str
+    top_k: int = Field(5, gt=0, le=MAX_TOP_K)
+    collection: str = DEFAULT_COLLECTION
+    filters: Optional[RetrievalFilters] = None
+    model: str = "open-mistral-7b"  # or "auto" to route by question complexity and latency
+    temperature: float = 0.7
+    max_tokens: int = 980
+    stream: bool = False
+
+
+class ChunkResult(BaseModel):
+    chunk: str
+    similarity: float
+
+
+class RetrieveResponse(BaseModel):
+    results: List[ChunkResult]
+
+
+service = RAGService()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await service.start()
+    try:
+        yield
+    finally:
+        await service.stop()
+
+
+app = FastAPI(title="RAG-DocuMind API", lifespan=lifespan)
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "vectorizer_type": API_VECTORIZER_TYPE,
+        "ready": service.warmup['ready'],
+        "warmup": service.warmup,
+        "listening_for_changes": service.watching(),
+        "collections": {name: len(index.vector_index) for name, index in service.indexes.items()}
+    }
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 503 until the warm-start indexes are loaded."""
+    if not service.warmup['ready']:
+        raise HTTPException(status_code=503, detail="Loading indexes")
+    return {"ready": True, "warmup_seconds": service.warmup['seconds']}
+
+
+@app.get("/metrics")
+async def metrics():
+    return {"routing": service.router.metrics()}
+
+
+@app.post("/retrieve", response_model=RetrieveResponse)
+async def retrieve(request: RetrieveRequest):
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+    results = await retrieve_chunks(request, request_collection(request))
+    return {"results": results}
+
+
+@app.post("/answer")
+async def answer(request: AnswerRequest):
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+    collection = request_collection(request)
+    relevant_chunks = await retrieve_chunks(request, collection)
+    if not relevant_chunks:
+        raise HTTPException(status_code=404, detail="No relevant content found")
+    stats = None
+    if CONTEXT_REDUCTION:
+        relevant_chunks, stats = await service.reduce_context(request.query, relevant_chunks, collection)
+    prompt = build_prompt(request.query, relevant_chunks)
+    decision = service.router.route(request.query, prompt) if request.model == AUTO_MODEL else None
+    model = decision.model if decision else request.model
+
+    if request.stream:
+        headers = {"X-Model": model}
+        if stats:
+            headers["X-Context-Tokens-Saved"] = str(stats['tokens_saved'])
+        return StreamingResponse(
+            service.generate_stream(prompt, model, request.temperature, request.max_tokens),
+            media_type="text/plain",
+            headers=headers
+        )
+
+    try:
+        if decision:
+            response, model = await service.generate_routed(decision, prompt, request.temperature, request.max_tokens)
+        else:
+            response = await service.generate(prompt, model, request.temperature, request.max_tokens)
+    except httpx.HTTPError as e:
+        logger.error(f"Mistral API error: {str(e)}")
+        raise upstream_error(e)
+    return {"response": response, "model": model, "context": relevant_chunks, "context_stats": stats}
@@ -3,22 +3,37 @@ import boto3
 import psycopg2
 import requests
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
-import PyPDF2
-import io
 import os
 from dotenv import load_dotenv
 import logging
-import pickle
 import time  # Add this import
 import re  # Add this import
 import plotly.express as px
-from datetime import datetime
+from datetime import datetime, timezone
 import uuid
 import json
 from streamlit import session_state
-from docx import Document  # Add this import
+from s3_inventory import S3Inventory
+from uploads import DirectUploader
+from text_cache import ExtractedTextCache, join_pages
+from extractors import extract_pages
+from vector_index import VectorIndex
+from llm_scheduler import BACKGROUND, BATCH, INTERACTIVE, RequestScheduler
+from single_flight import SingleFlight, request_fingerprint
+from resilience import CircuitBreaker, CircuitOpenError, Hedger
+from projection import PCAProjection
+from context_reduction import reduce_context
+from model_router import ModelRouter
+from corpus_events import CorpusWatcher
+from warmup import Warmup, serve_readiness
+from snapshots import open_snapshot
+from corpus_collections import (
+    DEFAULT_COLLECTION, VECTOR_SPACES, active_rows_clause, build_index_version, collection_signature, create_collection_tables,
+    list_collections, list_index_versions, load_collection_state, rollback_collection, session_collection,
+    validate_collection, vector_space
+)
 
 # Load environment variables
 load_dotenv()
@@ -41,6 +56,54 @@ POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
 MISTRAL_API_KEY = os.getenv('MISTRAL_API_KEY')
 MISTRAL_API_ENDPOINT = "https://api.mistral.ai/v1/chat/completions"
 MISTRAL_EMBED_API_ENDPOINT = "https://api.mistral.ai/v1/embeddings"
+INDEX_QUANTIZATION = os.getenv('INDEX_QUANTIZATION', 'none')  # none, int8 or binary
+EMBEDDING_PROJECTION_DIM = int(os.getenv('EMBEDDING_PROJECTION_DIM', '0'))  # 0 disables PCA projection
+PROJECTION_RESCORE = os.getenv('PROJECTION_RESCORE', 'true').lower() == 'true'
+
+# Queries are short, so batch retrieval embeds many of them per request
+QUERY_EMBED_BATCH_SIZE = int(os.getenv('QUERY_EMBED_BATCH_SIZE', '128'))
+
+# MMR re-ranking of retrieved chunks: 1.0 ranks by relevance only, lower values favour diversity
+RETRIEVAL_MMR_LAMBDA = float(os.getenv('RETRIEVAL_MMR_LAMBDA', '0.7'))
+MMR_CANDIDATE_FACTOR = int(os.getenv('MMR_CANDIDATE_FACTOR', '4'))
+
+# Trim retrieved context (score cutoff + sentence compression) before generation
+CONTEXT_REDUCTION = os.getenv('CONTEXT_REDUCTION', 'true').lower() == 'true'
+
+# Automatic model selection
+AUTO_MODEL = "auto"
+GENERATION_SLO_SECONDS = float(os.getenv('GENERATION_SLO_SECONDS', '8'))
+
+# Outbound Mistral calls share these slots; batch and background work can't take all of them
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv('MAX_CONCURRENT_LLM_CALLS', '4'))
+MAX_BATCH_LLM_CALLS = int(os.getenv('MAX_BATCH_LLM_CALLS', '3'))
+MAX_BACKGROUND_LLM_CALLS = int(os.getenv('MAX_BACKGROUND_LLM_CALLS', '2'))
+
+# Timeouts (seconds) for Mistral requests, so a stalled connection can't hang a session
+MISTRAL_CONNECT_TIMEOUT = float(os.getenv('MISTRAL_CONNECT_TIMEOUT', '5'))
+MISTRAL_READ_TIMEOUT = float(os.getenv('MISTRAL_READ_TIMEOUT', '60'))
+MISTRAL_EMBED_READ_TIMEOUT = float(os.getenv('MISTRAL_EMBED_READ_TIMEOUT', '30'))
+# Consecutive failures before an endpoint's circuit opens, and how long it stays open
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', '30'))
+# Embedding requests still unanswered after this long (until a p95 is observed) are sent again
+EMBED_HEDGE_DELAY = float(os.getenv('EMBED_HEDGE_DELAY', '2'))
+
+# Per-chunk metadata columns usable as retrieval filters
+METADATA_COLUMNS = ('document_key', 'file_type', 'uploaded_at', 'collection')
+
+# Resident indexes kept per process, one per recently queried collection
+COLLECTION_INDEX_CACHE_SIZE = int(os.getenv('COLLECTION_INDEX_CACHE_SIZE', '8'))
+# Previous index versions of each collection kept for rollback after a rebuild
+INDEX_VERSIONS_RETAINED = int(os.getenv('INDEX_VERSIONS_RETAINED', '1'))
+# Collections whose indexes are loaded in the background when the process starts
+WARM_START_COLLECTIONS = [name.strip() for name in os.getenv('WARM_START_COLLECTIONS', 'default').split(',') if name.strip()]
+# How long warm-up waits for the change listener, so it loads the indexes under the keys queries will use
+WARM_START_LISTENER_WAIT = float(os.getenv('WARM_START_LISTENER_WAIT', '10'))
+# Port of the GET /ready probe, which returns 503 until warm-up finishes; unset disables it
+WARM_START_READY_PORT = os.getenv('WARM_START_READY_PORT')
+# Directory or s3:// URI of exported index snapshots; active versions found there load without reading their rows
+INDEX_SNAPSHOT_ROOT = os.getenv('INDEX_SNAPSHOT_ROOT')
 
 # Initialize S3 Client
 s3_client = boto3.client(
@@ -50,6 +113,93 @@ s3_client = boto3.client(
     region_name=AWS_REGION
 )
 
+# Shared S3 listing cache (survives Streamlit reruns)
+@st.cache_resource
+def get_s3_inventory():
+    return S3Inventory(s3_client, S3_BUCKET_NAME, ttl=int(os.getenv('S3_INVENTORY_TTL', '60')))
+
+@st.cache_resource
+def get_uploader():
+    return DirectUploader(s3_client, S3_BUCKET_NAME, get_s3_inventory())
+
+# One scheduler per process, shared by every session
+@st.cache_resource
+def get_request_scheduler():
+    return RequestScheduler(
+        MAX_CONCURRENT_LLM_CALLS,
+        {BATCH: MAX_BATCH_LLM_CALLS, BACKGROUND: MAX_BACKGROUND_LLM_CALLS}
+    )
+
+# Identical Mistral requests in flight at the same time share one upstream call
+@st.cache_resource
+def get_single_flight():
+    return SingleFlight()
+
+@st.cache_resource
+def get_circuit_breaker(endpoint):
+    return CircuitBreaker(endpoint, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+
+@st.cache_resource
+def get_hedger():
+    return Hedger(default_delay=EMBED_HEDGE_DELAY)
+
+def open_circuits():
+    """Mistral endpoints currently failing fast; non-empty means the app runs in degraded mode."""
+    return [
+        endpoint for endpoint in (MISTRAL_API_ENDPOINT, MISTRAL_EMBED_API_ENDPOINT)
+        if get_circuit_breaker(endpoint).is_open
+    ]
+
+def show_degraded_mode():
+    """Warn that calls to a failing Mistral endpoint are being skipped until it recovers."""
+    circuits = open_circuits()
+    if MISTRAL_API_ENDPOINT in circuits:
+        st.warning("Degraded mode: Mistral text generation is failing, so requests are rejected immediately "
+                   "until it recovers.")
+    if MISTRAL_EMBED_API_ENDPOINT in circuits:
+        st.warning("Degraded mode: Mistral embeddings are failing, so Mistral-Embed processing and retrieval "
+                   "are unavailable until it recovers. TF-IDF still works.")
+
+def post_mistral(endpoint, headers, data, priority=INTERACTIVE, session=None, hedge=False):
+    """POST to Mistral in a scheduler slot; overlapping identical requests of the same priority are sent once.
+    
+    Raises CircuitOpenError without calling the endpoint while its circuit is open. Set hedge only
+    for idempotent requests.
+    """
+    scheduler = get_request_scheduler()
+    breaker = get_circuit_breaker(endpoint)
+    read_timeout = MISTRAL_EMBED_READ_TIMEOUT if endpoint == MISTRAL_EMBED_API_ENDPOINT else MISTRAL_READ_TIMEOUT
+    
+    def send():
+        return requests.post(endpoint, headers=headers, json=data, timeout=(MISTRAL_CONNECT_TIMEOUT, read_timeout))
+    
+    hedger = get_hedger() if hedge else None
+    
+    def attempt():
+        # Hedge inside the slot, so the hedge delay and latency samples cover only the HTTP call
+        # and a request still queueing locally never fires a duplicate
+        with scheduler.slot(priority, session):
+            return hedger.call(send) if hedger else send()
+    return get_single_flight().do(
+        # Keyed by priority too, so an interactive caller never waits behind a background slot
+        request_fingerprint(endpoint, data, priority),
+        lambda: breaker.call(attempt, is_failure=lambda response: response.status_code >= 500)
+    )
+
+def current_session_id():
+    """Fair-queuing key for the calling Streamlit session (worker threads have none)."""
+    try:
+        return st.session_state.setdefault('session_id', str(uuid.uuid4()))
+    except Exception:
+        return None
+
+@st.cache_resource
+def get_text_cache():
+    return ExtractedTextCache(
+        os.getenv('TEXT_CACHE_DIR', '.text_cache'),
+        max_bytes=int(os.getenv('TEXT_CACHE_MAX_MB', '512')) * 1024 * 1024
+    )
+
 # Initialize PostgreSQL Connection
 def get_db_connection():
     try:
@@ -65,12 +215,26 @@ def get_db_connection():
         logger.error(f"Database connection error: {str(e)}")
         raise
 
+# One change listener per process; indexes and answers are cached by the generations it tracks
+@st.cache_resource
+def get_corpus_watcher():
+    return CorpusWatcher(get_db_connection).start()
+
 conn = get_db_connection()
 cur = conn.cursor()
 
 # Initialize database tables
+@st.cache_resource
 def initialize_database():
-    """Initialize database tables with proper error handling."""
+    """Create and migrate the tables once per process.
+    
+    Reruns skip it: ALTER TABLE locks embeddings exclusively, so running it on every rerun would
+    queue each interaction behind any ingest in progress. A failed attempt is not cached and is
+    retried on the next run.
+    """
+    # Own connection, since the cached call outlives the run that made it
+    conn = get_db_connection()
+    cur = conn.cursor()
     try:
         # Create tables with IF NOT EXISTS clause
         cur.execute('''
@@ -81,6 +245,32 @@ def initialize_database():
             )
         ''')
         
+        cur.execute('''
+            ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS embedding_reduced FLOAT[]
+        ''')
+        
+        # Chunk metadata for filtered retrieval
+        cur.execute('''
+            ALTER TABLE embeddings
+                ADD COLUMN IF NOT EXISTS document_key TEXT,
+                ADD COLUMN IF NOT EXISTS file_type TEXT,
+                ADD COLUMN IF NOT EXISTS uploaded_at TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS collection TEXT DEFAULT 'default'
+        ''')
+        for column in METADATA_COLUMNS:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS embeddings_{column}_idx ON embeddings ({column})")
+        
+        # Single-corpus state from before collections; adopted by the default collection
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS projection_state (
+                id INTEGER PRIMARY KEY,
+                projection BYTEA,
+                source_dimension INTEGER,
+                reduced_dimension INTEGER,
+                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
         cur.execute('''
             CREATE TABLE IF NOT EXISTS model_state (
                 id INTEGER PRIMARY KEY,
@@ -89,6 +279,8 @@ def initialize_database():
             )
         ''')
         
+        create_collection_tables(cur)
+        
         # Ensure the tables were created successfully
         cur.execute("""
             SELECT EXISTS (
@@ -111,102 +303,81 @@ def initialize_database():
             
         conn.commit()
         logger.info("Database tables initialized successfully")
+        return True
         
     except Exception as e:
         logger.error(f"Database initialization error: {str(e)}")
         conn.rollback()
         raise
+    finally:
+        conn.close()
 
-# Modified vectorizer initialization with persistence
-@st.cache_resource
-def initialize_vectorizer(vectorizer_type):
-    try:
-        if vectorizer_type == "TF-IDF":
-            # Try to load fitted vectorizer from database
-            cur.execute("SELECT vectorizer FROM model_state WHERE id = 1")
-            result = cur.fetchone()
-            if result and result[0]:
-                vectorizer = pickle.loads(result[0])
-                st.success("Loaded previously fitted TF-IDF vectorizer")
-                return vectorizer, True
-            else:
-                vectorizer = TfidfVectorizer(
-                    max_features=100,
-                    stop_words='english',
-                    lowercase=True,
-                    dtype=np.float32
-                )
-                return vectorizer, False
-        else:
-            # For Mistral-Embed, no need to load from database
-            return None, False
-    except Exception as e:
-        st.error(f"Error initializing vectorizer: {str(e)}")
-        if vectorizer_type == "TF-IDF":
-            vectorizer = TfidfVectorizer(
-                max_features=100,
-                stop_words='english',
-                lowercase=True,
-                dtype=np.float32
-            )
-            return vectorizer, False
-        else:
-            return None, False
+def new_tfidf_vectorizer():
+    return TfidfVectorizer(
+        max_features=100,
+        stop_words='english',
+        lowercase=True,
+        dtype=np.float32
+    )
 
-def extract_text_from_pdf(pdf_content):
-    """Extract text from PDF binary content."""
-    try:
-        pdf_file = io.BytesIO(pdf_content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
-    except Exception as e:
-        logger.error(f"PDF extraction error: {str(e)}")
-        return None
+@st.cache_resource(max_entries=COLLECTION_INDEX_CACHE_SIZE)
+def load_collection_vectorizer(collection, signature):
+    """Fitted TF-IDF vectorizer of a collection's TF-IDF space as of signature, or None."""
+    # Own cursor, since this may also run on the warm-up thread
+    with conn.cursor() as state_cur:
+        state = load_collection_state(state_cur, collection, vector_space("TF-IDF"))
+    return state['vectorizer'] if state else None
 
-def extract_text_from_docx(docx_content):
-    """Extract text from DOCX binary content."""
-    try:
-        doc = Document(io.BytesIO(docx_content))
-        text = []
-        for paragraph in doc.paragraphs:
-            text.append(paragraph.text)
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    text.append(cell.text)
-        return '\n'.join(text)
-    except Exception as e:
-        logger.error(f"DOCX extraction error: {str(e)}")
+def get_vectorizer(collection=DEFAULT_COLLECTION):
+    return load_collection_vectorizer(collection, get_corpus_signature(collection, "TF-IDF"))
+
+def extract_document_text(document_key, document_content, etag=None):
+    """Extract text from document bytes, reusing the cached extraction for this key and ETag."""
+    cached = get_text_cache().get(document_key, etag)
+    if cached:
+        return cached[0]
+    
+    pages = extract_pages(document_key, document_content)
+    if pages is None:
         return None
+    text, page_offsets = join_pages(pages)
+    get_text_cache().put(document_key, etag, text, page_offsets)
+    return text
 
-def load_document_from_s3(bucket_name, document_key):
+def load_document_from_s3(bucket_name, document_key, etag=None):
     """Load document from S3 and handle multiple document types."""
     try:
+        # Skip the download entirely when this version was already extracted
+        cached = get_text_cache().get(document_key, etag)
+        if cached:
+            return cached[0]
+        
         response = s3_client.get_object(Bucket=bucket_name, Key=document_key)
+        etag = response['ETag'].strip('"')
+        cached = get_text_cache().get(document_key, etag)
+        if cached:
+            response['Body'].close()
+            return cached[0]
+        
         document_content = response['Body'].read()
         
         # Log document details for debugging
         logger.info(f"Loading document: {document_key}, Size: {len(document_content)} bytes")
         
-        file_extension = document_key.lower().split('.')[-1]
-        
-        if file_extension == 'pdf':
-            return extract_text_from_pdf(document_content)
-        elif file_extension in ['docx', 'doc']:
-            return extract_text_from_docx(document_content)
-        else:
-            try:
-                return document_content.decode('utf-8')
-            except UnicodeDecodeError:
-                return document_content.decode('latin-1')
+        return extract_document_text(document_key, document_content, etag)
     except Exception as e:
         logger.error(f"Error loading document from S3: {str(e)}")
         st.error(f"Error loading document {document_key}: {str(e)}")
         return None
 
+def load_document(document_key, etag=None):
+    """Load document text, reusing bytes uploaded in this session instead of downloading them again."""
+    uploaded = st.session_state.get('uploaded_documents', {}).get(document_key)
+    if uploaded and (etag is None or uploaded['etag'] == etag):
+        logger.info(f"Using uploaded bytes for {document_key}, Size: {len(uploaded['content'])} bytes")
+        return extract_document_text(document_key, uploaded['content'], uploaded['etag'])
+    return load_document_from_s3(S3_BUCKET_NAME, document_key, etag)
+
 def chunk_document_fixed_size(document, chunk_size=512, overlap=50):
     """Fixed-size chunking with sliding window."""
     if not document:
@@ -287,16 +458,20 @@ def chunk_document(document, chunking_strategy, chunk_size=512, overlap=50):
     else:
         return chunk_document_sentence(document)
 
-def call_mistral_embed_api(texts):
-    """Call Mistral Embed API to get embeddings."""
+def call_mistral_embed_api(texts, batch_size=5, priority=INTERACTIVE, session=None):
+    """Call Mistral Embed API to get embeddings, batch_size texts per request.
+
+    Each request waits for a scheduler slot in its priority class, so ingestion yields to queries
+    between batches.
+    """
+    session = session or current_session_id()
     try:
         # Ensure texts are non-empty and properly formatted
         texts = [text[:8000] for text in texts if text.strip()]  # Limit text length to 8000 chars
         if not texts:
             raise ValueError("No valid texts provided for embedding.")
         
-        # Process in smaller batches with delay between calls
-        batch_size = 5  # Reduced batch size
+        # Process in batches with delay between calls
         all_embeddings = []
         
         for i in range(0, len(texts), batch_size):
@@ -319,7 +494,7 @@ def call_mistral_embed_api(texts):
             
             for retry in range(max_retries):
                 try:
-                    response = requests.post(MISTRAL_EMBED_API_ENDPOINT, headers=headers, json=data)
+                    response = post_mistral(MISTRAL_EMBED_API_ENDPOINT, headers, data, priority, session, hedge=True)
                     
                     if response.status_code == 429:  # Too Many Requests
                         wait_time = int(response.headers.get('Retry-After', retry_delay * (retry + 1)))
@@ -339,12 +514,16 @@ def call_mistral_embed_api(texts):
                     if response.status_code != 429 or retry == max_retries - 1:
                         raise
                 
+                except CircuitOpenError:
+                    raise
+                
                 except Exception as e:
                     if retry == max_retries - 1:
                         raise
             
             # Add delay between batches to avoid rate limits
-            time.sleep(1)  # 1 second delay between batches
+            if i + batch_size < len(texts):
+                time.sleep(1)  # 1 second delay between batches
             
         return all_embeddings
         
@@ -358,179 +537,357 @@ def call_mistral_embed_api(texts):
         st.error(f"Mistral Embed API error: {str(e)}")
         return []
 
-def store_embeddings(chunks, vectorizer_type):
-    """Store document chunks and their embeddings with vectorizer persistence."""
+def fit_projection(embeddings):
+    """Fit a PCA projection for this corpus; returns (projection or None, reduced vector per embedding)."""
+    if not EMBEDDING_PROJECTION_DIM or not embeddings or len(embeddings[0]) <= EMBEDDING_PROJECTION_DIM:
+        return None, [None] * len(embeddings)
+    
+    projection = PCAProjection.fit(embeddings, EMBEDDING_PROJECTION_DIM)
+    logger.info(f"Fitted PCA projection {projection.source_dimension} -> {projection.dimension} dims")
+    return projection, projection.transform(embeddings).tolist()
+
+def chunk_metadata(document_key, uploaded_at=None, collection=DEFAULT_COLLECTION):
+    """Filterable metadata stored alongside each chunk of a document."""
+    # Stored as naive UTC so it compares directly with the TIMESTAMP column
+    uploaded_at = uploaded_at or datetime.now(timezone.utc)
+    if uploaded_at.tzinfo is not None:
+        uploaded_at = uploaded_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return {
+        'document_key': document_key,
+        'file_type': document_key.lower().split('.')[-1] if '.' in document_key else None,
+        'uploaded_at': uploaded_at,
+        'collection': collection
+    }
+
+def insert_chunk(cursor, chunk, embedding, reduced, metadata, version):
+    metadata = metadata or {}
+    cursor.execute("""
+        INSERT INTO embeddings (chunk, embedding, embedding_reduced, document_key, file_type, uploaded_at, collection,
+                                index_version)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """, (
+        chunk, embedding, reduced,
+        metadata.get('document_key'), metadata.get('file_type'),
+        metadata.get('uploaded_at'), metadata.get('collection', DEFAULT_COLLECTION), version
+    ))
+
+def store_embeddings(chunks, vectorizer_type, metadata=None, collection=DEFAULT_COLLECTION):
+    """Replace a collection's chunks, embeddings and vectorizer state.
+    
+    metadata is either one chunk_metadata() dict for all chunks or a list with one per chunk.
+    The new contents are built as a new index version beside the active one, which keeps serving
+    queries until the cutover; other collections are unaffected.
+    """
+    if not isinstance(metadata, list):
+        metadata = [metadata] * len(chunks)
+    valid = [(chunk, chunk_info) for chunk, chunk_info in zip(chunks, metadata) if chunk.strip()]
+    if not valid:
+        st.error("No valid text content found in chunks")
+        return False
+    
+    if vectorizer_type == "TF-IDF":
+        # Fit on the whole collection, then embed every chunk
+        vectorizer = new_tfidf_vectorizer()
+        vectorizer.fit([" ".join(chunk for chunk, _ in valid)])
+        embeddings = [vectorizer.transform([chunk]).toarray()[0].tolist() for chunk, _ in valid]
+    else:
+        vectorizer = None
+        # Use Mistral-Embed API to get embeddings
+        embeddings = call_mistral_embed_api([chunk for chunk, _ in valid], priority=BACKGROUND)
+        if len(embeddings) != len(valid):
+            st.error("Failed to get embeddings from Mistral-Embed API")
+            return False
+    
+    # Every version is one fixed-dimension vector space
+    dimension = len(embeddings[0])
+    if any(len(embedding) != dimension for embedding in embeddings):
+        st.error(f"{vectorizer_type} returned embeddings of different dimensions")
+        return False
+    
+    # Embed every chunk first so the optional projection is fitted on the whole corpus
+    projection, reduced_embeddings = fit_projection(embeddings)
+    
+    def write_chunks(ingest_cur, version):
+        for (chunk, chunk_info), embedding, reduced in zip(valid, embeddings, reduced_embeddings):
+            insert_chunk(ingest_cur, chunk, embedding, reduced, {**(chunk_info or {}), 'collection': collection}, version)
+    
+    ingest_conn = get_db_connection()
     try:
-        # Clear existing embeddings
-        cur.execute("DELETE FROM embeddings")
-        
-        if vectorizer_type == "TF-IDF":
-            # Combine all chunks to fit vectorizer
-            all_text = " ".join(chunks)
-            
-            # Fit the vectorizer and store it
-            vectorizer.fit([all_text])
-            vectorizer_binary = pickle.dumps(vectorizer)
-            
-            # Store or update the vectorizer in the database
-            cur.execute("""
-                INSERT INTO model_state (id, vectorizer)
-                VALUES (1, %s)
-                ON CONFLICT (id) 
-                DO UPDATE SET vectorizer = EXCLUDED.vectorizer, last_updated = CURRENT_TIMESTAMP
-            """, (vectorizer_binary,))
-            
-            successful_inserts = 0
-            failed_inserts = 0
-            
-            for chunk in chunks:
-                if not chunk.strip():
-                    continue
-                    
-                embedding = vectorizer.transform([chunk]).toarray()[0].tolist()
-                try:
-                    cur.execute(
-                        "INSERT INTO embeddings (chunk, embedding) VALUES (%s, %s)",
-                        (chunk, embedding)
-                    )
-                    successful_inserts += 1
-                except Exception as e:
-                    failed_inserts += 1
-                    st.error(f"Failed to insert chunk: {str(e)}")
-            
-            conn.commit()
-            st.success(f"Successfully processed {successful_inserts} chunks")
-            if failed_inserts > 0:
-                st.warning(f"Failed to process {failed_inserts} chunks")
-            
-            return True
-        else:
-            # Use Mistral-Embed API to get embeddings
-            embeddings = call_mistral_embed_api(chunks)
-            if not embeddings:
-                st.error("Failed to get embeddings from Mistral-Embed API")
-                return False
-            
-            successful_inserts = 0
-            failed_inserts = 0
-            
-            for chunk, embedding in zip(chunks, embeddings):
-                if not chunk.strip():
-                    continue
-                try:
-                    cur.execute(
-                        "INSERT INTO embeddings (chunk, embedding) VALUES (%s, %s)",
-                        (chunk, embedding)
-                    )
-                    successful_inserts += 1
-                except Exception as e:
-                    failed_inserts += 1
-                    st.error(f"Failed to insert chunk: {str(e)}")
-            
-            conn.commit()
-            st.success(f"Successfully processed {successful_inserts} chunks")
-            if failed_inserts > 0:
-                st.warning(f"Failed to process {failed_inserts} chunks")
-            
-            return True
-        
+        version = build_index_version(
+            ingest_conn, collection, vectorizer_type, dimension, write_chunks, vectorizer, projection,
+            INDEX_VERSIONS_RETAINED
+        )
+        st.success(f"Successfully processed {len(embeddings)} chunks into collection '{collection}' (version {version})")
+        return True
     except Exception as e:
         st.error(f"Error in store_embeddings: {str(e)}")
-        conn.rollback()
         return False
+    finally:
+        ingest_conn.close()
+
+def get_corpus_signature(collection=DEFAULT_COLLECTION, vectorizer_type=None):
+    """Cheap fingerprint of a collection's vector space, used to know when to rebuild its index.
+    
+    It comes from the change listener without touching the database, or from the database while
+    the listener is disconnected. vectorizer_type selects the space; None means the most recently built one.
+    """
+    token = get_corpus_watcher().token(collection)
+    if token is not None:
+        return token
+    with conn.cursor() as signature_cur:
+        return collection_signature(signature_cur, collection, vector_space(vectorizer_type))
 
-def retrieve_relevant_chunks(query, vectorizer_type, top_k=5):
-    """Retrieve relevant chunks using cosine similarity."""
+@st.cache_resource(max_entries=COLLECTION_INDEX_CACHE_SIZE)
+def load_vector_index(collection, vectorizer_type, signature, mode):
+    """Build the resident retrieval index for the active version of one vector space of a collection."""
+    started = time.perf_counter()
+    # Own cursor, since this may also run on the warm-up thread
+    with conn.cursor() as index_cur:
+        state = load_collection_state(index_cur, collection, vector_space(vectorizer_type))
+    snapshot = load_index_snapshot(collection, state)
+    if snapshot is not None:
+        # Full vectors stay memory-mapped from the snapshot file and are paged in as they are scanned
+        index = VectorIndex(
+            snapshot.ids,
+            snapshot.chunks,
+            snapshot.vectors,
+            mode=mode,
+            projection=snapshot.projection,
+            reduced_vectors=snapshot.reduced_vectors,
+            rescore=PROJECTION_RESCORE,
+            metadata=snapshot.metadata,
+            normalized=snapshot.normalized
+        )
+        logger.info(f"Loaded {len(index)} {vectorizer_type or 'latest'} chunks of '{collection}' into {mode} index "
+                    f"from snapshot in {time.perf_counter() - started:.1f}s")
+        return index
+
+    with conn.cursor() as index_cur:
+        # A version holds one space, so its rows form a homogeneous matrix; rows of another dimension
+        # can only come from data stored before spaces were recorded and are left out here
+        index_cur.execute("""
+            SELECT id, chunk, embedding, embedding_reduced, document_key, file_type, uploaded_at, collection
+            FROM embeddings
+            WHERE collection = %s AND index_version = %s AND array_length(embedding, 1) = %s AND chunk <> ''
+            ORDER BY id
+        """, (collection, state and state['version'], state and state['dimension']))
+        rows = index_cur.fetchall()
+    
+    # Use the projection fitted at ingest so queries are reduced with the same matrix
+    reduced_vectors = None
+    projection = state['projection'] if state else None
+    if projection is not None and rows:
+        if projection.source_dimension != state['dimension']:
+            projection = None
+        elif all(row[3] and len(row[3]) == projection.dimension for row in rows):
+            reduced_vectors = [row[3] for row in rows]
+    
+    index = VectorIndex(
+        [row[0] for row in rows],
+        [row[1] for row in rows],
+        [row[2] for row in rows],
+        mode=mode,
+        projection=projection,
+        reduced_vectors=reduced_vectors,
+        rescore=PROJECTION_RESCORE,
+        metadata={
+            column: [row[position] for row in rows]
+            for position, column in enumerate(METADATA_COLUMNS, start=4)
+        }
+    )
+    logger.info(f"Loaded {len(index)} {vectorizer_type or 'latest'} chunks of '{collection}' into {mode} index "
+                f"in {time.perf_counter() - started:.1f}s ({index.memory_bytes() / 1024 / 1024:.1f} MB resident)")
+    return index
+
+def load_index_snapshot(collection, state):
+    """Snapshot of the active version described by state under INDEX_SNAPSHOT_ROOT, or None to read Postgres."""
+    if not INDEX_SNAPSHOT_ROOT or state is None:
+        return None
     try:
+        return open_snapshot(INDEX_SNAPSHOT_ROOT, collection, state['version'])
+    except Exception as e:
+        logger.warning(f"Loading '{collection}' version {state['version']} from Postgres, its snapshot failed: {str(e)}")
+        return None
+
+def warm_collection_index(collection, vectorizer_type):
+    """Load one vector space's index (and TF-IDF vectorizer) into the shared cache; returns its chunk count."""
+    index = load_vector_index(
+        collection, vectorizer_type, get_corpus_signature(collection, vectorizer_type), INDEX_QUANTIZATION
+    )
+    if vectorizer_type == "TF-IDF":
+        get_vectorizer(collection)
+    return len(index)
+
+@st.cache_resource
+def get_warmup():
+    """Preloads WARM_START_COLLECTIONS once per process; every session then shares the resident indexes."""
+    def plan():
+        if not get_corpus_watcher().wait_connected(WARM_START_LISTENER_WAIT):
+            logger.warning("Warming up without the change listener; indexes may load again once it connects")
+        return [
+            (f"{collection}/{vectorizer_type}", lambda c=collection, v=vectorizer_type: warm_collection_index(c, v))
+            for collection in WARM_START_COLLECTIONS
+            for vectorizer_type in VECTOR_SPACES
+        ]
+    return Warmup(plan).start()
+
+@st.cache_resource
+def get_readiness_server():
+    """GET /ready on WARM_START_READY_PORT for the deployment's readiness probe; Streamlit's own health check doesn't wait for warm-up."""
+    return serve_readiness(get_warmup(), int(WARM_START_READY_PORT))
+
+def embed_texts(texts, vectorizer_type, collection=DEFAULT_COLLECTION):
+    """Embed texts with the collection's vectorizer in as few requests as possible."""
+    if vectorizer_type == "TF-IDF":
+        vectorizer = get_vectorizer(collection)
+        if vectorizer is None:
+            return None
+        return vectorizer.transform(texts).toarray()
+    return call_mistral_embed_api(texts, batch_size=max(len(texts), 1))
+
+def retrieve_relevant_chunks(query, vectorizer_type, top_k=5, filters=None, collection=DEFAULT_COLLECTION):
+    """Retrieve relevant chunks of one collection using cosine similarity.
+    
+    filters (document_keys, file_types, uploaded_after, uploaded_before) restrict the candidate
+    rows before scoring.
+    """
+    return retrieve_relevant_chunks_batch([query], vectorizer_type, top_k, filters, collection=collection)[0]
+
+def retrieve_relevant_chunks_batch(queries, vectorizer_type, top_k=5, filters=None, mmr_lambda=None,
+                                   collection=DEFAULT_COLLECTION):
+    """Retrieve relevant chunks for many queries at once.
+    
+    All queries are embedded together and scored against the index in blocks, which is far
+    faster than calling retrieve_relevant_chunks in a loop. Returns one result list per query
+    (empty for blank queries). filters apply to every query, as in retrieve_relevant_chunks.
+    Results are re-ranked with MMR (mmr_lambda, default RETRIEVAL_MMR_LAMBDA) so near-duplicate
+    chunks don't crowd out other passages.
+    """
+    mmr_lambda = RETRIEVAL_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    results = [[] for _ in queries]
+    try:
+        positions = [i for i, query in enumerate(queries) if query and query.strip()]
+        if not positions:
+            return results
+        texts = [queries[i] for i in positions]
+        
+        # Search the resident index of the selected vectorizer's space; it is rebuilt only when that space changes
+        index = load_vector_index(
+            collection, vectorizer_type, get_corpus_signature(collection, vectorizer_type), INDEX_QUANTIZATION
+        )
+        if not len(index):
+            st.warning(
+                f"No {vectorizer_type} embeddings found for this collection. "
+                f"Please embed the documents with {vectorizer_type} first."
+            )
+            return results
+        
+        rows = index.filter_rows(filters)
+        if rows is not None and not len(rows):
+            st.warning("No chunks match the selected filters.")
+            return results
+        
         if vectorizer_type == "TF-IDF":
-            if not hasattr(vectorizer, 'vocabulary_'):
+            vectorizer = get_vectorizer(collection)
+            if vectorizer is None:
                 st.error("Vectorizer not fitted! Please initialize document embeddings first.")
-                return []
+                return results
             
-            # Generate query embedding
-            query_embedding = vectorizer.transform([query]).toarray()[0].tolist()
+            # Generate query embeddings
+            query_embeddings = vectorizer.transform(texts).toarray()
         else:
-            # Use Mistral-Embed API to get query embedding
-            query_embeddings = call_mistral_embed_api([query])
-            if not query_embeddings:
-                return []
-            query_embedding = query_embeddings[0]
-        
-        # Fetch all embeddings
-        cur.execute("SELECT chunk, embedding FROM embeddings")
-        rows = cur.fetchall()
-        
-        if not rows:
-            st.warning("No embeddings found in database. Please initialize document embeddings first.")
-            return []
-        
-        # Split chunks and embeddings
-        chunks = []
-        embeddings = []
-        for row in rows:
-            if row[0] and row[1]:
-                chunks.append(row[0])
-                # Ensure embedding is a list of floats with consistent length
-                embedding = [float(x) for x in row[1]]
-                embeddings.append(embedding)
-        
-        if not chunks:
-            st.warning("No valid chunks found in database")
-            return []
-        
-        # Ensure all embeddings have the same length
-        embedding_length = len(embeddings[0])
-        embeddings = [emb for emb in embeddings if len(emb) == embedding_length]
-        
-        # Convert to numpy array with explicit dtype
-        embeddings_array = np.array(embeddings, dtype=np.float32)
-        query_embedding_array = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
-        
-        # Calculate similarities
-        similarities = cosine_similarity(query_embedding_array, embeddings_array)[0]
-        
-        # Get top results
-        top_indices = np.argsort(similarities)[-top_k:][::-1]
-        results = [{"chunk": chunks[i], "similarity": float(similarities[i])} for i in top_indices]
+            # Use Mistral-Embed API, many queries per request
+            query_embeddings = call_mistral_embed_api(texts, batch_size=QUERY_EMBED_BATCH_SIZE)
+            if len(query_embeddings) != len(texts):
+                return results
         
+        if mmr_lambda < 1:
+            matches = index.search_diverse(query_embeddings, top_k, mmr_lambda, MMR_CANDIDATE_FACTOR, rows=rows)
+        else:
+            matches = index.search(query_embeddings, top_k, rows=rows)
+        for position, query_matches in zip(positions, matches):
+            results[position] = [
+                {"chunk": index.chunks[row], "similarity": similarity} for row, similarity in query_matches
+            ]
         return results
         
     except Exception as e:
-        st.error(f"Error in retrieve_relevant_chunks: {str(e)}")
+        st.error(f"Error in retrieve_relevant_chunks_batch: {str(e)}")
         logger.error(f"Error retrieving chunks: {str(e)}")
-        return []
+        return results
+
+@st.cache_resource
+def get_model_router():
+    """Shared across sessions so latency observations from every user inform routing."""
+    return ModelRouter(slo_seconds=GENERATION_SLO_SECONDS)
+
+def call_mistral_completion(prompt, model, temperature, max_tokens, priority=INTERACTIVE, session=None):
+    """Call Mistral API, retrying on rate limits; raises on failure.
+    
+    Returns (content, seconds), seconds being the successful attempt's HTTP time alone, without
+    scheduler queueing or rate-limit backoff, so the router's latency stats reflect the model.
+    """
+    headers = {
+        "Authorization": f"Bearer {MISTRAL_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+    max_retries = 3
+    retry_delay = 5  # seconds
+    session = session or current_session_id()
+    for retry in range(max_retries):
+        response = post_mistral(MISTRAL_API_ENDPOINT, headers, data, priority, session)
+        if response.status_code == 429 and retry < max_retries - 1:
+            wait_time = int(response.headers.get('Retry-After', retry_delay * (retry + 1)))
+            logger.warning(f"Rate limit hit, waiting {wait_time} seconds...")
+            time.sleep(wait_time)
+            continue
+        response.raise_for_status()
+        content = response.json().get("choices", [{}])[0].get("message", {}).get("content", "")
+        return content, response.elapsed.total_seconds()
 
 def call_mistral_api(prompt, model, temperature, max_tokens):
     """Call Mistral API with error handling."""
+    started = time.perf_counter()
     try:
-        headers = {
-            "Authorization": f"Bearer {MISTRAL_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": model,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": temperature,
-            "max_tokens": max_tokens
-        }
-        response = requests.post(MISTRAL_API_ENDPOINT, headers=headers, json=data)
-        response.raise_for_status()
-        return response.json().get("choices", [{}])[0].get("message", {}).get("content", "")
+        response, seconds = call_mistral_completion(prompt, model, temperature, max_tokens)
+        get_model_router().record(model, seconds)
+        return response
     except Exception as e:
+        get_model_router().record(model, time.perf_counter() - started, success=False)
         logger.error(f"Mistral API error: {str(e)}")
         return f"Error calling Mistral API: {str(e)}"
 
-def diagnose_document_processing(vectorizer_type):
+def call_routed_mistral_api(query, prompt, temperature, max_tokens):
+    """Generate with the model the router picks for this query; returns (response, model, decision)."""
+    router = get_model_router()
+    decision = router.route(query, prompt)
+    logger.info(f"Routing decision: {decision}")
+    try:
+        response, model = router.call(
+            decision, lambda model: call_mistral_completion(prompt, model, temperature, max_tokens)
+        )
+        return response, model, decision
+    except Exception as e:
+        logger.error(f"Mistral API error: {str(e)}")
+        return f"Error calling Mistral API: {str(e)}", decision.model, decision
+
+def diagnose_document_processing(vectorizer_type, collection=DEFAULT_COLLECTION):
     """Diagnostic function to check document processing pipeline."""
     with st.expander("Diagnostics Results", expanded=True):
         st.write("Running diagnostics...")
         
         # Check S3 connection
         try:
-            response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME, Prefix=S3_DOCUMENT_KEY)
+            objects = get_s3_inventory().list_objects(prefixes=[S3_DOCUMENT_KEY], suffixes=None, refresh=True)
             st.write("✅ S3 connection successful")
-            if 'Contents' in response:
-                st.write(f"Found {len(response['Contents'])} objects with prefix {S3_DOCUMENT_KEY}")
+            if objects:
+                st.write(f"Found {len(objects)} objects with prefix {S3_DOCUMENT_KEY}")
             else:
                 st.warning(f"No objects found with prefix {S3_DOCUMENT_KEY}")
         except Exception as e:
@@ -539,7 +896,8 @@ def diagnose_document_processing(vectorizer_type):
         # Check vectorizer/embedding state
         try:
             if vectorizer_type == "TF-IDF":
-                if hasattr(vectorizer, 'vocabulary_'):
+                vectorizer = get_vectorizer(collection)
+                if vectorizer is not None:
                     st.write("✅ TF-IDF Vectorizer is fitted")
                     st.write(f"Vocabulary size: {len(vectorizer.vocabulary_)}")
                 else:
@@ -551,12 +909,13 @@ def diagnose_document_processing(vectorizer_type):
         
         # Check database state
         try:
-            cur.execute("SELECT COUNT(*) FROM embeddings")
+            active_rows, params = active_rows_clause(collection, vector_space(vectorizer_type))
+            cur.execute(f"SELECT COUNT(*) FROM embeddings WHERE {active_rows}", params)
             count = cur.fetchone()[0]
-            st.write(f"✅ Database connected, found {count} embeddings")
+            st.write(f"✅ Database connected, found {count} {vectorizer_type} embeddings in collection '{collection}'")
             
             if count > 0:
-                cur.execute("SELECT chunk FROM embeddings LIMIT 1")
+                cur.execute(f"SELECT chunk FROM embeddings WHERE {active_rows} LIMIT 1", params)
                 sample_chunk = cur.fetchone()[0]
                 st.write("Sample chunk preview:")
                 st.write(sample_chunk[:200] + "...")
@@ -570,6 +929,8 @@ def init_session_state():
         st.session_state.session_id = str(uuid.uuid4())
     if 'cache' not in st.session_state:
         st.session_state.cache = {}
+    if 'uploaded_documents' not in st.session_state:
+        st.session_state.uploaded_documents = {}
 
 @st.cache_data(ttl=3600)
 def get_cached_response(prompt, context):
@@ -618,10 +979,11 @@ def file_uploader_ui():
         progress_bar = st.progress(0)
         
         successful_uploads = 0
+        skipped_uploads = 0
         failed_uploads = 0
-        total_files = len(uploaded_files)
+        documents = []
         
-        for idx, file in enumerate(uploaded_files):
+        for file in uploaded_files:
             try:
                 # Validate file
                 if not file:
@@ -639,29 +1001,10 @@ def file_uploader_ui():
                 if file_extension not in ALLOWED_TYPES:
                     raise ValueError(f"Unsupported file type: {file_extension}")
                 
-                progress = (idx + 1) / total_files
-                progress_bar.progress(progress)
-                upload_status.text(f"Uploading {file.name}... ({idx + 1}/{total_files})")
-                
                 file.seek(0)
                 
                 # Upload directly to bucket root
-                s3_key = file.name
-                
-                try:
-                    s3_client.upload_fileobj(
-                        file,
-                        S3_BUCKET_NAME,
-                        s3_key,
-                        ExtraArgs={
-                            'ContentType': ALLOWED_TYPES.get(file_extension, 'application/octet-stream')
-                        }
-                    )
-                except Exception as s3_error:
-                    raise ValueError(f"S3 upload failed: {str(s3_error)}")
-                
-                successful_uploads += 1
-                st.success(f"✅ Successfully uploaded {file.name}")
+                documents.append((file.name, file.read(), ALLOWED_TYPES.get(file_extension, 'application/octet-stream')))
                 
             except Exception as e:
                 failed_uploads += 1
@@ -671,16 +1014,43 @@ def file_uploader_ui():
                 logger.exception("Detailed error traceback:")
                 continue
         
+        # Upload concurrently; identical content already in the bucket is skipped
+        upload_status.text(f"Uploading {len(documents)} files...")
+        for idx, result in enumerate(get_uploader().upload(documents)):
+            progress_bar.progress((idx + 1) / len(documents))
+            
+            if result['status'] == 'failed':
+                failed_uploads += 1
+                error_msg = f"❌ Failed to upload {result['requested_key']}: S3 upload failed: {result['error']}"
+                st.error(error_msg)
+                logger.error(f"Upload error: {error_msg}")
+                continue
+            
+            # Keep the bytes so ingestion can use them without downloading from S3
+            st.session_state.uploaded_documents[result['key']] = {
+                'etag': result['etag'],
+                'content': result['content']
+            }
+            
+            if result['status'] == 'skipped':
+                skipped_uploads += 1
+                st.info(f"⏭️ {result['requested_key']} is already stored as {result['key']}")
+            else:
+                successful_uploads += 1
+                st.success(f"✅ Successfully uploaded {result['key']}")
+        
         progress_bar.empty()
         upload_status.empty()
         
         if successful_uploads > 0:
             st.success(f"🎉 Successfully uploaded {successful_uploads} files")
+        if skipped_uploads > 0:
+            st.info(f"Skipped {skipped_uploads} files already in the bucket")
         if failed_uploads > 0:
             st.warning(f"⚠️ Failed to upload {failed_uploads} files")
             st.info("Please check file size, format, and try again")
         
-        return successful_uploads > 0
+        return successful_uploads + skipped_uploads > 0
 
 def main():
     # Initialize session state
@@ -704,6 +1074,15 @@ def main():
     # Center-aligned title with smaller size
     st.markdown("<h2 style='text-align: center;'>RAG-DocuMind: Intelligent Document Analysis & Response Platform</h2>", unsafe_allow_html=True)
     
+    show_degraded_mode()
+    
+    # Indexes load in the background from the first run in this process, which the script health check
+    # triggers at boot; queries meanwhile wait for them
+    if WARM_START_READY_PORT:
+        get_readiness_server()
+    if not get_warmup().ready:
+        st.info("Loading document indexes in the background. The first answers may take a little longer.")
+    
     # Application description
     st.markdown("""
         <div style='text-align: center; max-width: 800px; margin: 0 auto; margin-bottom: 20px;'>
@@ -739,6 +1118,27 @@ def main():
         with left_col:
             st.markdown("### Processing Configuration")
             
+            # Documents are embedded into, and questions answered from, one collection only
+            private_collection = st.checkbox("Private collection for this session", value=False)
+            if private_collection:
+                collection = session_collection(st.session_state.session_id)
+                st.caption(f"Collection: {collection}")
+            else:
+                collection_input = st.text_input(
+                    "Collection:",
+                    value=st.session_state.get('collection', DEFAULT_COLLECTION),
+                    help="Use one collection per team; embedding documents replaces only this collection"
+                )
+                try:
+                    collection = validate_collection(collection_input)
+                    st.session_state.collection = collection
+                except ValueError as e:
+                    st.error(str(e))
+                    collection = st.session_state.get('collection', DEFAULT_COLLECTION)
+                existing = [name for name, _ in list_collections(cur)]
+                if existing:
+                    st.caption("Existing collections: " + ", ".join(existing))
+            
             vectorizer_type = st.selectbox(
                 "Choose Vectorizer or Embed Model:",
                 ["TF-IDF", "Mistral-Embed"]
@@ -750,21 +1150,41 @@ def main():
                 help="Fixed-Size: Overlapping chunks of consistent size\nSentence-Based: Chunks that preserve sentence boundaries"
             )
             
-            # Initialize vectorizer
-            global vectorizer
-            vectorizer, is_fitted = initialize_vectorizer(vectorizer_type)
-
-            if vectorizer_type == "TF-IDF" and not is_fitted:
+            if vectorizer_type == "TF-IDF" and get_vectorizer(collection) is None:
                 st.warning("⚠️ Not initialized!")
             
             # Document processing controls
             process_button = st.button("Embed Documents", use_container_width=True)
             diagnose_button = st.button("Run Diagnostics", use_container_width=True)
             
+            with st.expander("Index versions"):
+                versions = list_index_versions(cur, collection)
+                if versions:
+                    st.dataframe(
+                        pd.DataFrame(versions)[
+                            ['version', 'status', 'embedding_model', 'model_version', 'dimension', 'chunk_count', 'activated_at']
+                        ],
+                        hide_index=True
+                    )
+                else:
+                    st.caption("No index built for this collection yet")
+                space = vector_space(vectorizer_type)
+                if any(version['status'] == 'retired' and (version['embedding_model'], version['model_version']) == space
+                       for version in versions):
+                    if st.button(f"Roll back {vectorizer_type} to previous version", use_container_width=True):
+                        try:
+                            restored = rollback_collection(cur, collection, space)
+                            conn.commit()
+                            st.success(f"Collection '{collection}' now serves version {restored}")
+                        except Exception as e:
+                            conn.rollback()
+                            st.error(f"Rollback failed: {str(e)}")
+            
             st.markdown("### Generation Settings")
             model = st.selectbox(
                 "Choose a Model:",
-                ["open-mistral-7b", "mistral-small-latest", "codestral-latest"]
+                [AUTO_MODEL, "open-mistral-7b", "mistral-small-latest", "codestral-latest"],
+                help="auto picks a model per question from its complexity and current model latency"
             )
             
             col1, col2 = st.columns(2)
@@ -792,38 +1212,37 @@ def main():
                 with progress_container:
                     with st.spinner("Processing documents..."):
                         try:
-                            # List all objects in S3 bucket root
-                            objects = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME)
-                            
-                            # Filter for supported document types
-                            supported_files = [
-                                obj for obj in objects.get('Contents', [])
-                                if obj['Key'].lower().endswith(('.pdf', '.txt', '.doc', '.docx'))
-                            ]
+                            # List all supported documents in the bucket (paginated, cached briefly)
+                            supported_files = get_s3_inventory().list_objects()
                             
                             total_docs = len(supported_files)
                             
                             if total_docs > 0:
                                 st.info(f"Found {total_docs} documents to process")
                                 
+                                all_chunks = []
+                                all_metadata = []
                                 for obj in supported_files:
-                                    document_key = obj['Key']
+                                    document_key = obj['key']
                                     st.text(f"Processing: {document_key}")
                                     
-                                    # Load and process document
-                                    document_content = load_document_from_s3(S3_BUCKET_NAME, document_key)
+                                    # Load and process document (uploaded bytes are reused when the ETag matches)
+                                    document_content = load_document(document_key, obj['etag'])
                                     
                                     if document_content:
-                                        # Chunk document and store embeddings
                                         chunks = chunk_document(document_content, chunking_strategy)
-                                        if store_embeddings(chunks, vectorizer_type):
-                                            st.success(f"Successfully processed {document_key}")
-                                        else:
-                                            st.error(f"Failed to process {document_key}")
+                                        all_chunks.extend(chunks)
+                                        all_metadata.extend(
+                                            [chunk_metadata(document_key, obj['last_modified'], collection)] * len(chunks)
+                                        )
                                     else:
                                         st.error(f"Could not load content from {document_key}")
                                 
-                                st.success("Document processing completed!")
+                                # One store for the whole collection, so it is replaced rather than overwritten per document
+                                if all_chunks and store_embeddings(all_chunks, vectorizer_type, all_metadata, collection):
+                                    st.success("Document processing completed!")
+                                else:
+                                    st.error("Failed to process documents")
                             else:
                                 st.warning("No supported documents found in the bucket")
                                 
@@ -832,7 +1251,7 @@ def main():
                             logger.error(f"Document processing error: {str(e)}")
 
             if diagnose_button:
-                diagnose_document_processing(vectorizer_type)
+                diagnose_document_processing(vectorizer_type, collection)
     
     with tab2:
         # Query interface
@@ -843,19 +1262,31 @@ def main():
             submit_button = st.button("Submit")
             
         if submit_button:
-            if vectorizer_type == "TF-IDF" and not hasattr(vectorizer, 'vocabulary_'):
+            if vectorizer_type == "TF-IDF" and get_vectorizer(collection) is None:
                 st.error("Please embed documents first!")
                 return
                 
             if prompt:
-                # Check cache first
-                cached_response = get_cached_response(prompt, "")
+                # Check cache first; answers are cached per version of the collection's index
+                answer_context = (collection, vectorizer_type, get_corpus_signature(collection, vectorizer_type))
+                cached_response = get_cached_response(prompt, answer_context)
                 if cached_response:
                     st.success("Retrieved from cache!")
                     st.write(cached_response)
                 else:
                     with st.spinner("Processing query..."):
-                        relevant_chunks = retrieve_relevant_chunks(prompt, vectorizer_type)
+                        relevant_chunks = retrieve_relevant_chunks(prompt, vectorizer_type, collection=collection)
+                        
+                        if relevant_chunks and CONTEXT_REDUCTION:
+                            relevant_chunks, context_stats = reduce_context(
+                                prompt, relevant_chunks, lambda texts: embed_texts(texts, vectorizer_type, collection)
+                            )
+                            logger.info(f"Context reduction: {context_stats}")
+                            st.caption(
+                                f"Context: {context_stats['chunks_after']}/{context_stats['chunks_before']} chunks, "
+                                f"~{context_stats['tokens_after']} of {context_stats['tokens_before']} tokens "
+                                f"({context_stats['tokens_saved']} saved)"
+                            )
                         
                         if relevant_chunks:
                             # Show top 2 similarity scores
@@ -870,23 +1301,39 @@ def main():
                                     st.write(chunk_info['chunk'])
                                     st.divider()
 
-                            # Generate and show response
-                            context = " ".join(chunk["chunk"] for chunk in relevant_chunks)
-                            combined_prompt = f"Context: {context}\n\nQuestion: {prompt}\n\nPlease provide a detailed answer based on the context above."
+                            if MISTRAL_API_ENDPOINT in open_circuits():
+                                # Degraded mode: the passages are the best available answer
+                                st.warning("Answer generation is unavailable right now. The most relevant passages are shown instead.")
+                                for chunk_info in relevant_chunks:
+                                    st.write(chunk_info['chunk'])
+                            else:
+                                # Generate and show response
+                                context = " ".join(chunk["chunk"] for chunk in relevant_chunks)
+                                combined_prompt = f"Context: {context}\n\nQuestion: {prompt}\n\nPlease provide a detailed answer based on the context above."
                             
-                            with st.spinner("Generating response..."):
-                                response = call_mistral_api(combined_prompt, model, temperature, max_tokens)
-                                st.markdown("### Response:")
-                                st.write(response)
+                                with st.spinner("Generating response..."):
+                                    if model == AUTO_MODEL:
+                                        response, used_model, decision = call_routed_mistral_api(
+                                            prompt, combined_prompt, temperature, max_tokens
+                                        )
+                                        st.caption(
+                                            f"Routed to {used_model} ({decision.reason}, complexity {decision.complexity:.2f}, "
+                                            f"predicted {decision.predicted_seconds:.1f}s)"
+                                        )
+                                    else:
+                                        used_model = model
+                                        response = call_mistral_api(combined_prompt, model, temperature, max_tokens)
+                                    st.markdown("### Response:")
+                                    st.write(response)
                                 
-                                # Store in cache and history
-                                store_cached_response(prompt, "", response)
-                                st.session_state.history.append({
-                                    'timestamp': datetime.now().isoformat(),
-                                    'prompt': prompt,
-                                    'response': response,
-                                    'model': model
-                                })
+                                    # Store in cache and history
+                                    store_cached_response(prompt, answer_context, response)
+                                    st.session_state.history.append({
+                                        'timestamp': datetime.now().isoformat(),
+                                        'prompt': prompt,
+                                        'response': response,
+                                        'model': used_model
+                                    })
                         else:
                             st.warning("No relevant content found.")
             else:
@@ -904,6 +1351,42 @@ def main():
                     st.write(f"**Response:** {item['response']}")
                     st.write(f"**Model:** {item['model']}")
         
+        # Model routing: decisions and per-model latency against the SLO
+        routing = get_model_router().metrics()
+        if routing['decisions'] or any(m['p95_seconds'] is not None for m in routing['models']):
+            st.write(f"Model Routing (latency SLO {routing['slo_seconds']:.0f}s):")
+            st.dataframe(pd.DataFrame(routing['models']))
+            if routing['decisions']:
+                st.dataframe(pd.DataFrame(routing['decisions']))
+            if routing['fallbacks']:
+                st.dataframe(pd.DataFrame(routing['fallbacks']))
+        
+        # Outbound call scheduling: queueing delay per priority class
+        scheduling = get_request_scheduler().metrics()
+        if any(stats['completed'] for stats in scheduling.values()):
+            st.write(f"Mistral Call Scheduling ({MAX_CONCURRENT_LLM_CALLS} concurrent calls):")
+            st.dataframe(pd.DataFrame([{'priority': priority, **stats} for priority, stats in scheduling.items()]))
+        hedging = get_hedger().metrics()
+        if hedging['hedged']:
+            st.write(f"Embedding requests hedged: {hedging['hedged']} of {hedging['calls']} "
+                     f"({hedging['hedge_wins']} answered by the duplicate)")
+        circuits = [get_circuit_breaker(endpoint).status() for endpoint in (MISTRAL_API_ENDPOINT, MISTRAL_EMBED_API_ENDPOINT)]
+        if any(circuit['state'] != CircuitBreaker.CLOSED or circuit['rejected'] for circuit in circuits):
+            st.dataframe(pd.DataFrame(circuits))
+        warmup = get_warmup().status()
+        if warmup['ready'] and warmup['tasks']:
+            st.write(f"Index warm-up finished in {warmup['seconds']:.1f}s:")
+            st.dataframe(pd.DataFrame(warmup['tasks']))
+        watcher = get_corpus_watcher().status()
+        if not watcher['connected']:
+            st.warning("Corpus change listener is disconnected; indexes are checked against the database on each query.")
+        coalescing = get_single_flight().metrics()
+        if coalescing['coalesced']:
+            st.write(
+                f"Duplicate Mistral calls coalesced: {coalescing['coalesced']} "
+                f"({coalescing['coalesced_ratio']:.1%} of {coalescing['executed'] + coalescing['coalesced']} calls)"
+            )
+        
         # Visualize embeddings if available
         if 'embeddings' in st.session_state:
             st.plotly_chart(
@@ -0,0 +1,220 @@
+# Benchmarks for the document pipeline
+# Usage: python benchmark.py extractors file1.pdf file2.docx ... [--repeat 3]
+#        python benchmark.py index [--rows 100000] [--dim 1024] [--projection-dim 128] [--from-db]
+#        python benchmark.py batch [--rows 100000] [--dim 1024] [--queries 1000] [--from-db]
+#        python benchmark.py scheduler [--background-workers 16] [--questions 50]
+
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+from extractors import available_extractors, run_with_timeout, automatic_timeout
+from llm_scheduler import BACKGROUND, INTERACTIVE, RequestScheduler, percentile
+from projection import PCAProjection
+from vector_index import QUANTIZATION_MODES, VectorIndex
+
+
+def benchmark_extractors(paths, repeat=3):
+    """Time every available backend on each file and print pages/sec per backend."""
+    totals = {}  # backend -> [pages, seconds, failures]
+    for path in paths:
+        with open(path, 'rb') as f:
+            content = f.read()
+        extension = os.path.splitext(path)[1]
+        for name, extractor in available_extractors(extension):
+            stats = totals.setdefault(name, [0, 0.0, 0])
+            for _ in range(repeat):
+                started = time.perf_counter()
+                try:
+                    pages = run_with_timeout(extractor, content, automatic_timeout(content))
+                except Exception as e:
+                    stats[2] += 1
+                    print(f"{name:16} {os.path.basename(path)}: failed ({str(e)})")
+                    break
+                stats[0] += len(pages)
+                stats[1] += time.perf_counter() - started
+
+    print(f"\n{'backend':16} {'pages':>8} {'seconds':>10} {'pages/sec':>10} {'failures':>9}")
+    for name, (pages, seconds, failures) in sorted(totals.items(), key=lambda item: -item[1][0] / max(item[1][1], 1e-9)):
+        rate = pages / seconds if seconds else 0.0
+        print(f"{name:16} {pages:>8} {seconds:>10.3f} {rate:>10.1f} {failures:>9}")
+
+
+def synthetic_vectors(rows, dim, clusters=200, seed=42):
+    """Clustered Gaussian vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=rows)
+    return centers[labels] + 0.5 * rng.standard_normal((rows, dim)).astype(np.float32)
+
+
+def load_db_vectors():
+    """Load the embeddings table using the same .env settings as the app."""
+    import psycopg2
+    from dotenv import load_dotenv
+    load_dotenv()
+    conn = psycopg2.connect(
+        host=os.getenv('POSTGRES_HOST'),
+        port=os.getenv('POSTGRES_PORT'),
+        dbname=os.getenv('POSTGRES_DB'),
+        user=os.getenv('POSTGRES_USER'),
+        password=os.getenv('POSTGRES_PASSWORD')
+    )
+    with conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT embedding FROM embeddings WHERE index_version IN (SELECT version FROM index_versions WHERE status = 'active')"
+        )
+        rows = [row[0] for row in cur.fetchall() if row[0]]
+    conn.close()
+    dimension = len(rows[0])
+    return np.array([row for row in rows if len(row) == dimension], dtype=np.float32)
+
+
+def benchmark_index(vectors, n_queries=200, top_k=10, rescore_factor=None, modes=QUANTIZATION_MODES,
+                    projection_dim=None):
+    """Report resident memory, query latency and recall@k against exact search for each mode."""
+    rng = np.random.default_rng(0)
+    query_rows = rng.choice(len(vectors), size=min(n_queries, len(vectors)), replace=False)
+    queries = vectors[query_rows] + 0.1 * rng.standard_normal((len(query_rows), vectors.shape[1])).astype(np.float32)
+    ids = np.arange(len(vectors))
+    chunks = [''] * len(vectors)
+
+    exact = VectorIndex(ids, chunks, vectors, mode='none')
+    truth = [{row for row, _ in result} for result in exact.search(queries, top_k)]
+    full_bytes = exact.full_precision_bytes()
+
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {len(queries)} queries, recall@{top_k}, rescore factor {rescore_factor or 'default'}")
+    configurations = [(mode, None, True) for mode in modes]
+    if projection_dim:
+        started = time.perf_counter()
+        projection = PCAProjection.fit(vectors, projection_dim)
+        print(f"PCA to {projection.dimension} dims fitted in {time.perf_counter() - started:.2f}s")
+        configurations.append(('none', projection, False))
+        configurations += [(mode, projection, True) for mode in modes]
+
+    print(f"{'mode':22} {'resident MB':>12} {'reduction':>10} {'ms/query':>10} {'recall':>8}")
+    for mode, projection, rescore in configurations:
+        index = VectorIndex(ids, chunks, vectors, mode=mode, projection=projection, rescore=rescore)
+        started = time.perf_counter()
+        results = index.search(queries, top_k, rescore_factor=rescore_factor)
+        elapsed = time.perf_counter() - started
+        recall = np.mean([
+            len({row for row, _ in result} & expected) / len(expected)
+            for result, expected in zip(results, truth)
+        ])
+        resident = index.memory_bytes()
+        label = mode
+        if projection is not None:
+            label += f" pca{projection.dimension}" + (" +rescore" if rescore else "")
+        print(f"{label:22} {resident / 1024 / 1024:>12.1f} {full_bytes / resident:>9.1f}x "
+              f"{1000 * elapsed / len(queries):>10.2f} {recall:>8.3f}")
+
+
+def benchmark_batch_search(vectors, n_queries=1000, top_k=5, mode='none'):
+    """Compare one search call per query with a single batched search over all queries."""
+    rng = np.random.default_rng(0)
+    query_rows = rng.integers(0, len(vectors), size=n_queries)
+    queries = vectors[query_rows] + 0.1 * rng.standard_normal((n_queries, vectors.shape[1])).astype(np.float32)
+    index = VectorIndex(np.arange(len(vectors)), [''] * len(vectors), vectors, mode=mode)
+
+    started = time.perf_counter()
+    looped = [index.search([query], top_k)[0] for query in queries]
+    loop_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batched = index.search(queries, top_k)
+    batch_seconds = time.perf_counter() - started
+
+    agreement = np.mean([[row for row, _ in a] == [row for row, _ in b] for a, b in zip(looped, batched)])
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {n_queries} queries, top-{top_k}, {mode} index")
+    print(f"{'per-query loop':16} {loop_seconds:>8.2f}s {n_queries / loop_seconds:>10.0f} queries/sec")
+    print(f"{'batched':16} {batch_seconds:>8.2f}s {n_queries / batch_seconds:>10.0f} queries/sec")
+    print(f"speedup {loop_seconds / batch_seconds:.1f}x, identical results for {agreement:.1%} of queries")
+
+
+def benchmark_scheduler(background_workers=16, questions=50, call_seconds=0.05, max_concurrency=4,
+                        background_limit=2):
+    """Interactive latency under a background flood of simulated API calls, FIFO vs prioritized."""
+    def run(prioritized):
+        limits = {BACKGROUND: background_limit} if prioritized else None
+        scheduler = RequestScheduler(max_concurrency, limits)
+        stop = threading.Event()
+
+        def background(worker):
+            priority = BACKGROUND if prioritized else INTERACTIVE
+            while not stop.is_set():
+                scheduler.run(time.sleep, call_seconds, priority=priority, session=f"ingest-{worker}")
+
+        threads = [threading.Thread(target=background, args=(i,)) for i in range(background_workers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(call_seconds * 4)
+        latencies = []
+        for i in range(questions):
+            started = time.perf_counter()
+            scheduler.run(time.sleep, call_seconds, priority=INTERACTIVE, session=f"user-{i % 5}")
+            latencies.append(time.perf_counter() - started)
+            time.sleep(call_seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return latencies, sum(scheduler.completed.values()) - questions
+
+    print(f"{background_workers} background workers, {questions} questions, {max_concurrency} slots, "
+          f"{1000 * call_seconds:.0f} ms per call")
+    print(f"{'scheduling':12} {'p50 ms':>8} {'p99 ms':>8} {'background calls':>17}")
+    for label, prioritized in (('fifo', False), ('priority', True)):
+        latencies, background_calls = run(prioritized)
+        print(f"{label:12} {1000 * percentile(latencies, 0.5):>8.0f} {1000 * percentile(latencies, 0.99):>8.0f} "
+              f"{background_calls:>17}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG-DocuMind benchmarks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    extractors_parser = subparsers.add_parser('extractors', help="Compare extraction backends in pages/sec")
+    extractors_parser.add_argument('paths', nargs='+')
+    extractors_parser.add_argument('--repeat', type=int, default=3)
+
+    index_parser = subparsers.add_parser('index', help="Compare quantization modes: memory, latency, recall@k")
+    index_parser.add_argument('--rows', type=int, default=100000)
+    index_parser.add_argument('--dim', type=int, default=1024)
+    index_parser.add_argument('--queries', type=int, default=200)
+    index_parser.add_argument('--top-k', type=int, default=10)
+    index_parser.add_argument('--rescore-factor', type=int, default=None)
+    index_parser.add_argument('--projection-dim', type=int, default=None, help="Also benchmark a PCA-reduced scan")
+    index_parser.add_argument('--from-db', action='store_true', help="Use the embeddings table instead of synthetic vectors")
+
+    batch_parser = subparsers.add_parser('batch', help="Compare per-query and batched search throughput")
+    batch_parser.add_argument('--rows', type=int, default=100000)
+    batch_parser.add_argument('--dim', type=int, default=1024)
+    batch_parser.add_argument('--queries', type=int, default=1000)
+    batch_parser.add_argument('--top-k', type=int, default=5)
+    batch_parser.add_argument('--mode', choices=QUANTIZATION_MODES, default='none')
+    batch_parser.add_argument('--from-db', action='store_true', help="Use the embeddings table instead of synthetic vectors")
+
+    scheduler_parser = subparsers.add_parser('scheduler', help="Interactive latency under background load, FIFO vs prioritized")
+    scheduler_parser.add_argument('--background-workers', type=int, default=16)
+    scheduler_parser.add_argument('--questions', type=int, default=50)
+    scheduler_parser.add_argument('--call-ms', type=float, default=50)
+    scheduler_parser.add_argument('--max-concurrency', type=int, default=4)
+
+    args = parser.parse_args()
+    if args.command == 'extractors':
+        benchmark_extractors(args.paths, args.repeat)
+    elif args.command == 'index':
+        vectors = load_db_vectors() if args.from_db else synthetic_vectors(args.rows, args.dim)
+        benchmark_index(vectors, args.queries, args.top_k, args.rescore_factor, projection_dim=args.projection_dim)
+    elif args.command == 'batch':
+        vectors = load_db_vectors() if args.from_db else synthetic_vectors(args.rows, args.dim)
+        benchmark_batch_search(vectors, args.queries, args.top_k, args.mode)
+    elif args.command == 'scheduler':
+        benchmark_scheduler(args.background_workers, args.questions, args.call_ms / 1000, args.max_concurrency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+# Context reduction for RAG prompts
+# Drops retrieved chunks that fall below a score floor or after a large drop in similarity, then
+# keeps only the sentences of the remaining chunks that are close to the query. The prompt gets
+# shorter, so generation is faster and cheaper, while the supporting sentences stay in.
+
+import os
+import re
+
+import numpy as np
+
+from vector_index import normalize
+
+CONTEXT_SCORE_FLOOR = float(os.getenv('CONTEXT_SCORE_FLOOR', '0'))
+# Cut after a drop between consecutive scores larger than this fraction of the best score
+CONTEXT_RELATIVE_GAP = float(os.getenv('CONTEXT_RELATIVE_GAP', '0.15'))
+# Keep sentences scoring at least this fraction of the best sentence score (plus each chunk's best)
+SENTENCE_KEEP_RATIO = float(os.getenv('SENTENCE_KEEP_RATIO', '0.8'))
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for English text)."""
+    return len(text) // 4 + 1 if text else 0
+
+
+def split_sentences(text):
+    """Split on sentence-ending punctuation, the same way the sentence chunker does."""
+    return [sentence.strip() for sentence in re.split(r'(?<=[.!?])\s+', text) if sentence.strip()]
+
+
+def cutoff(results, score_floor=CONTEXT_SCORE_FLOOR, relative_gap=CONTEXT_RELATIVE_GAP):
+    """Drop results below score_floor or after the first large gap in score; keeps their order.
+
+    The best result is always kept.
+    """
+    if len(results) <= 1:
+        return list(results)
+    scores = sorted((result['similarity'] for result in results), reverse=True)
+    threshold = score_floor
+    best = scores[0]
+    for higher, lower in zip(scores, scores[1:]):
+        if best > 0 and (higher - lower) / best > relative_gap:
+            threshold = max(threshold, higher)
+            break
+    kept = [result for result in results if result['similarity'] >= threshold]
+    return kept or [max(results, key=lambda result: result['similarity'])]
+
+
+def sentence_units(results):
+    """(result index, sentence) for every sentence of every result, in order."""
+    return [(i, sentence) for i, result in enumerate(results) for sentence in split_sentences(result['chunk'])]
+
+
+def compress(results, units, query_vector, sentence_vectors, keep_ratio=SENTENCE_KEEP_RATIO):
+    """Rebuild each result's text from its sentences most similar to the query."""
+    if not units:
+        return list(results)
+    similarities = normalize(sentence_vectors) @ normalize(query_vector)[0]
+    threshold = similarities.max() * keep_ratio if similarities.max() > 0 else np.inf
+    chunk_ids = np.array([i for i, _ in units])
+
+    compressed = []
+    for i, result in enumerate(results):
+        positions = np.flatnonzero(chunk_ids == i)
+        if not len(positions):
+            compressed.append(result)
+            continue
+        # The chunk's best sentence always survives so every retained chunk contributes evidence
+        keep = set(positions[similarities[positions] >= threshold].tolist())
+        keep.add(int(positions[similarities[positions].argmax()]))
+        compressed.append({**result, "chunk": " ".join(units[p][1] for p in sorted(keep))})
+    return compressed
+
+
+def context_stats(before, after):
+    tokens_before = sum(estimate_tokens(result['chunk']) for result in before)
+    tokens_after = sum(estimate_tokens(result['chunk']) for result in after)
+    return {
+        'chunks_before': len(before),
+        'chunks_after': len(after),
+        'tokens_before': tokens_before,
+        'tokens_after': tokens_after,
+        'tokens_saved': tokens_before - tokens_after
+    }
+
+
+def reduce_context(query, results, embed, score_floor=CONTEXT_SCORE_FLOOR, relative_gap=CONTEXT_RELATIVE_GAP,
+                   keep_ratio=SENTENCE_KEEP_RATIO):
+    """Cut off and compress results; embed(texts) returns one vector per text.
+
+    Returns (reduced results, stats). If embedding fails, only the score cutoff is applied.
+    """
+    kept = cutoff(results, score_floor, relative_gap)
+    units = sentence_units(kept)
+    vectors = embed([query] + [sentence for _, sentence in units]) if units else None
+    if vectors is None or len(vectors) != len(units) + 1:
+        return kept, context_stats(results, kept)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    reduced = compress(kept, units, vectors[0], vectors[1:], keep_ratio)
+    return reduced, context_stats(results, reduced)
@@ -0,0 +1,111 @@
+# Priority scheduling for outbound Mistral calls
+# Every completion and embedding request takes a slot from one process-wide scheduler before it is
+# sent. Interactive requests always go ahead of batch and background work, batch and background
+# classes are capped below the global limit so a slot is free for a question quickly, and within a
+# class sessions are served by start-time fair queuing so one user's large ingest can't starve the
+# others.
+
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BATCH, BACKGROUND)  # Highest first
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+class RequestScheduler:
+    """Admits callers in priority order, fairly across sessions, within concurrency caps.
+
+    class_limits caps the in-flight requests of a priority class; unlisted classes may use every
+    slot. Session weights (default 1) set each session's share of its class when queues are busy.
+    """
+
+    def __init__(self, max_concurrency=4, class_limits=None, weights=None):
+        self.max_concurrency = max_concurrency
+        self.class_limits = {priority: max_concurrency for priority in PRIORITIES}
+        self.class_limits.update(class_limits or {})
+        self.weights = dict(weights or {})
+        self.condition = threading.Condition()
+        self.queues = {priority: [] for priority in PRIORITIES}  # heaps of (start tag, sequence)
+        self.virtual_time = {priority: 0.0 for priority in PRIORITIES}
+        self.session_finish = {priority: {} for priority in PRIORITIES}
+        self.in_flight = Counter()
+        self.completed = Counter()
+        self.waits = {priority: deque(maxlen=1000) for priority in PRIORITIES}
+        self.sequence = itertools.count()
+
+    def set_weight(self, session, weight):
+        with self.condition:
+            self.weights[session] = weight
+
+    def _enqueue(self, priority, session):
+        # Start tag: no earlier than the class's virtual time or the session's previous finish tag
+        start = max(self.virtual_time[priority], self.session_finish[priority].get(session, 0.0))
+        self.session_finish[priority][session] = start + 1.0 / self.weights.get(session, 1.0)
+        entry = (start, next(self.sequence))
+        heapq.heappush(self.queues[priority], entry)
+        return entry
+
+    def _next_class(self):
+        """Highest-priority class with a waiting request and a free slot."""
+        if sum(self.in_flight.values()) >= self.max_concurrency:
+            return None
+        for priority in PRIORITIES:
+            if self.queues[priority] and self.in_flight[priority] < self.class_limits[priority]:
+                return priority
+        return None
+
+    @contextmanager
+    def slot(self, priority=INTERACTIVE, session=None):
+        """Block until this request may run; the slot is released when the block exits."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        enqueued = time.perf_counter()
+        with self.condition:
+            entry = self._enqueue(priority, session)
+            while not (self._next_class() == priority and self.queues[priority][0] == entry):
+                self.condition.wait()
+            heapq.heappop(self.queues[priority])
+            self.virtual_time[priority] = entry[0]
+            self.in_flight[priority] += 1
+            self.waits[priority].append(time.perf_counter() - enqueued)
+            # Another class may still have a free slot
+            self.condition.notify_all()
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.in_flight[priority] -= 1
+                self.completed[priority] += 1
+                self.condition.notify_all()
+
+    def run(self, fn, *args, priority=INTERACTIVE, session=None, **kwargs):
+        with self.slot(priority, session):
+            return fn(*args, **kwargs)
+
+    def metrics(self):
+        """Queue depth, in-flight count and queueing delay (seconds) per priority class."""
+        with self.condition:
+            return {
+                priority: {
+                    'queued': len(self.queues[priority]),
+                    'in_flight': self.in_flight[priority],
+                    'completed': self.completed[priority],
+                    'limit': self.class_limits[priority],
+                    'wait_p50': percentile(self.waits[priority], 0.5),
+                    'wait_p99': percentile(self.waits[priority], 0.99),
+                }
+                for priority in PRIORITIES
+            }
@@ -0,0 +1,190 @@
+# Latency-aware model routing
+# Picks a generation model per request from a cheap estimate of how hard the question is, the
+# prompt size and each model's observed rolling p95 latency against a latency SLO. A model that is
+# failing or too slow is skipped in favour of a faster one. Every decision is counted for metrics.
+
+import re
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+
+# Cheapest/fastest first. prior_seconds is the assumed latency until real calls are observed.
+MODEL_PROFILES = {
+    'open-mistral-7b': {'tier': 0, 'prior_seconds': 2.0},
+    'mistral-small-latest': {'tier': 1, 'prior_seconds': 4.0},
+    'codestral-latest': {'tier': 1, 'prior_seconds': 4.0, 'code': True},
+}
+
+COMPLEX_PATTERN = re.compile(
+    r"\b(why|how|explain|compare|contrast|analy[sz]e|evaluate|summari[sz]e|implications?|trade-?offs?|"
+    r"differences?|relationship|step[- ]by[- ]step|pros and cons)\b",
+    re.IGNORECASE
+)
+
+# Code markers rather than words like "class" or "import", which ordinary questions use too
+CODE_PATTERN = re.compile(
+    r"`"                                                         # inline code or fenced blocks
+    r"|\bdef \w+\s*\(|\bclass \w+\s*[(:]|\bfunction\s*\w*\s*\("  # definitions
+    r"|^\s*from [\w.]+ import \w+|^\s*import [\w.]+ as \w+|^\s*#include\s*[<\"]"
+    r"|\bSELECT\b.+?\bFROM\b"
+    r"|Traceback \(most recent call last\)|File \"[^\"]+\", line \d+|\b[A-Z]\w*(?:Error|Exception):"
+    r"|\bat [\w$.]+\([\w$]+\.\w+:\d+\)"                          # Java/JavaScript stack frames
+    r"|\b\w+\.\w+\([^)]*\)|==|!=|=>",                            # calls and operators
+    re.MULTILINE | re.DOTALL
+)
+
+
+def estimate_complexity(query):
+    """Score in [0, 1] from length, reasoning keywords and the number of sub-questions."""
+    words = len(query.split())
+    score = min(words / 60, 0.4)
+    score += min(len(COMPLEX_PATTERN.findall(query)) * 0.2, 0.4)
+    score += min(max(query.count('?') - 1, 0) * 0.1, 0.2)
+    return min(score, 1.0)
+
+
+@dataclass
+class RoutingDecision:
+    model: str
+    reason: str
+    complexity: float
+    predicted_seconds: float
+    fallback: str = None
+
+
+class LatencyTracker:
+    """Rolling window of call latencies and failures per model.
+
+    Samples older than max_age_seconds are ignored. A model the router stopped using for being slow
+    or failing gets no new samples, so its history has to expire for it to be tried again.
+    """
+
+    def __init__(self, window=100, max_age_seconds=120.0):
+        self.window = window
+        self.max_age_seconds = max_age_seconds
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, model, seconds, success=True):
+        with self.lock:
+            self.samples.setdefault(model, deque(maxlen=self.window)).append((seconds, success, time.monotonic()))
+
+    def _recent(self, model):
+        cutoff = time.monotonic() - self.max_age_seconds
+        with self.lock:
+            return [(seconds, success) for seconds, success, at in self.samples.get(model, ()) if at >= cutoff]
+
+    def p95(self, model):
+        latencies = sorted(seconds for seconds, success in self._recent(model) if success)
+        if not latencies:
+            return None
+        return latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)]
+
+    def error_rate(self, model, recent=10):
+        samples = self._recent(model)[-recent:]
+        if not samples:
+            return 0.0
+        return sum(1 for _, success in samples if not success) / len(samples)
+
+
+class ModelRouter:
+    """Chooses a model per request within a latency SLO."""
+
+    def __init__(self, models=None, slo_seconds=8.0, complexity_threshold=0.4, max_error_rate=0.5,
+                 reference_tokens=4000, sample_max_age_seconds=120.0):
+        self.models = models or MODEL_PROFILES
+        self.slo_seconds = slo_seconds
+        self.complexity_threshold = complexity_threshold
+        self.max_error_rate = max_error_rate
+        self.reference_tokens = reference_tokens
+        self.tracker = LatencyTracker(max_age_seconds=sample_max_age_seconds)
+        self.decisions = Counter()
+        self.fallbacks_used = Counter()
+        self.lock = threading.Lock()
+
+    def predicted_seconds(self, model, prompt_tokens):
+        """Observed p95 (or the prior) scaled up for prompts longer than the reference size."""
+        base = self.tracker.p95(model) or self.models[model]['prior_seconds']
+        return base * max(1.0, prompt_tokens / self.reference_tokens)
+
+    def healthy(self, model):
+        return self.tracker.error_rate(model) < self.max_error_rate
+
+    def route(self, query, prompt):
+        """Pick a model for this query and full prompt."""
+        complexity = estimate_complexity(query)
+        prompt_tokens = len(prompt) // 4
+        if CODE_PATTERN.search(query) and any(p.get('code') for p in self.models.values()):
+            wanted = [name for name, profile in self.models.items() if profile.get('code')]
+            reason = "code"
+        elif complexity >= self.complexity_threshold:
+            top_tier = max(profile['tier'] for profile in self.models.values())
+            wanted = [name for name, profile in self.models.items() if profile['tier'] == top_tier and not profile.get('code')]
+            reason = "complex"
+        else:
+            wanted = [name for name, profile in self.models.items() if profile['tier'] == 0]
+            reason = "simple"
+
+        # Fastest healthy model that meets the SLO, as the fallback or when the wanted one can't
+        by_speed = sorted(self.models, key=lambda name: self.predicted_seconds(name, prompt_tokens))
+        healthy = [name for name in by_speed if self.healthy(name)] or by_speed
+        fastest = healthy[0]
+
+        model = next(
+            (name for name in wanted
+             if self.healthy(name) and self.predicted_seconds(name, prompt_tokens) <= self.slo_seconds),
+            None
+        )
+        if model is None:
+            model = fastest
+            reason = f"{reason}->fallback"
+        fallback = next((name for name in healthy if name != model), None)
+        decision = RoutingDecision(model, reason, complexity, self.predicted_seconds(model, prompt_tokens), fallback)
+        with self.lock:
+            self.decisions[(model, reason)] += 1
+        return decision
+
+    def record(self, model, seconds, success=True):
+        self.tracker.record(model, seconds, success)
+
+    def record_fallback(self, from_model, to_model):
+        with self.lock:
+            self.fallbacks_used[(from_model, to_model)] += 1
+
+    def call(self, decision, generate):
+        """Run generate(model) with the routed model, retrying once on the fallback if it fails.
+
+        generate returns (result, seconds), where seconds is the upstream call's own latency;
+        client-side waits such as rate-limit backoff would otherwise count against the model.
+        """
+        for model in [decision.model] + ([decision.fallback] if decision.fallback else []):
+            started = time.perf_counter()
+            try:
+                result, seconds = generate(model)
+            except Exception:
+                self.record(model, time.perf_counter() - started, success=False)
+                if model == decision.fallback or not decision.fallback:
+                    raise
+                self.record_fallback(decision.model, decision.fallback)
+                continue
+            self.record(model, seconds)
+            return result, model
+
+    def metrics(self):
+        """Routing counts plus per-model p95 and error rate, for dashboards and /metrics."""
+        with self.lock:
+            decisions = [
+                {'model': model, 'reason': reason, 'count': count}
+                for (model, reason), count in sorted(self.decisions.items())
+            ]
+            fallbacks = [
+                {'from': from_model, 'to': to_model, 'count': count}
+                for (from_model, to_model), count in sorted(self.fallbacks_used.items())
+            ]
+        models = [
+            {'model': name, 'p95_seconds': self.tracker.p95(name), 'error_rate': self.tracker.error_rate(name),
+             'healthy': self.healthy(name)}
+            for name in self.models
+        ]
+        return {'slo_seconds': self.slo_seconds, 'decisions': decisions, 'fallbacks': fallbacks, 'models': models}
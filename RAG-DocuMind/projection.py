@@ -0,0 +1,62 @@
+# Linear dimensionality reduction for stored embeddings
+# A PCA fitted on the corpus at ingest time. The projection is serialized next to the vectors it
+# was fitted on so every replica projects queries with exactly the same matrix.
+
+import io
+
+import numpy as np
+
+
+def _unit_rows(vectors):
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class PCAProjection:
+    """Mean-centred projection onto the top principal components.
+
+    Inputs are scaled to unit length first, so stored and query vectors project the same way
+    regardless of the embedding model's norms.
+    """
+
+    def __init__(self, mean, components):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.components = np.asarray(components, dtype=np.float32)
+
+    @property
+    def source_dimension(self):
+        return self.components.shape[1]
+
+    @property
+    def dimension(self):
+        return self.components.shape[0]
+
+    @classmethod
+    def fit(cls, vectors, dimension, sample_size=20000, seed=0):
+        """Fit on up to sample_size rows; the output dimension is capped by the data available."""
+        vectors = _unit_rows(vectors)
+        if len(vectors) > sample_size:
+            rows = np.random.default_rng(seed).choice(len(vectors), size=sample_size, replace=False)
+            vectors = vectors[rows]
+        mean = vectors.mean(axis=0)
+        centered = vectors - mean
+        # Eigenvectors of the d x d covariance are much cheaper than an SVD of the n x d data
+        covariance = (centered.T @ centered).astype(np.float64) / max(len(vectors) - 1, 1)
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        dimension = min(dimension, len(vectors), vectors.shape[1])
+        order = np.argsort(eigenvalues)[::-1][:dimension]
+        return cls(mean, eigenvectors[:, order].T)
+
+    def transform(self, vectors):
+        return (_unit_rows(vectors) - self.mean) @ self.components.T
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez(buffer, mean=self.mean, components=self.components)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(data)) as arrays:
+            return cls(arrays['mean'], arrays['components'])
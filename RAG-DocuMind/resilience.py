@@ -0,0 +1,158 @@
+# Bounding tail latency of outbound API calls
+# A circuit breaker per endpoint fails calls fast once the upstream keeps erroring, instead of
+# making every caller wait out its own timeout, and lets one probe through after a cool-down.
+# Idempotent calls can be hedged: if the first attempt hasn't answered within the recent p95
+# latency, a duplicate is sent and whichever answers first wins.
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Closed -> open after failure_threshold consecutive failures -> half-open after reset_seconds."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+            # Half-open lets a single probe through; everyone else keeps failing fast until it succeeds
+            if self.state == self.HALF_OPEN and not self.probing:
+                self.probing = True
+                return
+            if self.state != self.CLOSED:
+                self.rejected += 1
+                retry_in = max(self.reset_seconds - (time.monotonic() - self.opened_at), 0)
+                raise CircuitOpenError(f"{self.name} is unavailable, retrying in {retry_in:.0f}s")
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def call(self, fn, is_failure=None):
+        """Run fn through the breaker; is_failure(result) marks unsuccessful results such as 5xx."""
+        self.before_call()
+        try:
+            result = fn()
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Interrupted without an outcome (e.g. a Streamlit rerun); the next call probes instead
+            with self.lock:
+                self.probing = False
+            raise
+        if is_failure and is_failure(result):
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+    @property
+    def is_open(self):
+        """True while calls would fail fast: open and cooling down, or half-open with its probe in flight.
+
+        Once the cool-down has passed this is False, so callers that check it first still send the probe.
+        """
+        with self.lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at < self.reset_seconds
+            return self.state == self.HALF_OPEN and self.probing
+
+    def status(self):
+        with self.lock:
+            return {'name': self.name, 'state': self.state, 'failures': self.failures, 'rejected': self.rejected}
+
+
+class Hedger:
+    """Sends a second attempt when the first is slower than the recent p95; for idempotent calls only."""
+
+    def __init__(self, max_workers=8, default_delay=2.0, min_delay=0.1, min_samples=20, window=200):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def delay(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < self.min_samples:
+            return self.default_delay
+        return max(latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)], self.min_delay)
+
+    def _timed(self, fn):
+        started = time.perf_counter()
+        result = fn()
+        with self.lock:
+            self.latencies.append(time.perf_counter() - started)
+        return result
+
+    def call(self, fn):
+        """Result of the first attempt to succeed; raises the first error if every attempt fails."""
+        with self.lock:
+            self.calls += 1
+        primary = self.executor.submit(self._timed, fn)
+        pending = {primary}
+        done, _ = wait(pending, timeout=self.delay())
+        if not done:
+            pending.add(self.executor.submit(self._timed, fn))
+            with self.lock:
+                self.hedged += 1
+
+        errors = []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                    continue
+                if future is not primary:
+                    with self.lock:
+                        self.hedge_wins += 1
+                return future.result()
+        raise errors[0]
+
+    def metrics(self):
+        delay = self.delay()
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+                'delay_seconds': delay
+            }
@@ -0,0 +1,67 @@
+# Single-flight request coalescing
+# Concurrent identical calls (same endpoint and payload) share one upstream request: the first
+# caller makes it and the others wait for its result or exception. Nothing is kept after the call
+# finishes, so this only removes duplicates that overlap in time.
+
+import hashlib
+import json
+import threading
+
+
+def request_fingerprint(*parts):
+    """Stable key for JSON-serializable request parts."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs fn once per key among overlapping callers and fans the outcome out to all of them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def metrics(self):
+        with self.lock:
+            total = self.executed + self.coalesced
+            return {
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'in_flight': len(self.calls),
+                'coalesced_ratio': self.coalesced / total if total else 0.0
+            }
@@ -0,0 +1,408 @@
+# Columnar index snapshots
+# A snapshot is one active index version of a collection written as plain files, on local disk or
+# S3: the vectors as float32 .npy matrices that load memory-mapped, the chunk texts as one UTF-8
+# blob plus an offsets array, and dictionary-encoded metadata columns, all described by
+# manifest.json. The manifest is written last, so a snapshot without one is incomplete. Replicas
+# open the snapshot of the version Postgres reports as active instead of streaming its rows out of
+# the embeddings table, and `restore` bulk-loads a snapshot back into Postgres with COPY.
+#
+# Usage: python snapshots.py export --collection default --vectorizer-type Mistral-Embed --to s3://bucket/snapshots
+#        python snapshots.py restore s3://bucket/snapshots/default/v42 [--collection default]
+
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+
+from corpus_collections import (
+    DEFAULT_COLLECTION,
+    VECTOR_SPACES,
+    build_index_version,
+    load_collection_state,
+    validate_collection,
+    vector_space,
+)
+from projection import PCAProjection
+
+logger = logging.getLogger(__name__)
+
+FORMAT = 'rag-documind-snapshot'
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+
+EXPORT_BATCH_ROWS = 5000
+RESTORE_BATCH_ROWS = 5000
+# Snapshots whose vectors are all unit length within this tolerance are searched without normalizing
+UNIT_NORM_TOLERANCE = 1e-3
+SNAPSHOT_CACHE_DIR = os.getenv(
+    'SNAPSHOT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'rag-documind-snapshots')
+)
+
+
+def snapshot_location(root, collection, version):
+    """Directory or S3 prefix of one index version's snapshot under root."""
+    return f"{root.rstrip('/')}/{collection}/v{version}"
+
+
+def _is_s3(location):
+    return location.startswith('s3://')
+
+
+def _split_s3(location):
+    bucket, _, prefix = location[len('s3://'):].partition('/')
+    return bucket, prefix.rstrip('/')
+
+
+def _s3_client():
+    import boto3
+    return boto3.client(
+        's3',
+        aws_access_key_id=os.getenv('AWS_ACCESS_KEY'),
+        aws_secret_access_key=os.getenv('AWS_SECRET_KEY'),
+        region_name=os.getenv('AWS_REGION')
+    )
+
+
+def _dictionary_encode(values):
+    """int32 codes into a list of distinct values; -1 stands for None."""
+    dictionary, codes = {}, np.empty(len(values), dtype=np.int32)
+    for row, value in enumerate(values):
+        codes[row] = -1 if value is None else dictionary.setdefault(value, len(dictionary))
+    return codes, list(dictionary)
+
+
+def _dictionary_decode(codes, dictionary):
+    values = dictionary + [None]
+    return [values[code] for code in codes.tolist()]
+
+
+class Snapshot:
+    """A snapshot directory on local disk; vectors are memory-mapped, the rest is read into memory."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format') != FORMAT or self.manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} {FORMAT}")
+
+        self.collection = self.manifest['collection']
+        self.version = self.manifest['version']
+        self.vectorizer_type = self.manifest['vectorizer_type']
+        self.dimension = self.manifest['dimension']
+        self.normalized = self.manifest['normalized']
+        self.ids = np.load(self._file('ids.npy'))
+        self.vectors = np.load(self._file('embeddings.npy'), mmap_mode='r')
+        self.reduced_vectors = None
+        if self.manifest['reduced_dimension']:
+            self.reduced_vectors = np.load(self._file('embeddings_reduced.npy'), mmap_mode='r')
+
+        offsets = np.load(self._file('chunk_offsets.npy')).tolist()
+        with open(self._file('chunks.bin'), 'rb') as f:
+            blob = f.read()
+        self.chunks = [blob[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+        columns = self.manifest['columns']
+        uploaded_at = np.load(self._file('uploaded_at.npy')).astype('datetime64[us]').astype(object)
+        self.metadata = {
+            'document_key': _dictionary_decode(np.load(self._file('document_key.npy')), columns['document_key']),
+            'file_type': _dictionary_decode(np.load(self._file('file_type.npy')), columns['file_type']),
+            'uploaded_at': uploaded_at.tolist(),
+            'collection': [self.collection] * len(self.chunks)
+        }
+
+        self.vectorizer = None
+        if os.path.exists(self._file('vectorizer.pkl')):
+            with open(self._file('vectorizer.pkl'), 'rb') as f:
+                self.vectorizer = pickle.load(f)
+        self.projection = None
+        if os.path.exists(self._file('projection.bin')):
+            with open(self._file('projection.bin'), 'rb') as f:
+                self.projection = PCAProjection.from_bytes(f.read())
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def __len__(self):
+        return len(self.chunks)
+
+
+def _write_snapshot(cur, collection, state, directory):
+    """Stream the rows of state's version into snapshot files in directory; returns the manifest."""
+    version, dimension = state['version'], state['dimension']
+    projection = state['projection']
+    if projection is not None and projection.source_dimension != dimension:
+        projection = None
+    where = "collection = %s AND index_version = %s AND array_length(embedding, 1) = %s AND chunk <> ''"
+    params = (collection, version, dimension)
+
+    cur.execute(f"SELECT COUNT(*) FROM embeddings WHERE {where}", params)
+    count = cur.fetchone()[0]
+    ids = np.empty(count, dtype=np.int64)
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    uploaded_at = np.empty(count, dtype='datetime64[us]')
+    document_keys, file_types = [], []
+    vectors = np.lib.format.open_memmap(
+        os.path.join(directory, 'embeddings.npy'), mode='w+', dtype=np.float32, shape=(count, dimension)
+    )
+    reduced = None
+    if projection is not None:
+        reduced = np.lib.format.open_memmap(
+            os.path.join(directory, 'embeddings_reduced.npy'), mode='w+', dtype=np.float32,
+            shape=(count, projection.dimension)
+        )
+
+    # A server-side cursor streams the rows, so the version is never held in memory
+    rows_cur = cur.connection.cursor(name=f"snapshot_{version}")
+    rows_cur.itersize = EXPORT_BATCH_ROWS
+    rows = 0
+    try:
+        rows_cur.execute(f"""
+            SELECT id, chunk, embedding, embedding_reduced, document_key, file_type, uploaded_at
+            FROM embeddings WHERE {where} ORDER BY id
+        """, params)
+        with open(os.path.join(directory, 'chunks.bin'), 'wb') as chunk_file:
+            for row_id, chunk, embedding, embedding_reduced, document_key, file_type, uploaded in rows_cur:
+                if rows == count:
+                    raise RuntimeError(f"Index version {version} changed during export")
+                ids[rows] = row_id
+                vectors[rows] = embedding
+                if reduced is not None:
+                    if embedding_reduced and len(embedding_reduced) == projection.dimension:
+                        reduced[rows] = embedding_reduced
+                    else:
+                        # Same rule as loading from Postgres: reduced vectors are used only if every row has one
+                        reduced = None
+                data = chunk.encode('utf-8')
+                chunk_file.write(data)
+                offsets[rows + 1] = offsets[rows] + len(data)
+                uploaded_at[rows] = uploaded if uploaded is not None else np.datetime64('NaT')
+                document_keys.append(document_key)
+                file_types.append(file_type)
+                rows += 1
+    finally:
+        rows_cur.close()
+    if rows != count:
+        raise RuntimeError(f"Index version {version} changed during export")
+
+    normalized = True
+    for start in range(0, count, EXPORT_BATCH_ROWS):
+        norms = np.linalg.norm(vectors[start:start + EXPORT_BATCH_ROWS], axis=1)
+        if len(norms) and np.abs(norms - 1).max() > UNIT_NORM_TOLERANCE:
+            normalized = False
+            break
+    vectors.flush()
+    del vectors
+    if reduced is not None:
+        reduced.flush()
+        del reduced
+    else:
+        projection = None
+        if os.path.exists(os.path.join(directory, 'embeddings_reduced.npy')):
+            os.remove(os.path.join(directory, 'embeddings_reduced.npy'))
+
+    np.save(os.path.join(directory, 'ids.npy'), ids)
+    np.save(os.path.join(directory, 'chunk_offsets.npy'), offsets)
+    np.save(os.path.join(directory, 'uploaded_at.npy'), uploaded_at)
+    document_key_codes, document_key_values = _dictionary_encode(document_keys)
+    file_type_codes, file_type_values = _dictionary_encode(file_types)
+    np.save(os.path.join(directory, 'document_key.npy'), document_key_codes)
+    np.save(os.path.join(directory, 'file_type.npy'), file_type_codes)
+    if state['vectorizer'] is not None:
+        with open(os.path.join(directory, 'vectorizer.pkl'), 'wb') as f:
+            pickle.dump(state['vectorizer'], f)
+    if projection is not None:
+        with open(os.path.join(directory, 'projection.bin'), 'wb') as f:
+            f.write(projection.to_bytes())
+
+    return {
+        'format': FORMAT,
+        'format_version': FORMAT_VERSION,
+        'collection': collection,
+        'version': version,
+        'vectorizer_type': state['vectorizer_type'],
+        'embedding_model': state['embedding_model'],
+        'model_version': state['model_version'],
+        'dimension': dimension,
+        'reduced_dimension': projection.dimension if projection is not None else None,
+        'rows': count,
+        'normalized': normalized,
+        'columns': {'document_key': document_key_values, 'file_type': file_type_values},
+        'activated_at': state['activated_at'].isoformat() if state['activated_at'] else None,
+        'created_at': datetime.now(timezone.utc).isoformat()
+    }
+
+
+def export_snapshot(conn, collection, vectorizer_type, root):
+    """Write the active version of a collection's vector space under root (a directory or s3:// URI).
+
+    Returns the snapshot's location, snapshot_location(root, collection, version).
+    """
+    with conn.cursor() as cur:
+        state = load_collection_state(cur, collection, vector_space(vectorizer_type))
+        if state is None:
+            raise ValueError(f"Collection '{collection}' has no active {vectorizer_type} index")
+        location = snapshot_location(root, collection, state['version'])
+        directory = tempfile.mkdtemp(prefix='snapshot-') if _is_s3(root) else location
+        if not _is_s3(root):
+            os.makedirs(directory, exist_ok=True)
+            # A stale manifest would mark a half-written snapshot as complete
+            if os.path.exists(os.path.join(directory, MANIFEST)):
+                os.remove(os.path.join(directory, MANIFEST))
+        try:
+            manifest = _write_snapshot(cur, collection, state, directory)
+        finally:
+            # Read-only work; nothing to keep open between exports
+            conn.rollback()
+
+    manifest['files'] = sorted(os.listdir(directory))
+    if _is_s3(root):
+        try:
+            bucket, prefix = _split_s3(location)
+            s3 = _s3_client()
+            for name in manifest['files']:
+                s3.upload_file(os.path.join(directory, name), bucket, f"{prefix}/{name}")
+            s3.put_object(Bucket=bucket, Key=f"{prefix}/{MANIFEST}", Body=json.dumps(manifest, indent=2).encode('utf-8'))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    else:
+        with open(os.path.join(directory, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    logger.info(f"Exported {manifest['rows']} {vectorizer_type} chunks of '{collection}' (version {manifest['version']}) to {location}")
+    return location
+
+
+def fetch_snapshot(location, cache_dir=SNAPSHOT_CACHE_DIR):
+    """Local directory holding the complete snapshot at location, downloading it from S3 if needed.
+
+    Returns None if there is no complete snapshot there.
+    """
+    if not _is_s3(location):
+        return location if os.path.exists(os.path.join(location, MANIFEST)) else None
+
+    bucket, prefix = _split_s3(location)
+    directory = os.path.join(cache_dir, bucket, prefix)
+    if os.path.exists(os.path.join(directory, MANIFEST)):
+        return directory
+    s3 = _s3_client()
+    try:
+        manifest_body = s3.get_object(Bucket=bucket, Key=f"{prefix}/{MANIFEST}")['Body'].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+    manifest = json.loads(manifest_body)
+    os.makedirs(directory, exist_ok=True)
+    for name in manifest['files']:
+        s3.download_file(bucket, f"{prefix}/{name}", os.path.join(directory, name))
+    with open(os.path.join(directory, MANIFEST), 'wb') as f:
+        f.write(manifest_body)
+    return directory
+
+
+def open_snapshot(root, collection, version, cache_dir=SNAPSHOT_CACHE_DIR):
+    """Snapshot of one index version under root, or None if it hasn't been exported."""
+    directory = fetch_snapshot(snapshot_location(root, collection, version), cache_dir)
+    if directory is None:
+        return None
+    snapshot = Snapshot(directory)
+    if snapshot.collection != collection or snapshot.version != version:
+        raise ValueError(f"{directory} holds version {snapshot.version} of '{snapshot.collection}'")
+    return snapshot
+
+
+def _array_literal(values):
+    return '{' + ','.join(map(str, values.tolist())) + '}'
+
+
+def restore_snapshot(conn, location, collection=None, keep=1, cache_dir=SNAPSHOT_CACHE_DIR):
+    """Bulk-load a snapshot into Postgres as a new active version of collection; returns the version.
+
+    The rows are written with COPY into a staged version, which then goes through the usual
+    blue-green cutover, so a restore into a live collection is as safe as a re-ingest.
+    """
+    directory = fetch_snapshot(location, cache_dir)
+    if directory is None:
+        raise FileNotFoundError(f"No complete snapshot at {location}")
+    snapshot = Snapshot(directory)
+    collection = validate_collection(collection or snapshot.collection)
+    uploaded_at = [value.isoformat(sep=' ') if value is not None else None for value in snapshot.metadata['uploaded_at']]
+
+    def write_chunks(cur, version):
+        for start in range(0, len(snapshot), RESTORE_BATCH_ROWS):
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in range(start, min(start + RESTORE_BATCH_ROWS, len(snapshot))):
+                writer.writerow([
+                    snapshot.chunks[row],
+                    _array_literal(snapshot.vectors[row]),
+                    _array_literal(snapshot.reduced_vectors[row]) if snapshot.reduced_vectors is not None else None,
+                    snapshot.metadata['document_key'][row],
+                    snapshot.metadata['file_type'][row],
+                    uploaded_at[row],
+                    collection,
+                    version
+                ])
+            buffer.seek(0)
+            cur.copy_expert("""
+                COPY embeddings (chunk, embedding, embedding_reduced, document_key, file_type, uploaded_at,
+                                 collection, index_version)
+                FROM STDIN WITH (FORMAT csv)
+            """, buffer)
+
+    version = build_index_version(
+        conn, collection, snapshot.vectorizer_type, snapshot.dimension, write_chunks,
+        snapshot.vectorizer, snapshot.projection, keep
+    )
+    logger.info(f"Restored {len(snapshot)} chunks from {location} as version {version} of '{collection}'")
+    return version
+
+
+def connect():
+    """Connection using the same .env settings as the app."""
+    import psycopg2
+    from dotenv import load_dotenv
+    load_dotenv()
+    return psycopg2.connect(
+        host=os.getenv('POSTGRES_HOST'),
+        port=os.getenv('POSTGRES_PORT'),
+        dbname=os.getenv('POSTGRES_DB'),
+        user=os.getenv('POSTGRES_USER'),
+        password=os.getenv('POSTGRES_PASSWORD')
+    )
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="RAG-DocuMind index snapshots")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Write the active index of a collection to a snapshot")
+    export_parser.add_argument('--collection', default=DEFAULT_COLLECTION)
+    export_parser.add_argument('--vectorizer-type', choices=list(VECTOR_SPACES), default='Mistral-Embed')
+    export_parser.add_argument('--to', dest='root', required=True, help="Directory or s3://bucket/prefix")
+
+    restore_parser = subparsers.add_parser('restore', help="Bulk-load a snapshot into Postgres as the active index")
+    restore_parser.add_argument('location', help="Snapshot directory or s3:// URI, e.g. s3://bucket/snapshots/default/v42")
+    restore_parser.add_argument('--collection', default=None, help="Target collection (default: the snapshot's)")
+    restore_parser.add_argument('--keep', type=int, default=int(os.getenv('INDEX_VERSIONS_RETAINED', '1')))
+
+    args = parser.parse_args()
+    conn = connect()
+    try:
+        if args.command == 'export':
+            print(export_snapshot(conn, validate_collection(args.collection), args.vectorizer_type, args.root))
+        elif args.command == 'restore':
+            print(f"Active version: {restore_snapshot(conn, args.location, args.collection, args.keep)}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
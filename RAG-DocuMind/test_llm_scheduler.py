@@ -0,0 +1,113 @@
+import threading
+import time
+
+from llm_scheduler import BACKGROUND, BATCH, INTERACTIVE, RequestScheduler
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+class Caller:
+    """Threads that take a scheduler slot, recording the order they were admitted in."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.admitted = []
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def queue(self, name, priority, session=None):
+        """Start a caller and return once it is waiting in the queue."""
+        queued = self.scheduler.metrics()[priority]['queued']
+
+        def run():
+            with self.scheduler.slot(priority, session):
+                with self.lock:
+                    self.admitted.append(name)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.threads.append(thread)
+        wait_until(lambda: self.scheduler.metrics()[priority]['queued'] == queued + 1)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join(2)
+        return self.admitted
+
+
+def hold_slot(scheduler, priority=INTERACTIVE):
+    """Occupy one slot until the returned event is set."""
+    release = threading.Event()
+    held = threading.Event()
+
+    def run():
+        with scheduler.slot(priority, "holder"):
+            held.set()
+            release.wait(2)
+
+    threading.Thread(target=run).start()
+    held.wait(2)
+    return release
+
+
+def test_interactive_requests_go_before_queued_background_work():
+    scheduler = RequestScheduler(max_concurrency=1)
+    release = hold_slot(scheduler)
+    caller = Caller(scheduler)
+    caller.queue("background-1", BACKGROUND)
+    caller.queue("batch-1", BATCH)
+    caller.queue("background-2", BACKGROUND)
+    caller.queue("interactive-1", INTERACTIVE)
+
+    release.set()
+    assert caller.join() == ["interactive-1", "batch-1", "background-1", "background-2"]
+
+
+def test_class_limit_keeps_a_slot_free_for_interactive_requests():
+    scheduler = RequestScheduler(max_concurrency=2, class_limits={BACKGROUND: 1})
+    release = hold_slot(scheduler, BACKGROUND)
+    caller = Caller(scheduler)
+    # A second slot is free, but background work is capped at one
+    caller.queue("background", BACKGROUND)
+    assert scheduler.metrics()[BACKGROUND]['in_flight'] == 1
+
+    interactive = threading.Thread(target=scheduler.run, args=(lambda: None,))
+    interactive.start()
+    interactive.join(2)
+    assert not interactive.is_alive()
+    assert caller.admitted == []
+
+    release.set()
+    assert caller.join() == ["background"]
+
+
+def test_sessions_share_a_class_fairly():
+    scheduler = RequestScheduler(max_concurrency=1)
+    release = hold_slot(scheduler)
+    caller = Caller(scheduler)
+    # A queues a burst before B's first request; B is still served every other turn
+    for i in range(4):
+        caller.queue(f"a{i}", BATCH, session="a")
+    for i in range(2):
+        caller.queue(f"b{i}", BATCH, session="b")
+
+    release.set()
+    assert caller.join() == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+
+def test_weights_scale_a_sessions_share():
+    scheduler = RequestScheduler(max_concurrency=1, weights={"a": 2})
+    release = hold_slot(scheduler)
+    caller = Caller(scheduler)
+    for i in range(4):
+        caller.queue(f"a{i}", BATCH, session="a")
+    for i in range(2):
+        caller.queue(f"b{i}", BATCH, session="b")
+
+    release.set()
+    assert caller.join() == ["a0", "b0", "a1", "a2", "b1", "a3"]
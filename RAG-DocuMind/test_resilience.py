@@ -0,0 +1,37 @@
+import time
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError
+
+
+def fail():
+    raise RuntimeError("upstream down")
+
+
+def test_circuit_recovers_through_half_open_probe():
+    breaker = CircuitBreaker("endpoint", failure_threshold=2, reset_seconds=0.05)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            breaker.call(fail)
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "ok")
+
+    time.sleep(0.06)
+    # After the cool-down callers gating on is_open go ahead, and their call is the probe
+    assert not breaker.is_open
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert not breaker.is_open
+
+
+def test_failed_probe_reopens_circuit():
+    breaker = CircuitBreaker("endpoint", failure_threshold=1, reset_seconds=0.05)
+    with pytest.raises(RuntimeError):
+        breaker.call(fail)
+    time.sleep(0.06)
+    with pytest.raises(RuntimeError):
+        breaker.call(fail)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_open
@@ -0,0 +1,26 @@
+from pathlib import Path
+
+import pytest
+
+# Modules maintained here and copied verbatim into the other apps; edit them here and copy them over.
+# Their tests live in this directory and cover every copy as long as the copies stay identical.
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent
+SHARED_MODULES = {
+    'AI-SummarizeClassifyPredict': [
+        'corpus_collections.py', 'corpus_events.py', 'extractors.py', 'llm_scheduler.py', 'projection.py',
+        'resilience.py', 's3_inventory.py', 'single_flight.py', 'text_cache.py', 'uploads.py',
+        'vector_index.py', 'warmup.py',
+    ],
+    'ConversationalAI_Assistant_Using_Chainlit': ['extractors.py'],
+}
+
+
+@pytest.mark.parametrize('app, module', [
+    (app, module) for app, modules in SHARED_MODULES.items() for module in modules
+])
+def test_copy_matches_rag_documind(app, module):
+    copy = ROOT / app / module
+    assert copy.read_bytes() == (HERE / module).read_bytes(), (
+        f"{app}/{module} differs from RAG-DocuMind/{module}; change the RAG-DocuMind copy and copy it over"
+    )
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+from llm_scheduler import BACKGROUND, INTERACTIVE
+from single_flight import SingleFlight, request_fingerprint
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def start_followers(flight, key, count):
+    """Start callers for key that coalesce onto the call in flight; returns their outcomes and threads."""
+    outcomes = []
+    coalesced = flight.coalesced
+
+    def follow():
+        try:
+            outcomes.append(flight.do(key, lambda: pytest.fail("followers must not call fn")))
+        except Exception as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=follow) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: flight.coalesced == coalesced + count)
+    return outcomes, threads
+
+
+def start_leader(flight, key, outcome):
+    """Start a caller whose fn blocks until the returned event is set, then returns or raises outcome."""
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(key)
+        release.wait(2)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def lead():
+        try:
+            flight.do(key, fn)
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=lead)
+    thread.start()
+    wait_until(lambda: calls)
+    return release, calls, thread
+
+
+def test_overlapping_identical_calls_share_one_upstream_call():
+    flight = SingleFlight()
+    key = request_fingerprint("embeddings", {"input": ["a"]}, INTERACTIVE)
+    release, calls, leader = start_leader(flight, key, "result")
+    outcomes, followers = start_followers(flight, key, 3)
+
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(2)
+    assert calls == [key]
+    assert outcomes == ["result"] * 3
+    assert flight.metrics() == {'executed': 1, 'coalesced': 3, 'in_flight': 0, 'coalesced_ratio': 0.75}
+
+
+def test_followers_receive_the_leaders_exception():
+    flight = SingleFlight()
+    error = RuntimeError("upstream down")
+    release, _, leader = start_leader(flight, "key", error)
+    outcomes, followers = start_followers(flight, "key", 2)
+
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(2)
+    assert outcomes == [error, error]
+
+
+def test_calls_after_completion_run_again():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+    assert flight.metrics()['executed'] == 2
+
+
+def test_same_request_at_another_priority_is_not_coalesced():
+    flight = SingleFlight()
+    data = {"model": "mistral-embed", "input": ["a"]}
+    background = request_fingerprint("embeddings", data, BACKGROUND)
+    interactive = request_fingerprint("embeddings", data, INTERACTIVE)
+    assert background != interactive
+    assert request_fingerprint("embeddings", dict(reversed(list(data.items()))), INTERACTIVE) == interactive
+
+    # An interactive caller never waits on a background call still queued for its slot
+    release, _, leader = start_leader(flight, background, "background result")
+    assert flight.do(interactive, lambda: "interactive result") == "interactive result"
+    assert flight.metrics()['coalesced'] == 0
+
+    release.set()
+    leader.join(2)
@@ -0,0 +1,92 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from vector_index import VectorIndex
+
+
+def clustered_corpus(n_rows=600, dimension=64, n_clusters=12, seed=7):
+    """Rows around a few centres, so each query has a clear set of nearest neighbours."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(n_clusters, dimension))
+    vectors = centres[np.arange(n_rows) % n_clusters] + 0.3 * rng.normal(size=(n_rows, dimension))
+    queries = centres[:4] + 0.1 * rng.normal(size=(4, dimension))
+    return vectors.astype(np.float32), queries.astype(np.float32)
+
+
+def make_index(vectors, mode='none', metadata=None):
+    return VectorIndex(np.arange(len(vectors)), [f"chunk {i}" for i in range(len(vectors))], vectors,
+                       mode=mode, metadata=metadata)
+
+
+@pytest.mark.parametrize('mode', ['int8', 'binary'])
+def test_quantized_search_matches_float32_after_rescoring(mode):
+    vectors, queries = clustered_corpus()
+    expected = make_index(vectors).search(queries, top_k=5)
+    results = make_index(vectors, mode=mode).search(queries, top_k=5)
+
+    for found, exact in zip(results, expected):
+        assert [row for row, _ in found] == [row for row, _ in exact]
+        # Rescored similarities are the float32 ones, not the quantized estimates
+        np.testing.assert_allclose([score for _, score in found], [score for _, score in exact], rtol=1e-5)
+
+
+def test_filtered_search_returns_only_matching_rows():
+    vectors, queries = clustered_corpus()
+    n_rows = len(vectors)
+    metadata = {
+        'document_key': [f"doc-{i % 5}" for i in range(n_rows)],
+        'file_type': ['pdf' if i % 2 else 'txt' for i in range(n_rows)],
+        'collection': ['default'] * n_rows,
+        'uploaded_at': [datetime(2024, 1, 1 + i % 28) for i in range(n_rows)],
+    }
+    filters = {
+        'document_keys': ['doc-1', 'doc-3'],
+        'file_types': ['pdf'],
+        'uploaded_after': datetime(2024, 1, 10),
+        'uploaded_before': datetime(2024, 1, 20),
+    }
+
+    for mode in ('none', 'int8', 'binary'):
+        index = make_index(vectors, mode=mode, metadata=metadata)
+        rows = index.filter_rows(filters)
+        expected = [
+            row for row in range(n_rows)
+            if metadata['document_key'][row] in filters['document_keys']
+            and metadata['file_type'][row] == 'pdf'
+            and filters['uploaded_after'] <= metadata['uploaded_at'][row] <= filters['uploaded_before']
+        ]
+        assert rows.tolist() == expected
+
+        for result in index.search(queries, top_k=10, rows=rows):
+            assert result
+            assert {row for row, _ in result} <= set(expected)
+
+
+def test_filter_without_matches_returns_no_results():
+    vectors, queries = clustered_corpus()
+    index = make_index(vectors, metadata={'file_type': ['pdf'] * len(vectors)})
+    rows = index.filter_rows({'file_types': ['docx']})
+    assert len(rows) == 0
+    assert index.search(queries, top_k=5, rows=rows) == [[] for _ in queries]
+
+
+def test_mmr_with_lambda_one_is_similarity_order():
+    vectors, queries = clustered_corpus()
+    index = make_index(vectors)
+    for diverse, plain in zip(index.search_diverse(queries, top_k=5, lambda_mult=1.0), index.search(queries, top_k=5)):
+        assert [row for row, _ in diverse] == [row for row, _ in plain]
+        np.testing.assert_allclose([score for _, score in diverse], [score for _, score in plain], rtol=1e-5)
+
+
+def test_mmr_with_low_lambda_skips_near_duplicates():
+    # Three copies of the best match and one distinct, slightly less relevant row
+    vectors = np.array([[1, 0.1, 0], [1, 0.1, 0], [1, 0.1, 0], [0.8, -0.6, 0], [0, 0, 1]], dtype=np.float32)
+    index = make_index(vectors)
+    query = np.array([[1, 0, 0]], dtype=np.float32)
+
+    plain = [row for row, _ in index.search(query, top_k=2)[0]]
+    diverse = [row for row, _ in index.search_diverse(query, top_k=2, lambda_mult=0.3, candidate_factor=2)[0]]
+    assert set(plain) <= {0, 1, 2}
+    assert diverse[0] in {0, 1, 2} and diverse[1] == 3
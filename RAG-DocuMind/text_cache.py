@@ -0,0 +1,112 @@
+# Extracted-text cache
+# Stores the text pulled out of each document, with per-page offsets, keyed by S3 key + ETag.
+# Entries are gzip-compressed JSON files in a local directory, evicted least-recently-used
+# once the directory grows past max_bytes.
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def join_pages(pages):
+    """Join page texts the way the extractors do and return (text, page start offsets)."""
+    offsets = []
+    parts = []
+    position = 0
+    for page in pages:
+        offsets.append(position)
+        parts.append(page + "\n")
+        position += len(page) + 1
+    return "".join(parts), offsets
+
+
+class ExtractedTextCache:
+    """Size-bounded on-disk cache of extracted document text."""
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key, etag):
+        digest = hashlib.sha256(f"{key}\0{etag}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json.gz")
+
+    def _entries(self):
+        """Yield (path, size, last_used) for every cached entry."""
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.json.gz'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def get(self, key, etag):
+        """Return (text, page_offsets) for this object version, or None if not cached."""
+        if not etag:
+            return None
+        path = self._path(key, etag)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable text cache entry for {key}: {str(e)}")
+            self._remove(path)
+            return None
+        logger.info(f"Text cache hit for {key} ({etag})")
+        return entry['text'], entry['page_offsets']
+
+    def put(self, key, etag, text, page_offsets):
+        """Store extracted text for this object version and evict old entries if over budget."""
+        if not etag or text is None:
+            return
+        path = self._path(key, etag)
+        payload = json.dumps({'key': key, 'etag': etag, 'text': text, 'page_offsets': page_offsets})
+        data = gzip.compress(payload.encode('utf-8'))
+        if len(data) > self.max_bytes:
+            return
+
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._total_bytes += len(data) - previous
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove least-recently-used entries until the cache fits in max_bytes."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._total_bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total_bytes -= size
+            logger.info(f"Evicted text cache entry {os.path.basename(path)}")
+
+    def _remove(self, path):
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self._total_bytes -= size
+            except FileNotFoundError:
+                pass
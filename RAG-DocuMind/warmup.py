@@ -0,0 +1,98 @@
+# Warm-start preloading
+# Loading a collection's index (unpickling the vectorizer, reading every embedding from Postgres and
+# building the arrays) takes long enough on a large corpus that the first query after a deploy
+# stalls. A Warmup runs those loads once per process on a background thread, records how long each
+# took, and reports ready when they are done. A failed load is logged and doesn't block readiness;
+# that index is then loaded by the first query that needs it, as before.
+#
+# serve_readiness exposes the state as GET /ready for deployments whose own health check (such as
+# Streamlit's /_stcore/health) reports ready before the indexes are loaded.
+
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """Runs named load tasks in the background; plan() returns [(name, fn)] and runs on the thread too."""
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.tasks = []
+        self.seconds = None
+        self.error = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="index-warmup", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    @property
+    def ready(self):
+        return self.done.is_set()
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def _run(self):
+        started = time.perf_counter()
+        try:
+            for name, fn in self.plan():
+                task_started = time.perf_counter()
+                task = {'name': name, 'seconds': None, 'result': None, 'error': None}
+                try:
+                    task['result'] = fn()
+                except Exception as e:
+                    task['error'] = str(e)
+                    logger.warning(f"Warm-up of {name} failed: {str(e)}")
+                task['seconds'] = time.perf_counter() - task_started
+                with self.lock:
+                    self.tasks.append(task)
+        except Exception as e:
+            self.error = str(e)
+            logger.warning(f"Warm-up failed: {str(e)}")
+        finally:
+            self.seconds = time.perf_counter() - started
+            self.done.set()
+            logger.info(f"Warm-up finished in {self.seconds:.1f}s ({len(self.tasks)} indexes)")
+
+    def status(self):
+        with self.lock:
+            return {
+                'ready': self.ready,
+                'seconds': self.seconds,
+                'error': self.error,
+                'tasks': [dict(task) for task in self.tasks]
+            }
+
+
+def serve_readiness(warmup, port, host='0.0.0.0'):
+    """Serves GET /ready on a daemon thread: 503 until warmup is done, then 200; the body is warmup.status()."""
+    class ReadinessHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') != '/ready':
+                self.send_error(404)
+                return
+            status = warmup.status()
+            body = json.dumps(status).encode()
+            self.send_response(200 if status['ready'] else 503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Probes arrive every few seconds; keep them out of the app log
+            pass
+
+    server = ThreadingHTTPServer((host, port), ReadinessHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="warmup-readiness", daemon=True).start()
+    logger.info(f"Readiness probe listening on {host}:{server.server_port}/ready")
+    return server